@@ -0,0 +1,233 @@
+"""
+流水线基准测试（使用本地替身 Client，不消耗 API 配额）
+测量 Step 1 / Step 2 / 解析 / 可视化在不同输入规模下的吞吐（条/秒）与 p50 / p95 / p99 延迟，
+用于发现流水线自身（而非模型）的性能回退。
+
+用法：
+    python benchmarks/bench_pipeline.py                                  # 默认 10 / 1k / 100k
+    python benchmarks/bench_pipeline.py --sizes 10,1000 --latency lognormal:0.05,0.5 --error-rate 0.02
+    python benchmarks/bench_pipeline.py --save out/bench_baseline.json
+    python benchmarks/bench_pipeline.py --compare out/bench_baseline.json --tolerance 0.2
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+from tools.fake_client import FakeGeminiClient
+from tools.call_layer import ModelCaller
+from tools.json_stream import JsonArrayStream
+from tools.metrics import RunMetrics
+from tools.visualization import render_batch
+from run_step1_vision import VisionAnalyzer, list_image_files, IMAGE_DIR, MAX_WORKERS
+from run_step2_plan import MissionPlanner
+
+STAGES = ["step1", "step2", "parse", "stream_parse", "render"]
+DEFAULT_SIZES = "10,1000,100000"
+# 可视化每条需要数十毫秒，默认只跑到该规模
+DEFAULT_RENDER_MAX = 1000
+# 流式解析的分片长度（字符）
+STREAM_CHUNK_CHARS = 64
+
+
+@contextlib.contextmanager
+def quiet():
+    """基准运行期间屏蔽流水线的逐条打印（print 本身会显著影响大规模吞吐）"""
+    with open(os.devnull, "w", encoding="utf-8") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def timed(fn, latencies):
+    """包装函数，记录每次调用的耗时"""
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - start)
+    return wrapper
+
+
+def make_client(args):
+    return FakeGeminiClient(latency=args.latency, upload_latency=args.upload_latency,
+                            error_rate=args.error_rate, seed=args.seed)
+
+
+def make_call_layer():
+    # 退避基准时间缩短，注入错误时重试等待不主导测量结果
+    return ModelCaller(base_delay=0.01, max_delay=0.1)
+
+
+def bench_step1(args, n):
+    client = make_client(args)
+    vision = VisionAnalyzer(client, call_layer=make_call_layer())
+    latencies = []
+    vision.analyze_scene = timed(vision.analyze_scene, latencies)
+    paths = [f"bench_{i:06d}.jpg" for i in range(n)]
+    start = time.perf_counter()
+    empty = sum(1 for _, zones in vision.iter_analyze(paths, max_workers=args.workers) if not zones)
+    return time.perf_counter() - start, latencies, {"empty": empty}
+
+
+def bench_step2(args, n):
+    client = make_client(args)
+    planner = MissionPlanner(client, call_layer=make_call_layer())
+    scenes = client.recorded_scenes()
+    latencies = []
+    generate = timed(planner.generate_mission_code, latencies)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.planner_workers) as executor:
+        codes = list(executor.map(lambda i: generate(scenes[i % len(scenes)]), range(n)))
+    return time.perf_counter() - start, latencies, {"empty": sum(1 for code in codes if not code)}
+
+
+def _recorded_texts(client):
+    return [json.dumps(zones, ensure_ascii=False, indent=2) for zones in client.recorded_scenes()]
+
+
+def bench_parse(args, n):
+    client = make_client(args)
+    vision = VisionAnalyzer(client)
+    texts = ["```json\n" + text + "\n```" for text in _recorded_texts(client)]
+    latencies = []
+    parse = timed(vision._parse_json_response, latencies)
+    start = time.perf_counter()
+    for i in range(n):
+        parse(texts[i % len(texts)])
+    return time.perf_counter() - start, latencies, {}
+
+
+def bench_stream_parse(args, n):
+    client = make_client(args)
+    chunked = [[text[i:i + STREAM_CHUNK_CHARS] for i in range(0, len(text), STREAM_CHUNK_CHARS)]
+               for text in _recorded_texts(client)]
+
+    def parse(chunks):
+        parser = JsonArrayStream()
+        for chunk in chunks:
+            parser.feed(chunk)
+        return parser.items
+
+    latencies = []
+    parse = timed(parse, latencies)
+    start = time.perf_counter()
+    for i in range(n):
+        parse(chunked[i % len(chunked)])
+    return time.perf_counter() - start, latencies, {}
+
+
+def bench_render(args, n):
+    client = make_client(args)
+    images = list_image_files(IMAGE_DIR)
+    items = [(client.zones_for(os.path.basename(images[i % len(images)])), images[i % len(images)])
+             for i in range(n)]
+    output_dir = tempfile.mkdtemp(prefix="bench_render_")
+    metrics = RunMetrics("bench")
+    try:
+        start = time.perf_counter()
+        render_batch(items, metrics=metrics, backend="pillow", output_dir=output_dir, max_size=args.render_size)
+        elapsed = time.perf_counter() - start
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+    return elapsed, metrics.stages.get("render", []), {}
+
+
+BENCHES = {
+    "step1": bench_step1,
+    "step2": bench_step2,
+    "parse": bench_parse,
+    "stream_parse": bench_stream_parse,
+    "render": bench_render,
+}
+
+
+def summarize(elapsed, latencies, n, extra):
+    ms = np.asarray(latencies, dtype=float) * 1000.0
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99]) if len(ms) else (0.0, 0.0, 0.0)
+    return {"items": n, "seconds": round(elapsed, 4), "throughput": round(n / elapsed, 2) if elapsed else None,
+            "p50_ms": round(float(p50), 3), "p95_ms": round(float(p95), 3), "p99_ms": round(float(p99), 3), **extra}
+
+
+def compare(results, baseline, tolerance):
+    """与基线比较：吞吐下降或 p95 上升超过 tolerance 视为回退，返回回退描述列表"""
+    regressions = []
+    for key, result in results.items():
+        base = baseline.get(key)
+        if not base or not base.get("throughput") or not result.get("throughput"):
+            continue
+        if result["throughput"] < base["throughput"] * (1 - tolerance):
+            regressions.append(f"{key}: 吞吐 {base['throughput']} -> {result['throughput']} 条/秒")
+        if base["p95_ms"] and result["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{key}: p95 {base['p95_ms']} -> {result['p95_ms']} ms")
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="流水线基准测试（本地替身 Client）")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help=f"输入规模，逗号分隔（默认 {DEFAULT_SIZES}）")
+    parser.add_argument("--stages", default=",".join(STAGES), help=f"测试阶段，逗号分隔（默认全部: {','.join(STAGES)}）")
+    parser.add_argument("--latency", default=None,
+                        help="替身模型请求耗时分布/秒（默认无延迟，只测流水线开销），如 lognormal:0.05,0.5")
+    parser.add_argument("--upload-latency", default=None, help="替身上传耗时分布/秒")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="替身请求返回 429/503 的概率")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS, help=f"Step 1 并发数（默认 {MAX_WORKERS}）")
+    parser.add_argument("--planner-workers", type=int, default=1, help="Step 2 并发数（默认 1，与 run_step2_plan.py 一致）")
+    parser.add_argument("--render-max", type=int, default=DEFAULT_RENDER_MAX,
+                        help=f"可视化只测试不超过该值的规模（默认 {DEFAULT_RENDER_MAX}）")
+    parser.add_argument("--render-size", type=int, default=320, help="可视化输出最长边像素（默认 320）")
+    parser.add_argument("--save", default=None, help="把结果保存为 JSON（可作为 --compare 的基线）")
+    parser.add_argument("--compare", default=None, help="与基线 JSON 比较，出现回退时以退出码 1 结束")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="回退判定的相对容差（默认 0.2）")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    sizes = [int(size) for size in args.sizes.split(",") if size]
+    stages = [stage for stage in args.stages.split(",") if stage]
+
+    results = {}
+    print(f"{'stage':<13}{'items':>9}{'seconds':>10}{'items/s':>12}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for stage in stages:
+        for n in sizes:
+            if stage == "render" and n > args.render_max:
+                print(f"{stage:<13}{n:>9}   跳过（超过 --render-max {args.render_max}）")
+                continue
+            with quiet():
+                elapsed, latencies, extra = BENCHES[stage](args, n)
+            result = results[f"{stage}/{n}"] = summarize(elapsed, latencies, n, extra)
+            print(f"{stage:<13}{n:>9}{result['seconds']:>10.2f}{result['throughput']:>12.1f}"
+                  f"{result['p50_ms']:>10.2f}{result['p95_ms']:>10.2f}{result['p99_ms']:>10.2f}")
+
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": results}, f, ensure_ascii=False, indent=4)
+        print(f"💾 [Bench] 结果已保存至: {args.save}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f).get("results", {})
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("❌ [Bench] 检测到性能回退:")
+            for line in regressions:
+                print(f"   {line}")
+            return 1
+        print(f"✅ [Bench] 与基线相比无回退（容差 {args.tolerance:.0%}）")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
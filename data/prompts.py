@@ -64,4 +64,25 @@ JSON 列表格式如下：
   },
   ...
 ]
-"""
\ No newline at end of file
+"""
+# ==========================================
+# 多图批量请求的附加说明
+# 一次请求上传多张图像，每张图像前有一行 "图像名称: xxx.jpg" 的标注
+# ==========================================
+batch_task_prompt_json = task_prompt_json + """
+====================================
+【批量模式（覆盖上文的输出格式）】
+====================================
+本次请求包含**多张**航拍图像，每张图像之前都有一行 “图像名称: <文件名>” 的文字标注。
+请对**每一张图像独立**执行上述全部任务（各图像之间互不参考、坐标互不混用）。
+
+输出必须是一个 **JSON 对象**（不是列表）：
+- key：图像名称（与标注中的文件名完全一致，不能遗漏任何一张）
+- value：该图像的 zone 列表（格式与上文的 JSON 列表完全相同）
+
+示例：
+{
+  "0001.jpg": [ { "id": "zone_0", ... }, ... ],
+  "0002.jpg": [ { "id": "zone_0", ... }, ... ]
+}
+"""
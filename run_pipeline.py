@@ -0,0 +1,341 @@
+"""
+Step 1 → Step 2 流式融合管线
+视觉分析结果一到达即送入任务规划（生产者/消费者队列），无需等待整批图片分析完成。
+每条结果完成后追加写入日志（zones_data.jsonl / missions_plan.jsonl），结束（或中断）时压缩一次为
+zones_data.json / missions_plan.json，单条结果的写入开销与已完成数量无关。
+流式模式下，High 区域在视觉响应结束前即写入 high_zones.jsonl，供下游提前调度。
+"""
+import os
+import time
+import queue
+import argparse
+import threading
+
+from tools.utils import add_client_arguments, create_client, isolate_path
+from tools.response_cache import ResponseCache
+from tools.preprocess import ImagePreprocessor, DEFAULT_MAX_SIDE, DEFAULT_QUALITY
+from tools.upload_cache import UploadCache
+from tools.context_cache import ContextCache
+from tools.storage import ResultJournal, journal_path_for, load_json, compact_results
+from run_step1_vision import (
+    VisionAnalyzer, list_image_files, IMAGE_DIR, OUTPUT_JSON, UPLOAD_CACHE_JSON,
+    RESPONSE_CACHE_DIR, PREPROCESS_DIR, FRAMES_DIR, MAX_WORKERS, REQUESTS_PER_MINUTE, MODEL_NAME, BATCH_SIZE,
+)
+from run_step2_plan import MissionPlanner, format_mission_code, OUTPUT_CODE_JSON, OUTPUT_DIR
+from tools.generate import ZONE_FORMATS, DEFAULT_ZONE_FORMAT, DEFAULT_COORD_PRECISION
+from tools.planner import LocalMissionPlanner
+from tools.frame_source import add_frame_source_arguments, frames_from_args
+from tools.call_layer import add_call_arguments, create_call_layer
+from tools.fleet import FleetRegistry, add_fleet_arguments
+from tools.archive import add_archive_arguments, archive_results, ARCHIVE_DB
+from tools.prescreen import add_prescreen_arguments, create_prescreener
+from tools.metrics import RunMetrics, profile_run
+
+# 同时进行的任务规划请求数（消费者线程数）
+PLANNER_WORKERS = 2
+
+# 流式模式下提前到达的 High 区域日志
+HIGH_ZONES_JSONL = os.path.join(OUTPUT_DIR, "high_zones.jsonl")
+
+# 运行指标与性能分析输出
+METRICS_JSON = os.path.join(OUTPUT_DIR, "metrics_pipeline.json")
+METRICS_PROM = os.path.join(OUTPUT_DIR, "metrics_pipeline.prom")
+PROFILE_PATH = os.path.join(OUTPUT_DIR, "profile_pipeline.prof")
+
+
+class StreamingPipeline:
+    def __init__(self, vision_system, planner, zones_path=OUTPUT_JSON, missions_path=OUTPUT_CODE_JSON,
+                 planner_workers=PLANNER_WORKERS, high_zones_path=HIGH_ZONES_JSONL):
+        """
+        初始化流式管线
+        :param vision_system: VisionAnalyzer 实例（生产者）
+        :param planner: MissionPlanner 实例（消费者）
+        :param zones_path: zones 输出文件路径
+        :param missions_path: 任务代码输出文件路径
+        :param planner_workers: 消费者线程数
+        :param high_zones_path: 流式模式下提前到达的 High 区域日志路径
+        """
+        self.vision_system = vision_system
+        self.planner = planner
+        self.zones_path = zones_path
+        self.missions_path = missions_path
+        self.planner_workers = planner_workers
+
+        self.zones_results = {}
+        self.mission_results = {}
+        self.zones_journal = ResultJournal(journal_path_for(zones_path))
+        self.missions_journal = ResultJournal(journal_path_for(missions_path))
+        self.high_zones_journal = ResultJournal(high_zones_path)
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._start_time = None
+        self.first_mission_latency = None
+        self.first_high_zone_latency = None
+        self.total_time = None
+        # 已读取的输入路径（按扫描顺序，输入为生成器时逐个追加）
+        self.scanned_paths = []
+
+    def _elapsed(self):
+        return time.monotonic() - self._start_time
+
+    def _consume(self):
+        """消费者：从队列取出区域数据并生成任务指令"""
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+
+            file_name, zones = item
+            code = self.planner.generate_mission_code(zones, scene=file_name)
+            with self._lock:
+                self.mission_results[file_name] = format_mission_code(code) if code else None
+                self.missions_journal.append(file_name, self.mission_results[file_name])
+
+                if code and self.first_mission_latency is None:
+                    self.first_mission_latency = self._elapsed()
+                    print(f"   🚀 首个任务已生成: {file_name} (耗时 {self.first_mission_latency:.1f}s)")
+
+            status = "✅ 指令生成成功" if code else "❌ 指令生成失败"
+            print(f"   [{self._elapsed():.1f}s] {file_name}: {status}")
+
+    def on_zone(self, image_path, zone):
+        """流式回调：含火点的 High 区域一闭合即写入日志，不等待整个视觉响应结束"""
+        if zone.get("risk_level") != "High" or not zone.get("fire_points"):
+            return
+        file_name = os.path.basename(image_path)
+        with self._lock:
+            self.high_zones_journal.append(f"{file_name}/{zone.get('id')}", zone)
+            if self.first_high_zone_latency is None:
+                self.first_high_zone_latency = self._elapsed()
+                print(f"   🔥 首个高危区域已到达: {file_name} {zone.get('id')} (耗时 {self.first_high_zone_latency:.1f}s)")
+
+    def _drain_queue(self):
+        """丢弃队列中尚未开始规划的场景，返回丢弃的数量"""
+        dropped = 0
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return dropped
+            if item is not None:
+                dropped += 1
+
+    def _load_previous(self, resume):
+        """续跑时从日志与已有输出恢复结果，否则清空日志"""
+        if not resume:
+            self.zones_journal.reset()
+            self.missions_journal.reset()
+            self.high_zones_journal.reset()
+            return
+        self.zones_results = load_json(self.zones_path, default={}) or {}
+        self.zones_results.update(self.zones_journal.load())
+        self.mission_results = load_json(self.missions_path, default={}) or {}
+        self.mission_results.update(self.missions_journal.load())
+
+    def run(self, image_paths, max_workers=MAX_WORKERS, preprocessor=None, resume=False, batch_size=BATCH_SIZE):
+        """
+        运行管线，返回 (zones_results, mission_results)
+        :param image_paths: 图片路径列表，或按需产出路径的生成器（视频帧筛选时边筛选边分析）
+        """
+        self._start_time = time.monotonic()
+        self._load_previous(resume)
+        self.scanned_paths = []
+
+        def iter_pending():
+            # 续跑：已有任务代码的跳过；已有 zones 但无任务代码的直接送入规划队列
+            for path in image_paths:
+                self.scanned_paths.append(path)
+                file_name = os.path.basename(path)
+                if self.mission_results.get(file_name):
+                    continue
+                if self.zones_results.get(file_name):
+                    self._queue.put((file_name, self.zones_results[file_name]))
+                    continue
+                yield path
+
+        total = "?"
+        if isinstance(image_paths, list):
+            names = [os.path.basename(p) for p in image_paths if not self.mission_results.get(os.path.basename(p))]
+            total = sum(1 for name in names if not self.zones_results.get(name))
+            if resume:
+                print(f"   [Resume] 待视觉分析 {total} 张，待规划 {len(names) - total} 个场景")
+
+        consumers = [threading.Thread(target=self._consume, daemon=True) for _ in range(self.planner_workers)]
+        for t in consumers:
+            t.start()
+
+        finished = False
+        try:
+            # 生产者：视觉分析结果按完成顺序入队
+            analyzed = self.vision_system.iter_analyze(iter_pending() if total == "?" else list(iter_pending()),
+                                                       max_workers=max_workers, preprocessor=preprocessor,
+                                                       batch_size=batch_size)
+            for index, (image_path, zones) in enumerate(analyzed):
+                file_name = os.path.basename(image_path)
+                print(f"\n--- 视觉完成 [{index+1}/{total}] ({self._elapsed():.1f}s): {file_name} ---")
+
+                with self._lock:
+                    self.zones_results[file_name] = zones or None
+                    self.zones_journal.append(file_name, self.zones_results[file_name])
+                    if not zones:
+                        self.mission_results[file_name] = None
+                        self.missions_journal.append(file_name, None)
+
+                if zones:
+                    print(f"   ✅ 获取到 {len(zones)} 个区域数据，送入规划队列")
+                    self._queue.put((file_name, zones))
+                else:
+                    print(f"   ❌ 分析失败或无数据")
+            finished = True
+        finally:
+            if not finished:
+                # 中断（Ctrl-C / 异常）：先清空队列再发停止信号，消费者只完成手头正在进行的规划请求；
+                # 被丢弃的场景 zones 已写入日志，--resume 时会重新送入规划
+                dropped = self._drain_queue()
+                if dropped:
+                    print(f"   [Pipeline] 已中断，丢弃 {dropped} 个待规划场景（--resume 可继续）")
+            for _ in consumers:
+                self._queue.put(None)
+            for t in consumers:
+                t.join()
+
+            # 压缩日志：按原始扫描顺序重写一次输出（中断时也写出已完成部分）
+            order = [os.path.basename(p) for p in self.scanned_paths]
+            self.zones_results = compact_results(self.zones_results, self.zones_path, order=order)
+            self.mission_results = compact_results(self.mission_results, self.missions_path, order=order)
+        self.total_time = self._elapsed()
+        return self.zones_results, self.mission_results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Step 1 → Step 2 流式管线（图片 -> zones -> 指令代码）")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="跳过响应缓存读取，强制重新请求模型（新结果仍会写入缓存）")
+    parser.add_argument("--preprocess", action="store_true",
+                        help="上传前缩放并重新编码图片（去除 EXIF）")
+    parser.add_argument("--max-side", type=int, default=DEFAULT_MAX_SIDE,
+                        help=f"预处理最长边像素上限（默认 {DEFAULT_MAX_SIDE}）")
+    parser.add_argument("--jpeg-quality", type=int, default=DEFAULT_QUALITY,
+                        help=f"预处理 JPEG 质量（默认 {DEFAULT_QUALITY}）")
+    parser.add_argument("--planner-workers", type=int, default=PLANNER_WORKERS,
+                        help=f"同时进行的任务规划请求数（默认 {PLANNER_WORKERS}）")
+    parser.add_argument("--resume", action="store_true",
+                        help="续跑：跳过已完成的图片/场景")
+    parser.add_argument("--no-context-cache", action="store_true",
+                        help="不把提示词前缀注册为服务端缓存上下文，每次请求完整发送")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE,
+                        help=f"每个视觉请求包含的图像数，>1 时启用多图批量请求（默认 {BATCH_SIZE}）")
+    parser.add_argument("--planner", choices=["llm", "local"], default="llm",
+                        help="规划后端：llm 调用大模型；local 使用本地确定性规划器")
+    parser.add_argument("--stream", action="store_true",
+                        help=f"视觉请求使用流式响应，High 区域一到达即写入 {os.path.basename(HIGH_ZONES_JSONL)}")
+    add_fleet_arguments(parser)
+    parser.add_argument("--zone-format", choices=ZONE_FORMATS, default=DEFAULT_ZONE_FORMAT,
+                        help="规划 Prompt 中区域数据的编码：compact 紧凑表格；json 原样序列化")
+    parser.add_argument("--coord-precision", type=int, default=DEFAULT_COORD_PRECISION,
+                        help=f"compact 编码的火点坐标小数位数（默认 {DEFAULT_COORD_PRECISION}）")
+    add_client_arguments(parser)
+    add_call_arguments(parser)
+    parser.add_argument("--fallback", choices=["none", "local"], default="none",
+                        help="规划请求失败或超过场景截止时间时的回退：local 使用本地确定性规划器")
+    parser.add_argument("--structured", action="store_true",
+                        help="视觉请求使用结构化输出（application/json + zone Schema）")
+    parser.add_argument("--profile", action="store_true",
+                        help=f"用 cProfile 包裹整次运行（主线程与工作线程合并统计，不含渲染 / 预处理进程），"
+                             f"保存至 out/{os.path.basename(PROFILE_PATH)} 并打印热点函数")
+    add_frame_source_arguments(parser)
+    add_prescreen_arguments(parser)
+    add_archive_arguments(parser)
+    args = parser.parse_args(argv)
+    if args.archive == ARCHIVE_DB:
+        args.archive = isolate_path(ARCHIVE_DB, args.client)
+    return args
+
+def run(args, metrics):
+    """运行流式管线（main 负责性能分析与指标导出）"""
+    # 1. 初始化
+    client = create_client(args)
+    # 替身 Client 的输出与缓存写入 out/fake/、cache/fake/，不覆盖被回放的记录
+    zones_path, missions_path = isolate_path(OUTPUT_JSON, args.client), isolate_path(OUTPUT_CODE_JSON, args.client)
+    high_zones_path = isolate_path(HIGH_ZONES_JSONL, args.client)
+    response_cache = ResponseCache(isolate_path(RESPONSE_CACHE_DIR, args.client), bypass=args.no_cache)
+    context_cache = None if args.no_context_cache else ContextCache(client, MODEL_NAME)
+    call_layer = create_call_layer(args)
+    vision_system = VisionAnalyzer(
+        client,
+        requests_per_minute=REQUESTS_PER_MINUTE,
+        upload_cache=UploadCache(isolate_path(UPLOAD_CACHE_JSON, args.client)),
+        response_cache=response_cache,
+        context_cache=context_cache,
+        stream=args.stream,
+        call_layer=call_layer,
+        scene_deadline=args.scene_deadline,
+        metrics=metrics,
+        structured=args.structured,
+        prescreener=create_prescreener(args),
+    )
+    registry = FleetRegistry.load(args.fleet)
+    fleet = registry.to_dicts() if args.fleet else None
+    if args.planner == "local":
+        planner = LocalMissionPlanner(fleet)
+    else:
+        planner = MissionPlanner(client, response_cache=response_cache, context_cache=context_cache,
+                                 call_layer=call_layer, scene_deadline=args.scene_deadline,
+                                 fallback_planner=LocalMissionPlanner(fleet) if args.fallback == "local" else None,
+                                 fleet_registry=registry if args.candidates > 0 else None,
+                                 candidates_k=args.candidates, zone_format=args.zone_format,
+                                 coord_precision=args.coord_precision, metrics=metrics)
+
+    # 2. 扫描图片（或从视频 / 帧目录中筛选画面变化的帧）
+    if args.source:
+        image_files = frames_from_args(args, FRAMES_DIR)
+        print(f"🔥 [Pipeline] 开始流式处理，边筛选帧边分析: {args.source}")
+    else:
+        image_files = list_image_files(IMAGE_DIR)
+        print(f"🔥 [Pipeline] 开始流式处理，共 {len(image_files)} 张图片")
+
+    preprocessor = None
+    if args.preprocess:
+        preprocessor = ImagePreprocessor(PREPROCESS_DIR, max_side=args.max_side, quality=args.jpeg_quality)
+
+    # 3. 运行管线
+    pipeline = StreamingPipeline(vision_system, planner, zones_path=zones_path, missions_path=missions_path,
+                                 planner_workers=args.planner_workers, high_zones_path=high_zones_path)
+    vision_system.on_zone = pipeline.on_zone
+    try:
+        pipeline.run(image_files, max_workers=MAX_WORKERS, preprocessor=preprocessor, resume=args.resume,
+                     batch_size=args.batch_size)
+    finally:
+        if preprocessor is not None:
+            preprocessor.close()
+
+    print(f"\n💾 [Pipeline 完成] 区域数据: {zones_path}")
+    print(f"💾 [Pipeline 完成] 任务代码: {missions_path}")
+    if args.archive:
+        archive_results(args.archive, pipeline.zones_results, pipeline.mission_results,
+                        {os.path.basename(p): p for p in pipeline.scanned_paths}, source=zones_path)
+    if pipeline.first_mission_latency is not None:
+        print(f"⏱️ 首个任务耗时: {pipeline.first_mission_latency:.1f}s，总耗时: {pipeline.total_time:.1f}s")
+    print(f"📊 [Calls] {call_layer.summary()}")
+    print(f"📊 [Parse] {metrics.parse_summary()}")
+    if args.prescreen:
+        print(f"📊 [Prescreen] {metrics.prescreen_summary()}")
+    if isinstance(planner, MissionPlanner):
+        print(f"📊 [Tokens] {planner.usage.summary()}")
+    if pipeline.first_high_zone_latency is not None:
+        print(f"⏱️ 首个高危区域耗时: {pipeline.first_high_zone_latency:.1f}s (日志: {high_zones_path})")
+
+def main(argv=None):
+    args = parse_args(argv)
+    metrics = RunMetrics("pipeline")
+    metrics_json, metrics_prom = isolate_path(METRICS_JSON, args.client), isolate_path(METRICS_PROM, args.client)
+    try:
+        with profile_run(isolate_path(PROFILE_PATH, args.client) if args.profile else None):
+            run(args, metrics)
+    finally:
+        metrics.export(metrics_json, metrics_prom)
+        print(f"📊 [Metrics] {metrics.summary()}")
+        print(f"📊 [Metrics] 运行报告: {metrics_json}，Prometheus: {metrics_prom}")
+
+if __name__ == "__main__":
+    main()
@@ -1,111 +1,791 @@
 import os
 import glob
 import json
+import time
+import threading
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
 from google.genai import types
 
-from tools.utils import setup_client
-from tools.visualization import visualize_segmentation_on_image
-from data.prompts import task_prompt_json
+from tools.utils import add_client_arguments, create_client, client_kind, isolate_path
+from tools.rate_limit import RateLimiter
+from tools.upload_cache import UploadCache, file_sha256
+from tools.response_cache import ResponseCache, make_cache_key
+from tools.context_cache import ContextCache
+from tools.preprocess import ImagePreprocessor, DEFAULT_MAX_SIDE, DEFAULT_QUALITY
+from tools.storage import ResultJournal, journal_path_for, load_json, compact_results
+from tools.visualization import BatchRenderer, render_batch, DEFAULT_MAX_SIZE
+from tools.bulk import create_bulk_backend, build_request, run_bulk_job, DEFAULT_POLL_INTERVAL
+from tools.json_stream import JsonArrayStream, parse_json_tolerant
+from tools.zone_schema import zone_list_schema, batch_zone_schema, structured_config
+from tools.frame_source import add_frame_source_arguments, frames_from_args
+from tools.tiling import add_tiling_arguments, iter_mosaics
+from tools.prescreen import add_prescreen_arguments, create_prescreener
+from tools.call_layer import ModelCaller, DeadlineExceeded, add_call_arguments, create_call_layer
+from tools.metrics import RunMetrics, profile_run
+from data.prompts import task_prompt_json, batch_task_prompt_json
 
 # 配置路径
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 IMAGE_DIR = os.path.join(BASE_DIR, "temp")      # 图片输入文件夹
 OUTPUT_DIR = os.path.join(BASE_DIR, "out")    # 结果输出文件夹
+CACHE_DIR = os.path.join(BASE_DIR, "cache")   # 本地缓存文件夹
 
 # 确保 output 文件夹存在
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
 # 定义输出文件路径
 OUTPUT_JSON = os.path.join(OUTPUT_DIR, "zones_data.json")
+UPLOAD_CACHE_JSON = os.path.join(CACHE_DIR, "uploads.json")
+RESPONSE_CACHE_DIR = os.path.join(CACHE_DIR, "responses")
+PREPROCESS_DIR = os.path.join(CACHE_DIR, "preprocessed")
+BULK_DIR = os.path.join(CACHE_DIR, "bulk")
+FRAMES_DIR = os.path.join(CACHE_DIR, "frames")
+TILES_DIR = os.path.join(CACHE_DIR, "tiles")
+METRICS_JSON = os.path.join(OUTPUT_DIR, "metrics_step1.json")
+METRICS_PROM = os.path.join(OUTPUT_DIR, "metrics_step1.prom")
+PROFILE_PATH = os.path.join(OUTPUT_DIR, "profile_step1.prof")
+
+# 模型配置
+MODEL_NAME = "gemini-3-pro-preview"
+
+# 并发配置
+MAX_WORKERS = 4                 # 同时进行的图像分析请求数
+REQUESTS_PER_MINUTE = 30        # 客户端限速（每分钟请求数），None 表示不限速
+BATCH_SIZE = 1                  # 每个请求包含的图像数（>1 时启用多图批量请求）
+
+
+class ZoneEmitter:
+    def __init__(self, image_path, on_zone):
+        """
+        单个流式请求的 zone 回调守卫（调用层的重试 / 超时下保证每个 zone 只回调一次）
+        - 只有当前这次尝试的回调会转发，超时被放弃的尝试在后台继续产出的 zone 被忽略
+        - 一旦有 zone 已经回调，后续重试不再发起新请求，直接返回已回调的部分结果
+        :param image_path: 图片路径
+        :param on_zone: 回调 on_zone(image_path, zone)
+        """
+        self.image_path = image_path
+        self.on_zone = on_zone
+        self.emitted = []
+        self._attempt = 0
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def begin(self):
+        """开始一次新的尝试，返回其编号；已有 zone 回调时返回 None（不应再发请求）"""
+        with self._lock:
+            if self.emitted:
+                return None
+            self._attempt += 1
+            return self._attempt
+
+    def emit(self, attempt, zone):
+        with self._lock:
+            if self._closed or attempt != self._attempt:
+                return
+            self.emitted.append(zone)
+        self.on_zone(self.image_path, zone)
+
+    def close(self):
+        """请求结束（成功、失败或放弃），之后的回调全部忽略"""
+        with self._lock:
+            self._closed = True
+
 
 class VisionAnalyzer:
-    def __init__(self, client):
+    def __init__(self, client, requests_per_minute=None, upload_cache=None, response_cache=None,
+                 model=MODEL_NAME, context_cache=None, stream=False, on_zone=None, call_layer=None,
+                 scene_deadline=None, metrics=None, structured=False, prescreener=None):
         """
         初始化视觉分析器
         :param client: 已初始化的 google.genai.Client 实例
+        :param requests_per_minute: 客户端限速（每分钟请求数），None 表示不限速
+        :param upload_cache: 可选的 UploadCache 实例，用于复用未过期的上传文件
+        :param response_cache: 可选的 ResponseCache 实例，相同图像 + 提示词 + 模型直接复用结果
+        :param model: 使用的模型名称
+        :param context_cache: 可选的 ContextCache 实例，把 task_prompt_json 注册为服务端缓存上下文
+        :param stream: 是否使用流式响应（单图请求），每个 zone 一闭合即回调 on_zone
+        :param on_zone: 可选回调 on_zone(image_path, zone)，流式模式下按到达顺序调用（可能来自工作线程）
+        :param call_layer: 可选的 ModelCaller 实例（超时 / 重试 / 对冲），默认使用默认参数创建
+        :param scene_deadline: 每个场景（含上传、重试、对冲）的总截止时长/秒，超过后返回空结果
+        :param metrics: 可选的 RunMetrics 实例（分阶段耗时 / token / 重试 / 解析失败）
+        :param structured: 结构化输出模式：以 JSON 响应类型 + zone Schema 约束模型输出
+        :param prescreener: 可选的 PreScreener，本地判定无火情的图像不调用模型，直接返回整图 Monitor 区域
         """
         self.client = client
+        # 替身 Client 的响应不与真实 Client 共用缓存 key
+        self.client_kind = client_kind(client)
+        self.model = model
+        self.context_cache = context_cache
         # 设置生成配置，温度设为0以保证JSON格式稳定
         self.config = types.GenerateContentConfig(temperature=0.0)
+        self.structured = structured
+        if structured:
+            self.config = structured_config(self.config, zone_list_schema())
+        self.rate_limiter = RateLimiter(requests_per_minute)
+        self.upload_cache = upload_cache
+        self.response_cache = response_cache
+        self.stream = stream
+        self.on_zone = on_zone
+        self.call_layer = call_layer or ModelCaller()
+        self.scene_deadline = scene_deadline
+        self.metrics = metrics or RunMetrics("step1")
+        self.prescreener = prescreener
+        # 多图批量请求的统计（每个请求一条：图像数 / 耗时 / token 数）
+        self.batch_stats = []
+        self._stats_lock = threading.Lock()
 
-    def analyze_scene(self, image_path):
+    def analyze_scene(self, image_path, screened=None):
         """
         执行 Phase 1: 上传图片并获取区域划分数据 (JSON)
+        :param screened: 调用方已完成的预筛结果 (合成 zones, 提示文本)，None 时按需预筛
+        :return: zones 列表，失败时为 []（需要区分失败与无区域时使用 analyze_scene_status）
+        """
+        return self.analyze_scene_status(image_path, screened)[0]
+
+    def analyze_scene_status(self, image_path, screened=None):
         """
+        与 analyze_scene 相同，但同时返回是否成功
+        :return: (zones, ok)；ok 为 False 表示请求失败、超时或响应无法解析（zones 为 [] 或不完整的部分结果），
+                 预筛跳过、命中缓存与模型返回空列表均为 ok
+        """
+        item = os.path.basename(image_path)
+
+        # 本地预筛：无火情图像直接返回合成的整图 Monitor 区域；有火情时可附带候选热点提示
+        hint = None
+        if self.prescreener is not None:
+            skipped, hint = screened or self.prescreen(image_path)
+            if skipped is not None:
+                return skipped, True
+        hints = [hint] if hint else []
+
         print(f"   [Vision] 正在上传并分析图像: {image_path}...")
+
+        # 查询响应缓存（key = 模型 + 配置 + 图像内容 + 提示词）
+        cache_key = None
+        if self.response_cache is not None:
+            cache_key = make_cache_key(self.model, self.config, [file_sha256(image_path), task_prompt_json, *hints],
+                                       client_kind=self.client_kind)
+            cached_text = self.response_cache.get(cache_key)
+            if cached_text is not None:
+                print(f"   [Vision] 命中响应缓存: {item}")
+                zones = self._parse_json_response(cached_text, item)
+                if self.stream and self.on_zone is not None:
+                    for zone in zones:
+                        self.on_zone(image_path, zone)
+                return zones, True
         
+        deadline = self.call_layer.deadline_after(self.scene_deadline)
+        emitter = ZoneEmitter(image_path, self.on_zone) if self.stream and self.on_zone is not None else None
         try:
-            # 上传图片
-            my_file = self.client.files.upload(file=image_path)
-            
-            # 调用大模型
-            response = self.client.models.generate_content(
-                model="gemini-3-pro-preview",
-                contents=[my_file, task_prompt_json],
-                config=self.config
-            )
+            # 上传图片（命中缓存则复用已上传的文件句柄）
+            on_retry = self.metrics.retry_counter(item)
+            my_file = self.call_layer.call(lambda: self._upload(image_path), deadline=deadline, hedge=False,
+                                           on_retry=on_retry)
             
-            return self._parse_json_response(response.text)
+            # 调用大模型（提示词已注册为缓存上下文时只发送图片）
+            contents, config = [my_file, task_prompt_json, *hints], self.config
+            cache_name = self.context_cache.get(task_prompt_json, "vision-task-prompt") if self.context_cache else None
+            if cache_name:
+                contents, config = [my_file, *hints], ContextCache.config_with(self.config, cache_name)
+
+            def request():
+                attempt = None
+                if emitter is not None:
+                    attempt = emitter.begin()
+                    if attempt is None:
+                        # 上一次尝试已回调过部分 zone：不再重发，以免下游收到重复 zone
+                        print(f"   [Vision Stream] {item}: 已回调 {len(emitter.emitted)} 个区域，不再重试")
+                        return None, list(emitter.emitted), "partial"
+                # 限速：每次尝试（含重试与对冲）都等待请求令牌
+                self.rate_limiter.acquire()
+                if self.stream:
+                    return self._generate_stream(image_path, contents, config,
+                                                 None if emitter is None else lambda zone: emitter.emit(attempt, zone))
+                start = time.monotonic()
+                response = self.client.models.generate_content(
+                    model=self.model,
+                    contents=contents,
+                    config=config
+                )
+                self._record_batch_stats(1, time.monotonic() - start, response, item)
+                return (response.text, *self._parse_zones(response.text, item))
+
+            # 流式请求会回调 on_zone，不做对冲以免重复回调
+            try:
+                text, zones, status = self.call_layer.call(request, deadline=deadline,
+                                                           hedge=False if self.stream else None, on_retry=on_retry)
+            finally:
+                if emitter is not None:
+                    emitter.close()
+
+            # 仅缓存可完整解析的响应（截断后恢复的部分结果不缓存）
+            if cache_key is not None and zones and status == "ok":
+                self.response_cache.put(cache_key, text, model=self.model)
+            return zones, status in ("ok", "recovered")
             
+        except DeadlineExceeded as e:
+            print(f"   [Vision Error] {os.path.basename(image_path)} 超过场景截止时间，降级为空结果: {e}")
         except Exception as e:
             print(f"   [Vision Error] 图像分析请求失败: {e}")
-            return []
+        # 已回调给下游的 zone 作为部分结果返回，与下游收到的内容保持一致
+        return (list(emitter.emitted) if emitter is not None else []), False
+
+    def _generate_stream(self, image_path, contents, config, emit=None):
+        """
+        内部方法：流式请求，增量解析顶层 JSON 数组，每个 zone 一闭合即回调 emit
+        :param emit: 可选回调 emit(zone)（由 ZoneEmitter 过滤被放弃尝试的回调）
+        :return: (完整响应文本, zones, 解析状态)
+        """
+        item = os.path.basename(image_path)
+        parser = JsonArrayStream()
+        pieces, last_chunk = [], None
+        parse_time = 0.0
+        start = time.monotonic()
+        for chunk in self.client.models.generate_content_stream(model=self.model, contents=contents, config=config):
+            text = chunk.text or ""
+            pieces.append(text)
+            last_chunk = chunk
+            feed_start = time.monotonic()
+            closed = parser.feed(text)
+            parse_time += time.monotonic() - feed_start
+            for zone in closed:
+                if len(parser.items) == 1:
+                    print(f"   [Vision Stream] {item}: 首个区域 {time.monotonic() - start:.1f}s 到达")
+                if emit is not None:
+                    emit(zone)
+        # usage_metadata 在最后一个分片中给出
+        self._record_batch_stats(1, time.monotonic() - start, last_chunk, item)
 
-    def _parse_json_response(self, raw_text):
-        """内部方法：清理 markdown 标记并解析 JSON"""
+        full_text = "".join(pieces)
+        if parser.complete and not parser.errors:
+            self.metrics.observe("parse", parse_time, item)
+            return full_text, parser.items, "ok"
+        return (full_text, *self._parse_zones(full_text, item))
+
+    def prescreen(self, image_path):
+        """
+        本地火焰 / 烟雾预筛（未配置 prescreener 或预筛出错时不跳过）
+        :return: (合成 zones 或 None, 提示文本或 None)
+        """
+        item = os.path.basename(image_path)
         try:
-            text = raw_text.strip()
-            if text.startswith("```json"):
-                text = text.replace("```json", "").replace("```", "").strip()
-            elif text.startswith("```"):
-                text = text.replace("```", "").strip()
-                
-            return json.loads(text)
-        except json.JSONDecodeError as e:
-            print(f"   [Vision Error] JSON 解析失败: {e}")
-            return []
+            with self.metrics.stage("prescreen", item):
+                skipped, hint = self.prescreener.screen(image_path)
+        except Exception as e:
+            print(f"   [Prescreen Warning] {item} 预筛失败，照常请求模型: {e}")
+            return None, None
+        if skipped is not None:
+            print(f"   [Prescreen] {item}: 未检测到火焰或烟雾，跳过模型请求")
+            self.metrics.add("prescreen_skipped", item=item)
+        return skipped, hint
+
+    def _upload(self, image_path):
+        """内部方法：上传图片，优先复用上传缓存"""
+        with self.metrics.stage("upload", os.path.basename(image_path)):
+            if self.upload_cache is None:
+                return self.client.files.upload(file=image_path)
+            my_file, hit = self.upload_cache.upload(self.client, image_path)
+        if hit:
+            print(f"   [Vision] 复用已上传文件: {os.path.basename(image_path)} -> {my_file.name}")
+        return my_file
+
+    def analyze_batch(self, image_paths, screened=None):
+        """
+        多图批量请求：一次请求发送多张图像，返回以图像名称为 key 的 JSON 对象
+        若整体解析失败或缺少某些图像，自动对失败部分二分后重试，单张时回退为 analyze_scene
+        :param image_paths: 图像路径列表
+        :param screened: 可选的 {image_path: 预筛结果}，回退为 analyze_scene 时沿用，不重复预筛
+        :return: {image_path: zones}
+        """
+        screened = screened or {}
+        if len(image_paths) <= 1:
+            return {path: self.analyze_scene(path, screened.get(path)) for path in image_paths}
+
+        names = [os.path.basename(p) for p in image_paths]
+        if len(set(names)) < len(names):
+            names = [f"image_{i}_{name}" for i, name in enumerate(names)]
+        print(f"   [Vision] 批量分析 {len(image_paths)} 张图像: {', '.join(names)}")
+
+        results = {}
+        pending = list(zip(names, image_paths))
+
+        # 查询响应缓存（每张图像单独缓存）
+        cache_keys = {}
+        if self.response_cache is not None:
+            for name, path in list(pending):
+                cache_keys[path] = make_cache_key(self.model, self.config, [file_sha256(path), batch_task_prompt_json],
+                                                  client_kind=self.client_kind)
+                cached_text = self.response_cache.get(cache_keys[path])
+                if cached_text is not None:
+                    results[path] = self._parse_json_response(cached_text, os.path.basename(path))
+                    pending.remove((name, path))
+            if not pending:
+                return results
+            if len(pending) == 1:
+                results.update(self.analyze_batch([pending[0][1]], screened))
+                return results
+
+        parsed = None
+        items = [os.path.basename(path) for _, path in pending]
+        on_retry = self.metrics.retry_counter(items)
+        deadline = self.call_layer.deadline_after(self.scene_deadline)
+        try:
+            contents = []
+            for name, path in pending:
+                my_file = self.call_layer.call(lambda p=path: self._upload(p), deadline=deadline, hedge=False,
+                                               on_retry=self.metrics.retry_counter(os.path.basename(path)))
+                contents.extend([f"图像名称: {name}", my_file])
+            config = self.config
+            if self.structured:
+                config = structured_config(config, batch_zone_schema([name for name, _ in pending]))
+            cache_name = self.context_cache.get(batch_task_prompt_json, "vision-batch-prompt") if self.context_cache else None
+            if cache_name:
+                config = ContextCache.config_with(config, cache_name)
+            else:
+                contents.append(batch_task_prompt_json)
+
+            def request():
+                self.rate_limiter.acquire()
+                start = time.monotonic()
+                response = self.client.models.generate_content(model=self.model, contents=contents, config=config)
+                self._record_batch_stats(len(pending), time.monotonic() - start, response, items)
+                return response.text
+
+            parsed = self._parse_json_response(self.call_layer.call(request, deadline=deadline, on_retry=on_retry),
+                                               items)
+        except Exception as e:
+            print(f"   [Vision Error] 批量分析请求失败: {e}")
+
+        failed = []
+        for name, path in pending:
+            zones = parsed.get(name) if isinstance(parsed, dict) else None
+            if isinstance(zones, list) and zones:
+                results[path] = zones
+                if path in cache_keys:
+                    self.response_cache.put(cache_keys[path], json.dumps(zones, ensure_ascii=False), model=self.model)
+            else:
+                failed.append(path)
+
+        # 失败部分二分重试
+        if failed:
+            print(f"   [Vision] 批量结果缺失 {len(failed)} 张，二分重试")
+            half = (len(failed) + 1) // 2
+            for part in (failed[:half], failed[half:]):
+                if part:
+                    results.update(self.analyze_batch(part, screened))
+        return results
+
+    def analyze_bulk(self, image_paths, backend, work_dir, poll_interval=DEFAULT_POLL_INTERVAL):
+        """
+        离线批量作业模式：上传全部图像并写入 JSONL 作业文件，通过批量作业接口提交并等待结果
+        :param image_paths: 图像路径列表
+        :param backend: BulkBackend 实例（Gemini Batch API 或本地替身）
+        :param work_dir: 作业文件目录
+        :param poll_interval: 轮询间隔（秒）
+        :return: {image_path: zones}
+        """
+        results, requests, keys = {}, {}, {}
+        for path in image_paths:
+            cache_key = None
+            if self.response_cache is not None:
+                cache_key = make_cache_key(self.model, self.config, [file_sha256(path), task_prompt_json],
+                                           client_kind=self.client_kind)
+                cached_text = self.response_cache.get(cache_key)
+                if cached_text is not None:
+                    results[path] = self._parse_json_response(cached_text, os.path.basename(path))
+                    continue
+            try:
+                my_file = self._upload(path)
+            except Exception as e:
+                print(f"   [Vision Error] 图像上传失败: {e}")
+                results[path] = []
+                continue
+            key = f"{len(requests):06d}_{os.path.basename(path)}"
+            requests[key] = build_request([my_file, task_prompt_json], self.config)
+            keys[key] = (path, cache_key)
+
+        if results:
+            print(f"   [Vision] 命中响应缓存 {len(results)} 张，批量作业 {len(requests)} 张")
+        texts = run_bulk_job(backend, requests, work_dir, "step1", self.model, poll_interval=poll_interval)
+        for key, (path, cache_key) in keys.items():
+            text = texts.get(key)
+            zones, status = self._parse_zones(text, os.path.basename(path)) if text else ([], "failed")
+            if cache_key is not None and zones and status == "ok":
+                self.response_cache.put(cache_key, text, model=self.model)
+            results[path] = zones
+        return results
+
+    def _record_batch_stats(self, size, latency, response, items=None):
+        """记录单个请求的每图耗时与 token 数（批量请求同时打印），并写入运行指标"""
+        self.metrics.observe("model", latency, items)
+        self.metrics.record_usage(response, items)
+        usage = getattr(response, "usage_metadata", None)
+        prompt_tokens = getattr(usage, "prompt_token_count", None) or 0
+        output_tokens = getattr(usage, "candidates_token_count", None) or 0
+        with self._stats_lock:
+            self.batch_stats.append({
+                "size": size,
+                "latency": latency,
+                "prompt_tokens": prompt_tokens,
+                "output_tokens": output_tokens,
+            })
+        if size > 1:
+            print(f"   [Vision Batch] {size} 张: 耗时 {latency:.1f}s ({latency / size:.1f}s/张), "
+                  f"输入 {prompt_tokens / size:.0f} tokens/张, 输出 {output_tokens / size:.0f} tokens/张")
+
+    def summarize_batch_stats(self):
+        """汇总批量请求统计：按批大小统计平均每图耗时与 token 数"""
+        summary = {}
+        for stat in self.batch_stats:
+            entry = summary.setdefault(stat["size"], {"requests": 0, "images": 0, "latency": 0.0,
+                                                      "prompt_tokens": 0, "output_tokens": 0})
+            entry["requests"] += 1
+            entry["images"] += stat["size"]
+            entry["latency"] += stat["latency"]
+            entry["prompt_tokens"] += stat["prompt_tokens"]
+            entry["output_tokens"] += stat["output_tokens"]
+        return {
+            size: {
+                "requests": e["requests"],
+                "latency_per_image": e["latency"] / e["images"],
+                "prompt_tokens_per_image": e["prompt_tokens"] / e["images"],
+                "output_tokens_per_image": e["output_tokens"] / e["images"],
+            }
+            for size, e in sorted(summary.items())
+        }
+
+    def iter_analyze(self, image_paths, max_workers=MAX_WORKERS, preprocessor=None, batch_size=1):
+        """
+        并发执行 Phase 1：使用线程池同时分析多张图像
+        结果按完成顺序逐个产出，便于调用方实时打印进度
+        :param image_paths: 图像路径列表，或按需产出路径的生成器（如视频帧筛选）
+        :param max_workers: 最大并发请求数
+        :param preprocessor: 可选的 ImagePreprocessor，缩放/重编码在进程池中与网络请求并行
+        :param batch_size: 每个请求包含的图像数，>1 时使用 analyze_batch
+        :return: 生成器，产出 (原始 image_path, zones)
+        """
+        batch_size = max(1, batch_size)
+        # 列表输入一次性提交全部任务（预处理可提前于网络请求运行）；
+        # 生成器输入边读取边提交，在途任务数达到上限时先等待结果，只提前读取有限的几帧
+        window = None if hasattr(image_paths, "__len__") else max_workers * 2
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        pending = set()
+        try:
+            chunk = []
+            for path in image_paths:
+                chunk.append((path, None if preprocessor is None else preprocessor.submit(path)))
+                if len(chunk) < batch_size:
+                    continue
+                pending.add(executor.submit(self._analyze_chunk, chunk))
+                chunk = []
+                if window is None:
+                    continue
+                # 不阻塞地产出已完成的结果；在途任务已满时等待至少一个完成
+                done = {f for f in pending if f.done()}
+                if not done and len(pending) >= window:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    pending.discard(future)
+                    yield from future.result()
+            if chunk:
+                pending.add(executor.submit(self._analyze_chunk, chunk))
+            for future in as_completed(pending):
+                yield from future.result()
+        finally:
+            # 中断（如 Ctrl-C）时取消尚未开始的请求，只等待进行中的请求结束
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def _analyze_chunk(self, chunk):
+        """内部方法：等待预处理完成后分析一组图像，返回 [(原始路径, zones)]"""
+        sources = {}
+        results = []
+        for path, prepare_future in chunk:
+            if prepare_future is None:
+                sources[path] = path
+                continue
+            try:
+                sources[prepare_future.result()] = path
+            except Exception as e:
+                print(f"   [Vision Error] 图像预处理失败: {e}")
+                results.append((path, []))
+
+        # 多图批量请求前先预筛，无火情的图像不进入批次（批量请求不附带热点提示）
+        screened = {}
+        if self.prescreener is not None:
+            for p in list(sources):
+                screened[p] = self.prescreen(p)
+                if screened[p][0] is not None:
+                    results.append((sources.pop(p), screened[p][0]))
+
+        if not sources:
+            analyzed = {}
+        elif len(sources) == 1:
+            analyzed = {p: self.analyze_scene(p, screened.get(p)) for p in sources}
+        else:
+            analyzed = self.analyze_batch(list(sources), screened)
+        results.extend((sources[p], analyzed.get(p, [])) for p in sources)
+        return results
+
+    def _parse_zones(self, raw_text, item=None):
+        """
+        内部方法：容错解析 JSON（去除 markdown 标记；截断的数组逐个恢复已完整的 zone）
+        :param item: 图片名称（或名称列表），用于记录解析耗时、恢复与失败次数
+        :return: (解析结果, 状态 ok / recovered / failed)，失败时结果为 []
+        """
+        with self.metrics.stage("parse", item):
+            value, status = parse_json_tolerant(raw_text)
+        if status == "recovered":
+            print(f"   [Vision Warning] 响应不完整，已逐个恢复 {len(value)} 个区域")
+            self.metrics.add("parse_recovered", item=item)
+        elif status == "failed":
+            print(f"   [Vision Error] JSON 解析失败: {(raw_text or '')[:80]!r}")
+            self.metrics.add("parse_failures", item=item)
+            value = []
+        return value, status
+
+    def _parse_json_response(self, raw_text, item=None):
+        """内部方法：解析 JSON，只返回结果（失败时为 []）"""
+        return self._parse_zones(raw_text, item)[0]
         
-def main():
-    # 1. 初始化
-    client = setup_client()
-    vision_system = VisionAnalyzer(client)
-    
-    # 2. 扫描图片
+def list_image_files(image_dir):
+    """扫描目录下支持格式的图片"""
     image_extensions = ['*.jpg', '*.jpeg', '*.png']
     image_files = []
     for ext in image_extensions:
-        image_files.extend(glob.glob(os.path.join(IMAGE_DIR, ext)))
-    
-    print(f"👁️ [Step 1] 开始视觉分析任务，共 {len(image_files)} 张图片")
+        image_files.extend(glob.glob(os.path.join(image_dir, ext)))
+    return image_files
+
+def report_high_zone(image_path, zone):
+    """流式模式回调：High 区域一到达即打印，便于提前调度"""
+    if zone.get("risk_level") == "High":
+        print(f"   🔥 [Stream] {os.path.basename(image_path)}: 高危区域 {zone.get('id')} 已到达，"
+              f"火点 {len(zone.get('fire_points') or [])} 个")
+
+def iter_bulk(vision_system, image_paths, backend, preprocessor=None, poll_interval=DEFAULT_POLL_INTERVAL,
+              work_dir=BULK_DIR):
+    """
+    离线批量作业模式：与 iter_analyze 产出相同的 (原始 image_path, zones)
+    :param work_dir: 作业文件目录（替身 Client 使用 cache/fake/bulk）
+    """
+    sources = {}
+    for path in image_paths:
+        if preprocessor is None:
+            sources[path] = path
+            continue
+        try:
+            sources[preprocessor.submit(path).result()] = path
+        except Exception as e:
+            print(f"   [Vision Error] 图像预处理失败: {e}")
+            yield path, []
+
+    # 预筛判定无火情的图像不写入作业文件
+    if vision_system.prescreener is not None:
+        for source in list(sources):
+            skipped, _ = vision_system.prescreen(source)
+            if skipped is not None:
+                yield sources.pop(source), skipped
+    if not sources:
+        return
+
+    analyzed = vision_system.analyze_bulk(list(sources), backend, work_dir, poll_interval=poll_interval)
+    for source, path in sources.items():
+        yield path, analyzed.get(source, [])
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Step 1：视觉分析（图片 -> zones JSON）")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="跳过响应缓存读取，强制重新请求模型（新结果仍会写入缓存）")
+    parser.add_argument("--preprocess", action="store_true",
+                        help="上传前缩放并重新编码图片（去除 EXIF）")
+    parser.add_argument("--max-side", type=int, default=DEFAULT_MAX_SIDE,
+                        help=f"预处理最长边像素上限（默认 {DEFAULT_MAX_SIDE}）")
+    parser.add_argument("--jpeg-quality", type=int, default=DEFAULT_QUALITY,
+                        help=f"预处理 JPEG 质量（默认 {DEFAULT_QUALITY}）")
+    parser.add_argument("--output", default=None,
+                        help="zones 输出文件路径（默认 out/zones_data.json，替身 Client 为 out/fake/zones_data.json；"
+                             "对比预处理前后的坐标漂移时可分别输出）")
+    parser.add_argument("--resume", action="store_true",
+                        help="续跑：跳过日志/输出中已有非空 zones 的图片")
+    parser.add_argument("--no-context-cache", action="store_true",
+                        help="不把提示词注册为服务端缓存上下文，每次请求完整发送")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE,
+                        help=f"每个请求包含的图像数，>1 时启用多图批量请求（默认 {BATCH_SIZE}）")
+    parser.add_argument("--render", choices=["async", "deferred", "off"], default="async",
+                        help="可视化方式：async 结果到达即提交进程池渲染；deferred 全部分析完成后批量渲染；off 不渲染")
+    parser.add_argument("--render-backend", choices=["matplotlib", "pillow"], default="matplotlib",
+                        help="可视化后端：matplotlib（带图例）或 pillow（轻量快速）")
+    parser.add_argument("--render-size", type=int, default=DEFAULT_MAX_SIZE,
+                        help=f"pillow 后端输出最长边像素（默认 {DEFAULT_MAX_SIZE}）")
+    parser.add_argument("--bulk", choices=["gemini", "local"], default=None,
+                        help="离线批量作业模式：gemini 提交到 Batch API；local 使用本地文件替身逐条执行")
+    parser.add_argument("--poll-interval", type=float, default=DEFAULT_POLL_INTERVAL,
+                        help=f"批量作业轮询间隔/秒（默认 {DEFAULT_POLL_INTERVAL}）")
+    parser.add_argument("--stream", action="store_true",
+                        help="流式响应：每个区域一闭合即解析，High 区域提前打印（仅单图请求）")
+    parser.add_argument("--structured", action="store_true",
+                        help="结构化输出：以 application/json + zone Schema 约束模型输出，消除格式错误")
+    parser.add_argument("--profile", action="store_true",
+                        help=f"用 cProfile 包裹整次运行（主线程与工作线程合并统计，不含渲染 / 预处理进程），"
+                             f"保存至 out/{os.path.basename(PROFILE_PATH)} 并打印热点函数")
+    add_client_arguments(parser)
+    add_call_arguments(parser)
+    add_frame_source_arguments(parser)
+    add_tiling_arguments(parser)
+    add_prescreen_arguments(parser)
+    args = parser.parse_args(argv)
+    # 替身 Client 的输出写入 out/fake/，不覆盖被回放的 out/zones_data.json
+    if args.output is None:
+        args.output = isolate_path(OUTPUT_JSON, args.client)
+    return args
+
+def run(args, metrics):
+    """执行 Step 1（main 负责性能分析与指标导出）"""
+    # 1. 初始化
+    client = create_client(args)
+    vision_system = VisionAnalyzer(
+        client,
+        requests_per_minute=REQUESTS_PER_MINUTE,
+        upload_cache=UploadCache(isolate_path(UPLOAD_CACHE_JSON, args.client)),
+        response_cache=ResponseCache(isolate_path(RESPONSE_CACHE_DIR, args.client), bypass=args.no_cache),
+        context_cache=None if args.no_context_cache else ContextCache(client, MODEL_NAME),
+        stream=args.stream,
+        on_zone=report_high_zone,
+        call_layer=create_call_layer(args),
+        scene_deadline=args.scene_deadline,
+        metrics=metrics,
+        structured=args.structured,
+        prescreener=create_prescreener(args),
+    )
     
-    results = {}
+    # 2. 扫描图片（或从视频 / 帧目录中筛选画面变化的帧；或使用分块分析的大幅影像）
+    if args.mosaic:
+        image_files = args.mosaic
+    else:
+        image_files = frames_from_args(args, FRAMES_DIR) if args.source else list_image_files(IMAGE_DIR)
 
-    # 3. 批量处理
-    for index, image_path in enumerate(image_files):
-        file_name = os.path.basename(image_path)
-        print(f"\n--- 处理中 [{index+1}/{len(image_files)}]: {file_name} ---")
-        
-        # 调用视觉层
-        zones = vision_system.analyze_scene(image_path)
-        
-        if zones:
-            print(f"   ✅ 获取到 {len(zones)} 个区域数据")
-            results[file_name] = zones
-            
-            # 可视化 (可选)
-            try:
-                visualize_segmentation_on_image(str(zones), image_path)
-            except Exception as e:
-                print(f"   ⚠️ 可视化失败: {e}")
+    # 3. 结果日志：每张图片完成即追加写入，支持中断后续跑
+    journal = ResultJournal(journal_path_for(args.output))
+    if args.resume:
+        results = load_json(args.output, default={}) or {}
+        results.update(journal.load())
+    else:
+        journal.reset()
+        results = {}
+
+    if isinstance(image_files, list):
+        scanned = [os.path.basename(p) for p in image_files]
+        pending_files = [p for p in image_files if not results.get(os.path.basename(p))]
+        total = len(pending_files)
+        skipped = len(image_files) - len(pending_files)
+
+        print(f"👁️ [Step 1] 开始视觉分析任务，共 {len(image_files)} 张图片 (并发数: {MAX_WORKERS})")
+        if skipped:
+            print(f"   [Resume] 跳过已完成的 {skipped} 张图片，剩余 {len(pending_files)} 张")
+    else:
+        # 视频 / 帧目录：逐帧筛选并按需送入分析，总数在读完之前未知
+        scanned, total = [], "?"
+
+        def iter_pending(frames):
+            for path in frames:
+                scanned.append(os.path.basename(path))
+                if not results.get(scanned[-1]):
+                    yield path
+
+        pending_files = iter_pending(image_files)
+        print(f"👁️ [Step 1] 开始视觉分析任务，边筛选帧边分析: {args.source} (并发数: {MAX_WORKERS})")
+
+    preprocessor = None
+    if args.preprocess:
+        preprocessor = ImagePreprocessor(PREPROCESS_DIR, max_side=args.max_side, quality=args.jpeg_quality)
+        print(f"   [Preprocess] 上传前缩放至最长边 {args.max_side}px，JPEG 质量 {args.jpeg_quality}")
+
+    if args.mosaic and args.render != "off":
+        # 整幅影像无法在内存中绘制，图块可视化也意义不大
+        print("   [Tiling] 分块分析模式下不生成可视化结果")
+        args.render = "off"
+
+    render_options = {"backend": args.render_backend, "max_size": args.render_size}
+    renderer = BatchRenderer(metrics=metrics, **render_options) if args.render == "async" else None
+    render_queue = []
+
+    # 4. 并发批量处理（按完成顺序输出进度）；离线批量作业模式下整体提交后统一产出
+    finished = False
+    try:
+        if args.mosaic:
+            # 分块分析：图块逐个请求模型（不使用离线批量作业与上传前预处理）
+            analyzed = iter_mosaics(vision_system, pending_files, TILES_DIR, tile_size=args.tile_size,
+                                    overlap=args.tile_overlap, max_workers=MAX_WORKERS, dedupe_px=args.tile_dedupe)
+        elif args.bulk:
+            print(f"   [Bulk] 离线批量作业模式 (后端: {args.bulk})")
+            bulk_dir = isolate_path(BULK_DIR, args.client)
+            analyzed = iter_bulk(vision_system, pending_files, create_bulk_backend(args.bulk, client, bulk_dir),
+                                 preprocessor=preprocessor, poll_interval=args.poll_interval, work_dir=bulk_dir)
         else:
-            print(f"   ❌ 分析失败或无数据")
-            results[file_name] = None
+            analyzed = vision_system.iter_analyze(pending_files, max_workers=MAX_WORKERS, preprocessor=preprocessor,
+                                                  batch_size=args.batch_size)
+        for index, (image_path, zones) in enumerate(analyzed):
+            file_name = os.path.basename(image_path)
+            print(f"\n--- 已完成 [{index+1}/{total}]: {file_name} ---")
+            
+            if zones:
+                print(f"   ✅ 获取到 {len(zones)} 个区域数据")
+                results[file_name] = zones
+                
+                # 可视化 (可选，不阻塞模型调用)
+                if renderer is not None:
+                    renderer.submit(zones, image_path)
+                elif args.render == "deferred":
+                    render_queue.append((zones, image_path))
+            else:
+                print(f"   ❌ 分析失败或无数据")
+                results[file_name] = None
+            with metrics.stage("write", file_name):
+                journal.append(file_name, results[file_name])
+        finished = True
+    finally:
+        if preprocessor is not None:
+            preprocessor.close()
+        if renderer is not None and not finished:
+            # 中断或出错：取消排队的渲染任务并关闭进程池，不留下工作进程
+            renderer.close(cancel=True)
 
-    # 4. 保存中间结果
-    with open(OUTPUT_JSON, 'w', encoding='utf-8') as f:
-        json.dump(results, f, ensure_ascii=False, indent=4)
+        # 5. 压缩日志，保存中间结果（按原始扫描顺序排列；中断时也写出已完成部分）
+        with metrics.stage("write"):
+            compact_results(results, args.output, order=scanned)
     
-    print(f"\n💾 [Step 1 完成] 区域数据已保存至: {OUTPUT_JSON}")
+    print(f"\n💾 [Step 1 完成] 区域数据已保存至: {args.output}")
+
+    print(f"📊 [Calls] {vision_system.call_layer.summary()}")
+    print(f"📊 [Parse] {metrics.parse_summary()}")
+    if args.prescreen:
+        print(f"📊 [Prescreen] {metrics.prescreen_summary()}")
+
+    # 批量请求统计：用于选择最佳批大小
+    for size, stat in vision_system.summarize_batch_stats().items():
+        print(f"📊 [Batch] 批大小 {size}: {stat['requests']} 个请求，{stat['latency_per_image']:.1f}s/张，"
+              f"输入 {stat['prompt_tokens_per_image']:.0f} tokens/张，输出 {stat['output_tokens_per_image']:.0f} tokens/张")
+
+    # 6. 可视化收尾：等待异步渲染完成，或执行延后的批量渲染
+    if renderer is not None:
+        print("🎨 [Render] 等待可视化渲染完成...")
+        renderer.close()
+    elif render_queue:
+        print(f"🎨 [Render] 批量渲染 {len(render_queue)} 张可视化结果...")
+        render_batch(render_queue, metrics=metrics, **render_options)
+
+def main(argv=None):
+    args = parse_args(argv)
+    metrics = RunMetrics("step1")
+    metrics_json, metrics_prom = isolate_path(METRICS_JSON, args.client), isolate_path(METRICS_PROM, args.client)
+    try:
+        with profile_run(isolate_path(PROFILE_PATH, args.client) if args.profile else None):
+            run(args, metrics)
+    finally:
+        # 中断时也导出已采集的指标
+        metrics.export(metrics_json, metrics_prom)
+        print(f"📊 [Metrics] {metrics.summary()}")
+        print(f"📊 [Metrics] 运行报告: {metrics_json}，Prometheus: {metrics_prom}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
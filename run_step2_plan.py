@@ -1,30 +1,97 @@
 import os
 import json
+import time
+import argparse
 from google.genai import types
 
-from tools.utils import setup_client
-from tools.generate import create_command_prompt
+from tools.utils import add_client_arguments, create_client, client_kind, isolate_path
+from tools.generate import (get_static_prompt, build_zones_prompt, ZONE_FORMATS, DEFAULT_ZONE_FORMAT,
+                            DEFAULT_COORD_PRECISION)
+from tools.usage import UsageTracker
+from tools.metrics import RunMetrics, profile_run
+from tools.context_cache import ContextCache
+from tools.response_cache import ResponseCache, make_cache_key
+from tools.planner import LocalMissionPlanner
+from tools.archive import add_archive_arguments, archive_results, find_image_paths, ARCHIVE_DB
+from tools.fleet import FleetRegistry, DEFAULT_CANDIDATES_K, add_fleet_arguments
+from tools.routing import route_mission_lines, SCENE_SCALE_M
+from tools.geometry import validate_scenes
+from tools.delta import replan_scene, MOVE_THRESHOLD
+from tools.storage import ResultJournal, journal_path_for, load_json, compact_results, save_json_atomic
+from tools.call_layer import ModelCaller, DeadlineExceeded, add_call_arguments, create_call_layer
+from tools.bulk import create_bulk_backend, build_request, run_bulk_job, DEFAULT_POLL_INTERVAL
 
 # 配置路径
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 OUTPUT_DIR = os.path.join(BASE_DIR, "out")
+CACHE_DIR = os.path.join(BASE_DIR, "cache")
+RESPONSE_CACHE_DIR = os.path.join(CACHE_DIR, "responses")
+BULK_DIR = os.path.join(CACHE_DIR, "bulk")
 
 # 定义输入和输出路径
 INPUT_JSON = os.path.join(OUTPUT_DIR, "zones_data.json")
 OUTPUT_CODE_JSON = os.path.join(OUTPUT_DIR, "missions_plan.json")
+ROUTING_REPORT_JSON = os.path.join(OUTPUT_DIR, "routing_report.json")
+VALIDATION_REPORT_JSON = os.path.join(OUTPUT_DIR, "validation_report.json")
+DELTA_REPORT_JSON = os.path.join(OUTPUT_DIR, "delta_report.json")
+METRICS_JSON = os.path.join(OUTPUT_DIR, "metrics_step2.json")
+METRICS_PROM = os.path.join(OUTPUT_DIR, "metrics_step2.prom")
+PROFILE_PATH = os.path.join(OUTPUT_DIR, "profile_step2.prof")
+
+# 模型配置
+MODEL_NAME = "gemini-3-pro-preview"
 
 class MissionPlanner:
-    def __init__(self, client):
+    def __init__(self, client, response_cache=None, model=MODEL_NAME, context_cache=None, call_layer=None,
+                 scene_deadline=None, fallback_planner=None, fleet_registry=None, candidates_k=DEFAULT_CANDIDATES_K,
+                 zone_format=DEFAULT_ZONE_FORMAT, coord_precision=DEFAULT_COORD_PRECISION, metrics=None):
         """
         初始化任务规划器
         :param client: 已初始化的 google.genai.Client 实例
+        :param response_cache: 可选的 ResponseCache 实例，相同 Prompt + 模型直接复用结果
+        :param model: 使用的模型名称
+        :param context_cache: 可选的 ContextCache 实例，把静态 Prompt 前缀注册为服务端缓存上下文
+        :param call_layer: 可选的 ModelCaller 实例（超时 / 重试 / 对冲），默认使用默认参数创建
+        :param scene_deadline: 每个场景（含重试、对冲）的总截止时长/秒
+        :param fallback_planner: 可选的回退规划器（如 LocalMissionPlanner），请求失败或超时时使用
+        :param fleet_registry: 可选的 FleetRegistry；给出时 Prompt 只包含每个场景的候选无人机子集
+        :param candidates_k: 每个火点选取的最近可用灭火机数量
+        :param zone_format: 区域数据编码（json / compact 紧凑表格）
+        :param coord_precision: compact 编码的坐标精度（小数位数）
+        :param metrics: 可选的 RunMetrics 实例（分阶段耗时 / token / 重试）
         """
         self.client = client
+        # 替身 Client 的响应不与真实 Client 共用缓存 key
+        self.client_kind = client_kind(client)
+        self.model = model
+        self.context_cache = context_cache
         self.config = types.GenerateContentConfig(temperature=0.0)
+        self.response_cache = response_cache
+        self.call_layer = call_layer or ModelCaller()
+        self.scene_deadline = scene_deadline
+        self.fallback_planner = fallback_planner
+        self.fleet_registry = fleet_registry
+        self.candidates_k = candidates_k
+        self.zone_format = zone_format
+        self.coord_precision = coord_precision
+        self.usage = UsageTracker()
+        self.metrics = metrics or RunMetrics("step2")
+
+    def build_prompt(self, zones_data):
+        """
+        构建 Prompt 的两部分：(静态前缀, 场景部分)
+        使用机队注册表时资源池从静态前缀移到场景部分，只列出候选子集
+        """
+        encoding = {"zone_format": self.zone_format, "precision": self.coord_precision}
+        if self.fleet_registry is None:
+            return get_static_prompt(), build_zones_prompt(zones_data, **encoding)
+        candidates = self.fleet_registry.candidate_subset(zones_data, self.candidates_k)
+        return get_static_prompt(include_fleet=False), build_zones_prompt(zones_data, fleet=candidates, **encoding)
 
-    def generate_mission_code(self, zones_data):
+    def generate_mission_code(self, zones_data, scene=None):
         """
         执行 Phase 2: 基于区域数据生成无人机控制代码
+        :param scene: 可选的场景名称（用于按场景记录运行指标）
         """
         if not zones_data:
             print("   [Planner Warning] 接收到的区域数据为空，跳过规划。")
@@ -32,76 +99,322 @@ class MissionPlanner:
 
         print("   [Planner] 正在根据区域数据生成任务指令...")
 
-        # 构建指令 Prompt
-        prompt = create_command_prompt(zones_data)
+        # 构建指令 Prompt（静态前缀在进程内缓存，只有区域数据部分随场景变化）
+        with self.metrics.stage("prompt", scene):
+            static_prefix, zones_prompt = self.build_prompt(zones_data)
+        prompt = static_prefix + zones_prompt
+
+        # 查询响应缓存（Prompt 已包含区域数据与无人机资源，任一变化都会产生新的 key）
+        cache_key = None
+        if self.response_cache is not None:
+            cache_key = make_cache_key(self.model, self.config, [prompt], client_kind=self.client_kind)
+            cached_text = self.response_cache.get(cache_key)
+            if cached_text is not None:
+                print("   [Planner] 命中响应缓存")
+                return cached_text
         
+        deadline = self.call_layer.deadline_after(self.scene_deadline)
         try:
-            # 大模型生成任务指令
-            response = self.client.models.generate_content(
-                model="gemini-3-pro-preview",
-                contents=[prompt],
-                config=self.config
+            # 大模型生成任务指令（静态前缀已注册为缓存上下文时只发送区域数据）
+            contents, config = [prompt], self.config
+            cache_name = self.context_cache.get(static_prefix, "planner-static-prefix") if self.context_cache else None
+            if cache_name:
+                contents, config = [zones_prompt], ContextCache.config_with(self.config, cache_name)
+            start = time.monotonic()
+            response = self.call_layer.call(
+                lambda: self.client.models.generate_content(model=self.model, contents=contents, config=config),
+                deadline=deadline,
+                on_retry=self.metrics.retry_counter(scene),
             )
+            latency = time.monotonic() - start
+            self.metrics.observe("model", latency, scene)
+            self.metrics.record_usage(response, scene)
+            prompt_tokens, _, _ = self.usage.record(response, latency)
+            print(f"   [Planner] 输入 {prompt_tokens} tokens，耗时 {latency:.1f}s")
+            if cache_key is not None:
+                self.response_cache.put(cache_key, response.text, model=self.model)
             return response.text
             
+        except DeadlineExceeded as e:
+            print(f"   [Planner Error] 超过场景截止时间: {e}")
         except Exception as e:
             print(f"   [Planner Error] 任务生成请求失败: {e}")
+        return self._fallback(zones_data)
+
+    def _fallback(self, zones_data):
+        """内部方法：请求失败时使用回退规划器，未配置时返回空字符串"""
+        if self.fallback_planner is None:
             return ""
+        print("   [Planner] 降级为回退规划器")
+        return self.fallback_planner.generate_mission_code(zones_data)
+
+    def generate_bulk(self, scenes, backend, work_dir, poll_interval=DEFAULT_POLL_INTERVAL):
+        """
+        离线批量作业模式：把全部场景的完整 Prompt 写入 JSONL 作业文件，通过批量作业接口提交并等待结果
+        :param scenes: {file_name: zones} 字典
+        :param backend: BulkBackend 实例（Gemini Batch API 或本地替身）
+        :param work_dir: 作业文件目录
+        :param poll_interval: 轮询间隔（秒）
+        :return: {file_name: 代码文本}，失败时为 ""
+        """
+        results, requests, keys = {}, {}, {}
+        for file_name, zones in scenes.items():
+            prompt = "".join(self.build_prompt(zones))
+            cache_key = None
+            if self.response_cache is not None:
+                cache_key = make_cache_key(self.model, self.config, [prompt], client_kind=self.client_kind)
+                cached_text = self.response_cache.get(cache_key)
+                if cached_text is not None:
+                    results[file_name] = cached_text
+                    continue
+            key = f"{len(requests):06d}_{file_name}"
+            requests[key] = build_request([prompt], self.config)
+            keys[key] = (file_name, cache_key)
+
+        if results:
+            print(f"   [Planner] 命中响应缓存 {len(results)} 个场景，批量作业 {len(requests)} 个")
+        texts = run_bulk_job(backend, requests, work_dir, "step2", self.model, poll_interval=poll_interval)
+        for key, (file_name, cache_key) in keys.items():
+            text = texts.get(key) or ""
+            if cache_key is not None and text:
+                self.response_cache.put(cache_key, text, model=self.model)
+            results[file_name] = text or self._fallback(scenes[file_name])
+        return results
+
+def format_mission_code(code):
+    """把模型输出的代码文本按行拆分为列表（missions_plan.json 的存储格式）"""
+    if not isinstance(code, str):
+        return code
+    # 去掉可能存在的空行，并按换行符分割
+    return [line for line in code.split('\n') if line.strip() != '']
+
+def create_planner(args, registry=None, metrics=None):
+    """根据命令行参数创建规划器（local 模式不初始化 client）"""
+    fleet = registry.to_dicts() if registry is not None and args.fleet else None
+    if args.planner == "local":
+        print("✅ [System] 使用本地确定性规划器")
+        return LocalMissionPlanner(fleet)
+    client = create_client(args)
+    return MissionPlanner(
+        client,
+        response_cache=ResponseCache(isolate_path(RESPONSE_CACHE_DIR, args.client), bypass=args.no_cache),
+        context_cache=None if args.no_context_cache else ContextCache(client, MODEL_NAME),
+        call_layer=create_call_layer(args),
+        scene_deadline=args.scene_deadline,
+        fallback_planner=LocalMissionPlanner(fleet) if args.fallback == "local" else None,
+        fleet_registry=registry if args.candidates > 0 else None,
+        candidates_k=args.candidates,
+        zone_format=args.zone_format,
+        coord_precision=args.coord_precision,
+        metrics=metrics,
+    )
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Step 2：任务规划（zones -> 指令代码）")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="跳过响应缓存读取，强制重新请求模型（新结果仍会写入缓存）")
+    parser.add_argument("--resume", action="store_true",
+                        help="续跑：跳过日志/输出中已有任务代码的场景")
+    parser.add_argument("--no-context-cache", action="store_true",
+                        help="不把静态 Prompt 前缀注册为服务端缓存上下文，每次请求完整发送")
+    parser.add_argument("--planner", choices=["llm", "local"], default="llm",
+                        help="规划后端：llm 调用大模型；local 使用本地确定性规划器（不请求 API）")
+    parser.add_argument("--route", action="store_true",
+                        help="对每架 UAV 的火点访问顺序做航线优化，并输出预计首次投放时间")
+    parser.add_argument("--scene-scale", type=float, default=SCENE_SCALE_M,
+                        help=f"归一化坐标 1.0 对应的实际距离/米（默认 {SCENE_SCALE_M}），用于估算飞行时间")
+    parser.add_argument("--validate", choices=["off", "reject", "repair"], default="off",
+                        help="规划前的几何校验：reject 跳过不合格场景；repair 先修复火点归属，仍不合格再跳过")
+    parser.add_argument("--bulk", choices=["gemini", "local"], default=None,
+                        help="离线批量作业模式：gemini 提交到 Batch API；local 使用本地文件替身逐条执行")
+    parser.add_argument("--poll-interval", type=float, default=DEFAULT_POLL_INTERVAL,
+                        help=f"批量作业轮询间隔/秒（默认 {DEFAULT_POLL_INTERVAL}）")
+    parser.add_argument("--previous-zones", default=None,
+                        help="上一帧的 zones_data.json：有上一帧区域与任务代码的场景只追加差异指令，不重新规划")
+    parser.add_argument("--previous-plan", default=None,
+                        help="上一帧的 missions_plan.json（默认即当前输出文件）")
+    parser.add_argument("--move-threshold", type=float, default=MOVE_THRESHOLD,
+                        help=f"火点匹配距离阈值（归一化坐标，默认 {MOVE_THRESHOLD}），超过视为熄灭 + 新增")
+    add_fleet_arguments(parser)
+    parser.add_argument("--zone-format", choices=ZONE_FORMATS, default=DEFAULT_ZONE_FORMAT,
+                        help="Prompt 中区域数据的编码：compact 紧凑表格（只保留 id/风险/火点）；json 原样序列化")
+    parser.add_argument("--coord-precision", type=int, default=DEFAULT_COORD_PRECISION,
+                        help=f"compact 编码的火点坐标小数位数（默认 {DEFAULT_COORD_PRECISION}）")
+    parser.add_argument("--profile", action="store_true",
+                        help=f"用 cProfile 包裹整次运行（主线程与工作线程合并统计，不含渲染 / 预处理进程），"
+                             f"保存至 out/{os.path.basename(PROFILE_PATH)} 并打印热点函数")
+    add_client_arguments(parser)
+    add_call_arguments(parser)
+    parser.add_argument("--fallback", choices=["none", "local"], default="none",
+                        help="模型请求失败或超过场景截止时间时的回退：local 使用本地确定性规划器")
+    add_archive_arguments(parser)
+    args = parser.parse_args(argv)
+    # 替身 Client 的输出、报告与归档写入 out/fake/，不覆盖被回放的 out/missions_plan.json
+    args.output = isolate_path(OUTPUT_CODE_JSON, args.client)
+    if args.previous_plan is None:
+        args.previous_plan = args.output
+    if args.archive == ARCHIVE_DB:
+        args.archive = isolate_path(ARCHIVE_DB, args.client)
+    return args
+
+def run(args, metrics):
+    """执行 Step 2（main 负责性能分析与指标导出）"""
+    # 替身 Client 优先读取替身 Step 1 的输出，没有时读取已记录的 zones（只读）
+    input_json = isolate_path(INPUT_JSON, args.client)
+    if not os.path.exists(input_json):
+        input_json = INPUT_JSON
+    output_json = args.output
+    routing_report_json = isolate_path(ROUTING_REPORT_JSON, args.client)
+    validation_report_json = isolate_path(VALIDATION_REPORT_JSON, args.client)
+    delta_report_json = isolate_path(DELTA_REPORT_JSON, args.client)
+    bulk_dir = isolate_path(BULK_DIR, args.client)
 
-def main():
     # 1. 检查输入文件是否存在
-    if not os.path.exists(INPUT_JSON):
-        print(f"❌ 错误: 未找到输入文件 {INPUT_JSON}")
+    if not os.path.exists(input_json):
+        print(f"❌ 错误: 未找到输入文件 {input_json}")
         print("请先运行 run_step1_vision.py 生成区域数据。")
         return
 
     # 2. 初始化
-    client = setup_client()
-    planner = MissionPlanner(client)
+    registry = FleetRegistry.load(args.fleet)
+    planner = create_planner(args, registry, metrics)
     
     # 3. 读取中间数据
-    with open(INPUT_JSON, 'r', encoding='utf-8') as f:
+    with open(input_json, 'r', encoding='utf-8') as f:
         all_zones_data = json.load(f)
     
-    print(f"🧠 [Step 2] 开始任务规划任务，加载了 {len(all_zones_data)} 条记录")
+    # 3.1 几何校验门禁（在付费规划前拒绝或修复不合格场景）
+    rejected = set()
+    if args.validate != "off":
+        all_zones_data, reports = validate_scenes(all_zones_data, repair=args.validate == "repair")
+        rejected = {name for name, report in reports.items() if not report["valid"]}
+        save_json_atomic(validation_report_json, reports)
+        repaired = sum(1 for report in reports.values() if report["repairs"])
+        print(f"📐 [Validate] {len(reports)} 个场景，修复 {repaired} 个，拒绝 {len(rejected)} 个 "
+              f"(报告: {validation_report_json})")
+
+    # 3.2 增量重规划的输入：上一帧的区域数据与任务代码（须在输出文件被覆盖前读取）
+    previous_zones, previous_plans, delta_reports = {}, {}, {}
+    if args.previous_zones:
+        previous_zones = load_json(args.previous_zones, default={}) or {}
+        previous_plans = load_json(args.previous_plan, default={}) or {}
+        print(f"🔁 [Delta] 上一帧: {len(previous_zones)} 个场景区域，{len(previous_plans)} 个场景任务代码")
+
+    # 4. 结果日志：每个场景完成即追加写入，支持中断后续跑
+    journal = ResultJournal(journal_path_for(output_json))
+    if args.resume:
+        mission_results = load_json(output_json, default={}) or {}
+        mission_results.update(journal.load())
+    else:
+        journal.reset()
+        mission_results = {}
     
-    mission_results = {}
+    print(f"🧠 [Step 2] 开始任务规划任务，加载了 {len(all_zones_data)} 条记录")
+
+    fleet = registry.to_dicts()
+    routing_reports = {}
 
-    # 4. 批量处理
+    # 4.1 离线批量作业模式：先整体提交所有待规划场景，再按原流程逐个写出结果
+    bulk_codes = None
+    if args.bulk and isinstance(planner, MissionPlanner):
+        pending = {name: zones for name, zones in all_zones_data.items()
+                   if zones and name not in rejected and not mission_results.get(name)
+                   and not (previous_zones.get(name) and previous_plans.get(name))}
+        print(f"   [Bulk] 离线批量作业模式 (后端: {args.bulk})，待规划 {len(pending)} 个场景")
+        backend = create_bulk_backend(args.bulk, planner.client, bulk_dir)
+        bulk_codes = planner.generate_bulk(pending, backend, bulk_dir, poll_interval=args.poll_interval)
+    elif args.bulk:
+        print("   [Bulk] 本地规划器无需批量作业，忽略 --bulk")
+
+    # 5. 批量处理
     count = 0
-    for file_name, zones in all_zones_data.items():
-        count += 1
-        print(f"\n--- 规划中 [{count}/{len(all_zones_data)}]: 来自 {file_name} 的数据 ---")
-        
-        if not zones:
-            print("   ⚠️ 跳过: 对应的区域数据为空")
-            mission_results[file_name] = None
-            continue
+    try:
+        for file_name, zones in all_zones_data.items():
+            count += 1
+            print(f"\n--- 规划中 [{count}/{len(all_zones_data)}]: 来自 {file_name} 的数据 ---")
+
+            if mission_results.get(file_name):
+                print("   ⏭️ 跳过: 已有任务代码 (resume)")
+                continue
             
-        # 调用规划层
-        code = planner.generate_mission_code(zones)
-        
-        if code:
-            print("   ✅ 指令生成成功")
-            mission_results[file_name] = code
-        else:
-            print("   ❌ 指令生成失败")
-            mission_results[file_name] = None
-
-    # 5. 保存最终结果
-    formatted_results = {}
-    for key, value in mission_results.items():
-        if isinstance(value, str):
-            # 去掉可能存在的空行，并按换行符分割
-            lines = [line for line in value.split('\n') if line.strip() != '']
-            formatted_results[key] = lines
-        else:
-            formatted_results[key] = value
-
-    with open(OUTPUT_CODE_JSON, 'w', encoding='utf-8') as f:
-        json.dump(formatted_results, f, ensure_ascii=False, indent=4)
-
-    print(f"\n💾 [Step 2 完成] 任务代码已保存至: {OUTPUT_CODE_JSON}")
+            if file_name in rejected:
+                print(f"   ⚠️ 跳过: 几何校验未通过 (详见 {validation_report_json})")
+                mission_results[file_name] = None
+                journal.append(file_name, None)
+                continue
+
+            if not zones:
+                print("   ⚠️ 跳过: 对应的区域数据为空")
+                mission_results[file_name] = None
+                journal.append(file_name, None)
+                continue
+                
+            # 增量重规划：保留已有任务代码，只追加差异指令
+            if previous_zones.get(file_name) and previous_plans.get(file_name):
+                with metrics.stage("delta", file_name):
+                    mission_results[file_name], report = replan_scene(
+                        previous_zones[file_name], zones, previous_plans[file_name], fleet,
+                        threshold=args.move_threshold)
+                delta_reports[file_name] = report
+                print(f"   🔁 增量重规划: 新增 {report['new']}，移动 {report['moved']}，熄灭 {report['extinguished']}，"
+                      f"受影响区域 {len(report['affected_zones'])}，追加 {len(report['delta_lines'])} 行指令")
+                journal.append(file_name, mission_results[file_name])
+                continue
+
+            # 调用规划层（批量作业模式下直接取作业结果）
+            if bulk_codes is not None:
+                code = bulk_codes.get(file_name, "")
+            else:
+                with metrics.stage("plan", file_name):
+                    code = planner.generate_mission_code(zones, scene=file_name)
+            
+            if code:
+                print("   ✅ 指令生成成功")
+                mission_results[file_name] = format_mission_code(code)
+
+                # 航线优化（可选）
+                if args.route:
+                    with metrics.stage("route", file_name):
+                        mission_results[file_name], report = route_mission_lines(
+                            mission_results[file_name], fleet, scene_scale_m=args.scene_scale)
+                    routing_reports[file_name] = report
+                    for zone_id, zone_report in report.items():
+                        if zone_report["time_to_first_drop_s"] is not None:
+                            print(f"   🛩️ {zone_id}: 预计首次投放 {zone_report['time_to_first_drop_s']:.1f}s")
+            else:
+                print("   ❌ 指令生成失败")
+                mission_results[file_name] = None
+            with metrics.stage("write", file_name):
+                journal.append(file_name, mission_results[file_name])
+    finally:
+        # 6. 压缩日志，保存最终结果（中断时也写出已完成部分）
+        with metrics.stage("write"):
+            compact_results(mission_results, output_json, order=list(all_zones_data))
+        if routing_reports:
+            save_json_atomic(routing_report_json, routing_reports)
+        if delta_reports:
+            save_json_atomic(delta_report_json, delta_reports)
+
+    print(f"\n💾 [Step 2 完成] 任务代码已保存至: {output_json}")
+    if args.archive:
+        archive_results(args.archive, all_zones_data, mission_results, find_image_paths(set(all_zones_data)),
+                        source=input_json)
+    if isinstance(planner, MissionPlanner):
+        print(f"📊 [Calls] {planner.call_layer.summary()}")
+        print(f"📊 [Tokens] {planner.usage.summary()}")
+
+def main(argv=None):
+    args = parse_args(argv)
+    metrics = RunMetrics("step2")
+    metrics_json, metrics_prom = isolate_path(METRICS_JSON, args.client), isolate_path(METRICS_PROM, args.client)
+    try:
+        with profile_run(isolate_path(PROFILE_PATH, args.client) if args.profile else None):
+            run(args, metrics)
+    finally:
+        # 中断时也导出已采集的指标
+        metrics.export(metrics_json, metrics_prom)
+        print(f"📊 [Metrics] {metrics.summary()}")
+        print(f"📊 [Metrics] 运行报告: {metrics_json}，Prometheus: {metrics_prom}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
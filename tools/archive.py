@@ -0,0 +1,447 @@
+"""
+任务归档库（SQLite，标准库 sqlite3）
+每次运行都会覆盖 out/zones_data.json 与 out/missions_plan.json，历史结果无法跨运行查询。
+本模块把每次运行的场景、区域、火点与任务代码行写入同一个 SQLite 数据库：
+- runs：运行 id、时间戳、来源说明
+- scenes：图片名称、图像内容哈希（SHA-256）、所属运行与时间戳
+- zones：风险等级、多边形、外接矩形（风险等级 + 时间建索引）
+- fire_points：火点坐标及其网格桶 (gx, gy)（网格桶建索引，用于邻近查询）
+- plan_lines：任务代码逐行保存
+支持从现有输出文件批量导入、按运行导出回当前的 JSON 格式，以及跨运行查询，例如
+“最近 7 天坐标 (0.5, 0.4) 附近的全部 High 区域”。坐标均为图像内 0~1 归一化坐标。
+
+用法：
+    python -m tools.archive ingest                          # 导入 out/ 下的当前结果
+    python -m tools.archive runs
+    python -m tools.archive zones --risk High --near 0.5,0.4,0.05 --since 7d
+    python -m tools.archive points --near 0.5,0.4,0.02 --risk High --since 2026-10-01
+    python -m tools.archive export <run_id> --zones z.json --missions m.json
+"""
+import os
+import re
+import glob
+import json
+import time
+import uuid
+import sqlite3
+import argparse
+import threading
+from datetime import datetime
+
+from tools.storage import save_json_atomic, load_json
+from tools.upload_cache import file_sha256
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ARCHIVE_DB = os.path.join(BASE_DIR, "out", "archive.db")
+ZONES_JSON = os.path.join(BASE_DIR, "out", "zones_data.json")
+MISSIONS_JSON = os.path.join(BASE_DIR, "out", "missions_plan.json")
+IMAGE_DIRS = [os.path.join(BASE_DIR, "temp"), os.path.join(BASE_DIR, "cache", "frames")]
+
+# 火点网格桶：每边 GRID_SIZE 个桶（归一化坐标下桶宽 1 / GRID_SIZE）
+GRID_SIZE = 64
+# zone 的标准字段；其余字段原样存入 extra
+ZONE_FIELDS = ("id", "risk_level", "coordinates", "fire_points", "reason", "boundary_description")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id TEXT PRIMARY KEY,
+    created_at REAL NOT NULL,
+    source TEXT
+);
+CREATE TABLE IF NOT EXISTS scenes (
+    id INTEGER PRIMARY KEY,
+    run_id TEXT NOT NULL REFERENCES runs(id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    image_hash TEXT,
+    created_at REAL NOT NULL,
+    analyzed INTEGER,
+    planned INTEGER,
+    UNIQUE (run_id, name)
+);
+CREATE TABLE IF NOT EXISTS zones (
+    id INTEGER PRIMARY KEY,
+    scene_id INTEGER NOT NULL REFERENCES scenes(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    zone_id TEXT,
+    risk_level TEXT,
+    coordinates TEXT NOT NULL,
+    reason TEXT,
+    boundary_description TEXT,
+    extra TEXT,
+    min_x REAL, min_y REAL, max_x REAL, max_y REAL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS fire_points (
+    id INTEGER PRIMARY KEY,
+    zone_row INTEGER NOT NULL REFERENCES zones(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    x REAL NOT NULL,
+    y REAL NOT NULL,
+    gx INTEGER NOT NULL,
+    gy INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS plan_lines (
+    scene_id INTEGER NOT NULL REFERENCES scenes(id) ON DELETE CASCADE,
+    line_no INTEGER NOT NULL,
+    code TEXT NOT NULL,
+    PRIMARY KEY (scene_id, line_no)
+);
+CREATE INDEX IF NOT EXISTS idx_scenes_run ON scenes(run_id, position);
+CREATE INDEX IF NOT EXISTS idx_scenes_hash ON scenes(image_hash);
+CREATE INDEX IF NOT EXISTS idx_scenes_time ON scenes(created_at);
+CREATE INDEX IF NOT EXISTS idx_zones_scene ON zones(scene_id, position);
+CREATE INDEX IF NOT EXISTS idx_zones_risk_time ON zones(risk_level, created_at);
+CREATE INDEX IF NOT EXISTS idx_points_zone ON fire_points(zone_row, position);
+CREATE INDEX IF NOT EXISTS idx_points_grid ON fire_points(gx, gy);
+"""
+
+
+def grid_bucket(value):
+    """归一化坐标 -> 网格桶编号（越界坐标夹到边缘桶）"""
+    return min(GRID_SIZE - 1, max(0, int(value * GRID_SIZE)))
+
+
+def parse_time(text):
+    """
+    解析查询时间：相对时长（30m / 12h / 7d）或 ISO 日期时间（2026-10-01 / 2026-10-01T08:00）
+    :return: Unix 时间戳；None 原样返回
+    """
+    if text is None:
+        return None
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)([mhd])", str(text).strip())
+    if match:
+        seconds = float(match.group(1)) * {"m": 60, "h": 3600, "d": 86400}[match.group(2)]
+        return time.time() - seconds
+    return datetime.fromisoformat(str(text).strip()).timestamp()
+
+
+def _format_time(timestamp):
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp))
+
+
+def find_image_paths(names, image_dirs=IMAGE_DIRS):
+    """在图片目录中按名称查找原图，返回 {名称: 路径}（找不到的名称不出现）"""
+    found = {}
+    for image_dir in image_dirs:
+        for path in glob.glob(os.path.join(image_dir, "*")):
+            name = os.path.basename(path)
+            if name in names and name not in found:
+                found[name] = path
+    return found
+
+
+def _present(results, name):
+    """scenes.analyzed / planned：NULL 表示文件中无该 key，0 表示值为 null（失败），1 表示有结果"""
+    if name not in results:
+        return None
+    return int(results[name] is not None)
+
+
+class MissionArchive:
+    def __init__(self, db_path=ARCHIVE_DB):
+        """
+        打开（不存在时创建）归档数据库
+        :param db_path: SQLite 文件路径
+        """
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        # WAL：导入时不阻塞并发查询；NORMAL 同步级别在 WAL 下仍保证数据库不损坏
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA foreign_keys=ON")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        # 让 SQLite 按需更新查询规划统计（ANALYZE），保证大量导入后仍选择合适的索引
+        self.conn.execute("PRAGMA optimize")
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    # ---------- 导入 ----------
+
+    def ingest(self, zones_data, missions=None, image_paths=None, run_id=None, created_at=None, source=None):
+        """
+        把一次运行的结果写入归档（单个事务，executemany 批量插入）
+        :param zones_data: {图片名: zones 或 None}（zones_data.json 的内容）
+        :param missions: 可选的 {图片名: 代码行列表 或 None}（missions_plan.json 的内容）
+        :param image_paths: 可选的 {图片名: 原图路径}，用于计算图像哈希
+        :param run_id: 运行 id，默认按时间生成
+        :param created_at: 运行时间戳，默认当前时间
+        :param source: 来源说明（如输入文件路径）
+        :return: 运行 id
+        """
+        missions = missions or {}
+        image_paths = image_paths or {}
+        created_at = time.time() if created_at is None else created_at
+        run_id = run_id or f"{time.strftime('%Y%m%dT%H%M%S', time.localtime(created_at))}-{uuid.uuid4().hex[:6]}"
+        names = list(zones_data) + [name for name in missions if name not in zones_data]
+        hashes = {name: file_sha256(path) for name, path in image_paths.items()
+                  if (name in zones_data or name in missions) and os.path.exists(path)}
+
+        with self._lock, self.conn:
+            self.conn.execute("INSERT INTO runs (id, created_at, source) VALUES (?, ?, ?)", (run_id, created_at, source))
+            self.conn.executemany(
+                "INSERT INTO scenes (run_id, name, position, image_hash, created_at, analyzed, planned) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(run_id, name, position, hashes.get(name), created_at,
+                  _present(zones_data, name), _present(missions, name))
+                 for position, name in enumerate(names)])
+            scene_ids = {row["name"]: row["id"] for row in
+                         self.conn.execute("SELECT id, name FROM scenes WHERE run_id = ?", (run_id,))}
+
+            zone_rows, point_groups = [], []
+            for name in names:
+                for position, zone in enumerate(zones_data.get(name) or []):
+                    coordinates = zone.get("coordinates") or []
+                    xs, ys = [p[0] for p in coordinates], [p[1] for p in coordinates]
+                    extra = {k: v for k, v in zone.items() if k not in ZONE_FIELDS}
+                    zone_rows.append((scene_ids[name], position, zone.get("id"), zone.get("risk_level"),
+                                      json.dumps(coordinates), zone.get("reason"), zone.get("boundary_description"),
+                                      json.dumps(extra, ensure_ascii=False) if extra else None,
+                                      min(xs, default=None), min(ys, default=None),
+                                      max(xs, default=None), max(ys, default=None), created_at))
+                    point_groups.append(zone.get("fire_points") or [])
+            cursor = self.conn.execute("SELECT COALESCE(MAX(id), 0) FROM zones")
+            first_zone_row = cursor.fetchone()[0] + 1
+            self.conn.executemany(
+                "INSERT INTO zones (id, scene_id, position, zone_id, risk_level, coordinates, reason, "
+                "boundary_description, extra, min_x, min_y, max_x, max_y, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(first_zone_row + i, *row) for i, row in enumerate(zone_rows)])
+            self.conn.executemany(
+                "INSERT INTO fire_points (zone_row, position, x, y, gx, gy) VALUES (?, ?, ?, ?, ?, ?)",
+                [(first_zone_row + i, position, x, y, grid_bucket(x), grid_bucket(y))
+                 for i, points in enumerate(point_groups) for position, (x, y) in enumerate(points)])
+            self.conn.executemany(
+                "INSERT INTO plan_lines (scene_id, line_no, code) VALUES (?, ?, ?)",
+                [(scene_ids[name], line_no, code)
+                 for name in names for line_no, code in enumerate(missions.get(name) or [])])
+        return run_id
+
+    def ingest_files(self, zones_path=ZONES_JSON, missions_path=MISSIONS_JSON, image_dirs=IMAGE_DIRS, run_id=None):
+        """
+        从现有输出文件导入（运行时间取 zones 文件的修改时间）
+        :return: 运行 id；zones 文件不存在时返回 None
+        """
+        zones_data = load_json(zones_path)
+        if zones_data is None:
+            return None
+        missions = load_json(missions_path, default={}) if missions_path else {}
+        image_paths = find_image_paths(set(zones_data) | set(missions or {}), image_dirs)
+        return self.ingest(zones_data, missions, image_paths, run_id=run_id,
+                           created_at=os.path.getmtime(zones_path), source=os.path.abspath(zones_path))
+
+    # ---------- 导出 ----------
+
+    def export_run(self, run_id):
+        """
+        按运行导出为当前 JSON 格式
+        :return: (zones_data, missions)，与 zones_data.json / missions_plan.json 结构一致
+        """
+        scenes = self.conn.execute(
+            "SELECT id, name, analyzed, planned FROM scenes WHERE run_id = ? ORDER BY position", (run_id,)).fetchall()
+        if not scenes:
+            raise KeyError(f"归档中不存在运行: {run_id}")
+
+        points = {}
+        for row in self.conn.execute(
+                "SELECT p.zone_row, p.x, p.y FROM scenes s JOIN zones z ON z.scene_id = s.id "
+                "JOIN fire_points p ON p.zone_row = z.id WHERE s.run_id = ? ORDER BY s.position, z.position, p.position",
+                (run_id,)):
+            points.setdefault(row["zone_row"], []).append([row["x"], row["y"]])
+        zones = {}
+        for row in self.conn.execute("SELECT z.* FROM scenes s JOIN zones z ON z.scene_id = s.id "
+                                     "WHERE s.run_id = ? ORDER BY s.position, z.position", (run_id,)):
+            zone = {"id": row["zone_id"], "risk_level": row["risk_level"],
+                    "coordinates": json.loads(row["coordinates"]), "fire_points": points.get(row["id"], [])}
+            for key in ("reason", "boundary_description"):
+                if row[key] is not None:
+                    zone[key] = row[key]
+            zone.update(json.loads(row["extra"]) if row["extra"] else {})
+            zones.setdefault(row["scene_id"], []).append(zone)
+        lines = {}
+        for row in self.conn.execute("SELECT l.scene_id, l.code FROM scenes s JOIN plan_lines l ON l.scene_id = s.id "
+                                     "WHERE s.run_id = ? ORDER BY s.position, l.line_no", (run_id,)):
+            lines.setdefault(row["scene_id"], []).append(row["code"])
+
+        zones_data = {s["name"]: zones.get(s["id"], []) if s["analyzed"] else None
+                      for s in scenes if s["analyzed"] is not None}
+        missions = {s["name"]: lines.get(s["id"], []) if s["planned"] else None
+                    for s in scenes if s["planned"] is not None}
+        return zones_data, missions
+
+    def export_files(self, run_id, zones_path, missions_path=None):
+        """按运行导出并写出 JSON 文件（原子替换）"""
+        zones_data, missions = self.export_run(run_id)
+        save_json_atomic(zones_path, zones_data)
+        if missions_path:
+            save_json_atomic(missions_path, missions)
+        return zones_data, missions
+
+    # ---------- 查询 ----------
+
+    def runs(self, limit=20):
+        """最近的运行及其场景 / 区域数"""
+        return [dict(row) for row in self.conn.execute(
+            "SELECT r.id, r.created_at, r.source, COUNT(DISTINCT s.id) AS scenes, COUNT(z.id) AS zones "
+            "FROM runs r LEFT JOIN scenes s ON s.run_id = r.id LEFT JOIN zones z ON z.scene_id = s.id "
+            "GROUP BY r.id ORDER BY r.created_at DESC LIMIT ?", (limit,))]
+
+    def query_zones(self, risk_level=None, since=None, until=None, near=None, run_id=None, image_hash=None,
+                    limit=100):
+        """
+        跨运行查询区域
+        :param risk_level: 风险等级过滤（High / Low / Monitor）
+        :param since: 起始时间戳（含）
+        :param until: 截止时间戳（不含）
+        :param near: (x, y, 半径)：外接矩形与该圆相交的区域
+        :param run_id: 限定某次运行
+        :param image_hash: 限定某张图像（内容哈希）
+        :return: 字典列表（按时间倒序），含运行 id、图片名、zone id、风险等级、火点数
+        """
+        where, params = [], []
+        for clause, value in (("z.risk_level = ?", risk_level), ("z.created_at >= ?", since),
+                              ("z.created_at < ?", until), ("s.run_id = ?", run_id), ("s.image_hash = ?", image_hash)):
+            if value is not None:
+                where.append(clause)
+                params.append(value)
+        if near is not None:
+            x, y, radius = near
+            # 点到外接矩形的距离不超过半径
+            where.append("(MAX(z.min_x - ?, 0, ? - z.max_x) * MAX(z.min_x - ?, 0, ? - z.max_x) + "
+                         "MAX(z.min_y - ?, 0, ? - z.max_y) * MAX(z.min_y - ?, 0, ? - z.max_y)) <= ?")
+            params.extend([x, x, x, x, y, y, y, y, radius * radius])
+        sql = ("SELECT s.run_id, s.name, s.image_hash, z.created_at, z.zone_id, z.risk_level, "
+               "(SELECT COUNT(*) FROM fire_points p WHERE p.zone_row = z.id) AS fire_points "
+               "FROM zones z JOIN scenes s ON s.id = z.scene_id")
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY z.created_at DESC, s.position, z.position LIMIT ?"
+        return [dict(row) for row in self.conn.execute(sql, params + [limit])]
+
+    def query_fire_points(self, x, y, radius, risk_level=None, since=None, until=None, limit=1000):
+        """
+        邻近火点查询：先按网格桶范围走索引筛选候选，再精确计算距离
+        :return: 字典列表（按距离升序），含运行 id、图片名、zone id、坐标与距离
+        """
+        gx0, gx1 = grid_bucket(x - radius), grid_bucket(x + radius)
+        gy0, gy1 = grid_bucket(y - radius), grid_bucket(y + radius)
+        where = ["p.gx BETWEEN ? AND ?", "p.gy BETWEEN ? AND ?",
+                 "(p.x - ?) * (p.x - ?) + (p.y - ?) * (p.y - ?) <= ?"]
+        params = [gx0, gx1, gy0, gy1, x, x, y, y, radius * radius]
+        for clause, value in (("z.risk_level = ?", risk_level), ("z.created_at >= ?", since),
+                              ("z.created_at < ?", until)):
+            if value is not None:
+                where.append(clause)
+                params.append(value)
+        sql = ("SELECT s.run_id, s.name, z.created_at, z.zone_id, z.risk_level, p.x, p.y, "
+               "(p.x - ?) * (p.x - ?) + (p.y - ?) * (p.y - ?) AS d2 "
+               "FROM fire_points p JOIN zones z ON z.id = p.zone_row JOIN scenes s ON s.id = z.scene_id "
+               "WHERE " + " AND ".join(where) + " ORDER BY d2 LIMIT ?")
+        rows = self.conn.execute(sql, [x, x, y, y] + params + [limit]).fetchall()
+        return [{**{k: row[k] for k in row.keys() if k != "d2"}, "distance": round(row["d2"] ** 0.5, 6)}
+                for row in rows]
+
+    def delete_run(self, run_id):
+        """删除一次运行（级联删除其场景、区域、火点与代码行）"""
+        with self._lock, self.conn:
+            return self.conn.execute("DELETE FROM runs WHERE id = ?", (run_id,)).rowcount
+
+
+def add_archive_arguments(parser):
+    """为入口脚本添加归档相关的命令行参数"""
+    parser.add_argument("--archive", nargs="?", const=ARCHIVE_DB, default=None,
+                        help=f"运行结束后把区域与任务代码导入 SQLite 归档（默认 out/{os.path.basename(ARCHIVE_DB)}）")
+
+
+def archive_results(db_path, zones_data, missions, image_paths, source=None):
+    """入口脚本收尾：导入本次运行结果并打印运行 id"""
+    with MissionArchive(db_path) as archive:
+        run_id = archive.ingest(zones_data, missions, image_paths, source=source)
+    print(f"🗄️ [Archive] 已归档运行 {run_id}（{len(zones_data)} 个场景）: {db_path}")
+    return run_id
+
+
+def _near(text):
+    x, y, radius = (float(v) for v in text.split(","))
+    return x, y, radius
+
+
+def _print_rows(rows):
+    for row in rows:
+        row = {k: (_format_time(v) if k == "created_at" else v) for k, v in row.items()}
+        print("  ".join(f"{k}={v}" for k, v in row.items()))
+    print(f"共 {len(rows)} 条")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="任务归档库：导入 / 导出 / 跨运行查询")
+    parser.add_argument("--db", default=ARCHIVE_DB, help=f"归档数据库路径（默认 out/{os.path.basename(ARCHIVE_DB)}）")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    ingest = commands.add_parser("ingest", help="从输出文件导入一次运行")
+    ingest.add_argument("--zones", default=ZONES_JSON, help="zones_data.json 路径")
+    ingest.add_argument("--missions", default=MISSIONS_JSON, help="missions_plan.json 路径（不存在时只导入区域）")
+    ingest.add_argument("--image-dir", action="append", default=None,
+                        help="查找原图以计算图像哈希的目录（可重复，默认 temp/ 与 cache/frames/）")
+    ingest.add_argument("--run-id", default=None, help="运行 id（默认按时间生成）")
+
+    export = commands.add_parser("export", help="按运行导出为 JSON")
+    export.add_argument("run_id")
+    export.add_argument("--zones", required=True, help="zones_data.json 输出路径")
+    export.add_argument("--missions", default=None, help="missions_plan.json 输出路径")
+
+    runs = commands.add_parser("runs", help="列出最近的运行")
+    runs.add_argument("--limit", type=int, default=20)
+
+    for name, help_text in (("zones", "查询区域"), ("points", "查询邻近火点")):
+        query = commands.add_parser(name, help=help_text)
+        query.add_argument("--risk", choices=["High", "Low", "Monitor"], default=None, help="风险等级")
+        query.add_argument("--since", default=None, help="起始时间：7d / 12h / 30m 或 ISO 日期")
+        query.add_argument("--until", default=None, help="截止时间：同上")
+        query.add_argument("--near", type=_near, required=name == "points", help="x,y,半径（归一化坐标）")
+        query.add_argument("--limit", type=int, default=100)
+    commands.choices["zones"].add_argument("--run-id", default=None, help="限定某次运行")
+
+    delete = commands.add_parser("delete", help="删除一次运行")
+    delete.add_argument("run_id")
+
+    args = parser.parse_args(argv)
+    with MissionArchive(args.db) as archive:
+        if args.command == "ingest":
+            start = time.monotonic()
+            run_id = archive.ingest_files(args.zones, args.missions if os.path.exists(args.missions) else None,
+                                          image_dirs=args.image_dir or IMAGE_DIRS, run_id=args.run_id)
+            if run_id is None:
+                print(f"❌ 错误: 未找到或无法解析 {args.zones}")
+                return 1
+            print(f"🗄️ [Archive] 已导入运行 {run_id}（{time.monotonic() - start:.2f}s）: {args.db}")
+        elif args.command == "export":
+            zones_data, missions = archive.export_files(args.run_id, args.zones, args.missions)
+            print(f"💾 [Archive] 已导出 {len(zones_data)} 个场景至: {args.zones}"
+                  + (f"，{args.missions}" if args.missions else ""))
+        elif args.command == "runs":
+            _print_rows(archive.runs(args.limit))
+        elif args.command == "zones":
+            _print_rows(archive.query_zones(args.risk, parse_time(args.since), parse_time(args.until), args.near,
+                                            run_id=args.run_id, limit=args.limit))
+        elif args.command == "points":
+            x, y, radius = args.near
+            _print_rows(archive.query_fire_points(x, y, radius, args.risk, parse_time(args.since),
+                                                  parse_time(args.until), limit=args.limit))
+        elif args.command == "delete":
+            print(f"🗑️ [Archive] 已删除 {archive.delete_run(args.run_id)} 次运行")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,280 @@
+"""
+离线批量作业（Gemini Batch API）
+夜间重分析历史航拍时不需要交互式延迟，但需要吞吐量和更低的成本：
+1. 把所有请求序列化为 JSONL 作业文件（每行 {"key": ..., "request": GenerateContentRequest}）
+2. 通过后端提交作业并轮询直到结束
+3. 下载结果 JSONL，按 key 映射回调用方
+提交/轮询层抽象为 BulkBackend：GeminiBulkBackend 对接 client.batches，
+LocalBulkBackend 是基于本地文件的替身，按同样的文件格式在进程内执行作业，便于测试与离线调试。
+同一作业文件（内容哈希相同）重复运行时会重新挂接到已提交的作业，不会重复提交。
+"""
+import os
+import json
+import time
+import uuid
+import hashlib
+from abc import ABC, abstractmethod
+from google.genai import types
+
+from tools.storage import save_json_atomic, load_json
+
+# 轮询间隔与超时（秒）；Batch API 的目标完成时间为 24 小时
+DEFAULT_POLL_INTERVAL = 30
+DEFAULT_TIMEOUT = 24 * 3600
+
+JOB_SUCCEEDED = "JOB_STATE_SUCCEEDED"
+JOB_FAILED_STATES = {"JOB_STATE_FAILED", "JOB_STATE_CANCELLED", "JOB_STATE_EXPIRED"}
+# 部分成功时结果文件同样可用，失败的请求以 error 行给出
+JOB_DONE_STATES = {JOB_SUCCEEDED, "JOB_STATE_PARTIALLY_SUCCEEDED"}
+
+
+def build_request(parts, config=None):
+    """
+    构建单条 GenerateContentRequest（JSON 形式）
+    :param parts: 文本（str）或已上传文件（types.File）组成的列表
+    :param config: 可选的 GenerateContentConfig，目前只序列化生成参数
+    """
+    request_parts = []
+    for part in parts:
+        if isinstance(part, str):
+            request_parts.append({"text": part})
+        else:
+            request_parts.append({"file_data": {"file_uri": part.uri, "mime_type": part.mime_type}})
+
+    request = {"contents": [{"role": "user", "parts": request_parts}]}
+    if config is not None:
+        generation_config = config.model_dump(mode="json", exclude_none=True)
+        generation_config.pop("http_options", None)
+        if generation_config:
+            request["generation_config"] = generation_config
+    return request
+
+
+def write_job_file(requests, path):
+    """
+    写出 JSONL 作业文件
+    :param requests: {key: request} 字典
+    :return: 作业文件内容的 sha256（用于识别重复提交）
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    digest = hashlib.sha256()
+    with open(path, "w", encoding="utf-8") as f:
+        for key, request in requests.items():
+            line = json.dumps({"key": key, "request": request}, ensure_ascii=False, sort_keys=True) + "\n"
+            digest.update(line.encode("utf-8"))
+            f.write(line)
+    return digest.hexdigest()
+
+
+def response_text(response):
+    """从结果行的 response（GenerateContentResponse 的 JSON 形式）中提取文本"""
+    texts = []
+    for candidate in (response or {}).get("candidates") or []:
+        for part in (candidate.get("content") or {}).get("parts") or []:
+            if "text" in part and not part.get("thought"):
+                texts.append(part["text"])
+        if texts:
+            break
+    return "".join(texts) if texts else None
+
+
+def read_results(path):
+    """
+    读取结果 JSONL
+    :return: {key: 文本}，请求失败或无文本的 key 值为 None
+    """
+    results = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            key = record.get("key")
+            if "error" in record:
+                print(f"   [Bulk Error] 请求 {key} 失败: {record['error']}")
+                results[key] = None
+            else:
+                results[key] = response_text(record.get("response"))
+    return results
+
+
+class BulkBackend(ABC):
+    """批量作业后端接口：submit / poll / fetch"""
+
+    @abstractmethod
+    def submit(self, job_file, model, display_name):
+        """提交作业文件，返回作业名称"""
+
+    @abstractmethod
+    def poll(self, job_name):
+        """返回作业状态字符串（JOB_STATE_*）"""
+
+    @abstractmethod
+    def fetch(self, job_name, output_path):
+        """把结果 JSONL 下载到 output_path"""
+
+
+class GeminiBulkBackend(BulkBackend):
+    def __init__(self, client):
+        """
+        Gemini Batch API 后端
+        :param client: 已初始化的 google.genai.Client 实例
+        """
+        self.client = client
+
+    def submit(self, job_file, model, display_name):
+        uploaded = self.client.files.upload(
+            file=job_file,
+            config=types.UploadFileConfig(display_name=display_name, mime_type="jsonl"),
+        )
+        job = self.client.batches.create(
+            model=model,
+            src=uploaded.name,
+            config=types.CreateBatchJobConfig(display_name=display_name),
+        )
+        return job.name
+
+    def poll(self, job_name):
+        job = self.client.batches.get(name=job_name)
+        return getattr(job.state, "name", str(job.state))
+
+    def fetch(self, job_name, output_path):
+        job = self.client.batches.get(name=job_name)
+        if job.dest is None or not job.dest.file_name:
+            raise RuntimeError(f"批量作业 {job_name} 没有结果文件")
+        content = self.client.files.download(file=job.dest.file_name)
+        with open(output_path, "wb") as f:
+            f.write(content)
+
+
+class LocalBulkBackend(BulkBackend):
+    def __init__(self, responder, work_dir):
+        """
+        基于本地文件的批量作业替身：作业目录中保存输入、状态与结果文件
+        :param responder: 可调用对象 (model, request) -> 文本，用于逐条执行请求
+        :param work_dir: 作业目录的根目录
+        """
+        self.responder = responder
+        self.work_dir = work_dir
+
+    def _job_dir(self, job_name):
+        return os.path.join(self.work_dir, job_name.replace("/", "_"))
+
+    def submit(self, job_file, model, display_name):
+        job_name = f"local-batches/{display_name}-{uuid.uuid4().hex[:8]}"
+        job_dir = self._job_dir(job_name)
+        os.makedirs(job_dir, exist_ok=True)
+        with open(job_file, "rb") as src, open(os.path.join(job_dir, "input.jsonl"), "wb") as dst:
+            dst.write(src.read())
+        save_json_atomic(os.path.join(job_dir, "state.json"), {"state": "JOB_STATE_PENDING", "model": model})
+        return job_name
+
+    def poll(self, job_name):
+        job_dir = self._job_dir(job_name)
+        meta = load_json(os.path.join(job_dir, "state.json"))
+        if meta is None:
+            return "JOB_STATE_FAILED"
+        if meta["state"] == "JOB_STATE_PENDING":
+            # 首次轮询时执行整个作业，模拟服务端异步处理
+            self._run(job_dir, meta["model"])
+            meta["state"] = JOB_SUCCEEDED
+            save_json_atomic(os.path.join(job_dir, "state.json"), meta)
+        return meta["state"]
+
+    def _run(self, job_dir, model):
+        tmp_path = os.path.join(job_dir, "output.jsonl.tmp")
+        with open(os.path.join(job_dir, "input.jsonl"), "r", encoding="utf-8") as src, \
+                open(tmp_path, "w", encoding="utf-8") as dst:
+            for line in src:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                try:
+                    text = self.responder(model, record["request"])
+                    result = {"key": record["key"],
+                              "response": {"candidates": [{"content": {"role": "model", "parts": [{"text": text}]}}]}}
+                except Exception as e:
+                    result = {"key": record["key"], "error": {"message": str(e)}}
+                dst.write(json.dumps(result, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, os.path.join(job_dir, "output.jsonl"))
+
+    def fetch(self, job_name, output_path):
+        with open(os.path.join(self._job_dir(job_name), "output.jsonl"), "rb") as src, open(output_path, "wb") as dst:
+            dst.write(src.read())
+
+
+def client_responder(client):
+    """LocalBulkBackend 的默认执行方式：用交互式接口逐条执行作业文件中的请求"""
+    def respond(model, request):
+        config = request.get("generation_config")
+        response = client.models.generate_content(
+            model=model,
+            contents=request["contents"],
+            config=types.GenerateContentConfig(**config) if config else None,
+        )
+        return response.text
+    return respond
+
+
+def run_bulk_job(backend, requests, work_dir, name, model,
+                 poll_interval=DEFAULT_POLL_INTERVAL, timeout=DEFAULT_TIMEOUT):
+    """
+    执行一次完整的批量作业：写作业文件 -> 提交（或挂接已提交的同一作业）-> 轮询 -> 下载结果
+    :param backend: BulkBackend 实例
+    :param requests: {key: request} 字典
+    :param work_dir: 作业文件、作业记录与结果文件的保存目录
+    :param name: 作业名称前缀（如 step1 / step2）
+    :param model: 模型名称
+    :param poll_interval: 轮询间隔（秒）
+    :param timeout: 等待超时（秒），超时抛出 TimeoutError（作业记录保留，下次运行会重新挂接）
+    :return: {key: 文本或 None}
+    """
+    if not requests:
+        return {}
+
+    job_file = os.path.join(work_dir, f"{name}_requests.jsonl")
+    record_path = os.path.join(work_dir, f"{name}_job.json")
+    result_path = os.path.join(work_dir, f"{name}_results.jsonl")
+    digest = write_job_file(requests, job_file)
+
+    record = load_json(record_path)
+    if record and record.get("digest") == digest and record.get("model") == model:
+        job_name = record["job_name"]
+        print(f"   [Bulk] 挂接已提交的批量作业: {job_name}")
+    else:
+        job_name = backend.submit(job_file, model, f"{name}-{digest[:12]}")
+        save_json_atomic(record_path, {"job_name": job_name, "digest": digest, "model": model,
+                                       "requests": len(requests), "submitted_at": time.time()})
+        print(f"   [Bulk] 已提交批量作业: {job_name} ({len(requests)} 条请求)")
+
+    deadline = time.monotonic() + timeout
+    while True:
+        state = backend.poll(job_name)
+        if state in JOB_DONE_STATES:
+            break
+        if state in JOB_FAILED_STATES:
+            os.remove(record_path)
+            raise RuntimeError(f"批量作业 {job_name} 结束于状态 {state}")
+        if time.monotonic() >= deadline:
+            raise TimeoutError(f"等待批量作业 {job_name} 超时（当前状态 {state}）")
+        print(f"   [Bulk] 作业状态: {state}，{poll_interval}s 后重试")
+        time.sleep(poll_interval)
+
+    backend.fetch(job_name, result_path)
+    os.remove(record_path)
+    results = read_results(result_path)
+    print(f"   [Bulk] 作业完成: {sum(1 for v in results.values() if v)}/{len(requests)} 条请求返回结果")
+    return results
+
+
+def create_bulk_backend(kind, client, work_dir):
+    """
+    根据命令行参数创建批量作业后端
+    :param kind: gemini（Batch API）或 local（本地替身，用交互式接口逐条执行）
+    """
+    if kind == "local":
+        return LocalBulkBackend(client_responder(client), os.path.join(work_dir, "local_jobs"))
+    return GeminiBulkBackend(client)
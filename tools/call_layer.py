@@ -0,0 +1,243 @@
+"""
+模型调用层（Step 1 / Step 2 共用）
+- 单次请求超时：请求在工作线程中执行，超时即放弃等待；同步 SDK 调用无法从外部中止，
+  因此真实 Client 同时设置 HTTP 超时（setup_client 的 timeout），让被放弃的请求在 SDK 内部结束
+- 超时后重试前先等待被放弃的请求结束（期间返回成功则直接采用）；宽限期后仍未结束时不再重试，
+  避免后台线程随重试不断堆积
+- 可重试错误（超时、429、5xx、网络错误）按带随机抖动的指数退避重试
+- 可选对冲请求：首个请求在历史 p95 延迟内未返回时再发一个相同请求，先返回者胜出
+- 场景截止时间：所有重试与对冲共享一个截止时间，超过后抛出 DeadlineExceeded，由调用方降级为回退结果
+"""
+import time
+import random
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import httpx
+from google.genai import errors
+
+# 默认参数
+DEFAULT_TIMEOUT = 120.0          # 单次请求超时（秒）
+DEFAULT_MAX_RETRIES = 3          # 最大重试次数（不含首次请求）
+DEFAULT_BASE_DELAY = 1.0         # 退避基准时间（秒）
+DEFAULT_MAX_DELAY = 30.0         # 单次退避上限（秒）
+HEDGE_QUANTILE = 0.95            # 对冲延迟取历史延迟的分位数
+HEDGE_MIN_SAMPLES = 10           # 样本数不足时不对冲
+LATENCY_WINDOW = 200             # 延迟统计窗口（最近 N 次成功请求）
+ABANDON_GRACE = 5.0              # 超时后等待被放弃请求结束的最短时间（秒）
+
+# 可重试的 HTTP 状态码
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+class CallTimeout(TimeoutError):
+    """单次请求超时"""
+
+    def __init__(self, message, pending=()):
+        """
+        :param pending: 超时时仍在执行的请求（Future 集合）
+        """
+        super().__init__(message)
+        self.pending = set(pending)
+
+
+class DeadlineExceeded(TimeoutError):
+    """超过场景截止时间"""
+
+
+def is_retryable(error):
+    """判断异常是否值得重试"""
+    if isinstance(error, CallTimeout):
+        return True
+    if isinstance(error, errors.APIError):
+        return error.code in RETRYABLE_STATUS
+    return isinstance(error, (httpx.TransportError, ConnectionError))
+
+
+class ModelCaller:
+    def __init__(self, timeout=DEFAULT_TIMEOUT, max_retries=DEFAULT_MAX_RETRIES, base_delay=DEFAULT_BASE_DELAY,
+                 max_delay=DEFAULT_MAX_DELAY, hedge=False, max_workers=32):
+        """
+        初始化调用层
+        :param timeout: 单次请求超时（秒），None 表示不限
+        :param max_retries: 可重试错误的最大重试次数
+        :param base_delay: 指数退避的基准时间（秒）
+        :param max_delay: 单次退避上限（秒）
+        :param hedge: 是否启用对冲请求
+        :param max_workers: 执行请求的线程数（被放弃的对冲副本也会占用线程直到结束；
+                            超时的请求未结束前不会重试，因此每个调用最多同时占用 2 个线程）
+        """
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.hedge = hedge
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="model-call")
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self.stats = {"calls": 0, "retries": 0, "timeouts": 0, "hedges": 0, "hedge_wins": 0,
+                      "deadline_exceeded": 0, "failures": 0, "retries_skipped": 0}
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self.stats[key] += n
+
+    @staticmethod
+    def deadline_after(seconds):
+        """把相对时长换算为截止时间（monotonic），None 表示无截止时间"""
+        return None if seconds is None else time.monotonic() + seconds
+
+    def hedge_delay(self):
+        """对冲延迟：最近成功请求延迟的 p95，样本不足时返回 None（不对冲）"""
+        with self._lock:
+            if len(self._latencies) < HEDGE_MIN_SAMPLES:
+                return None
+            ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(HEDGE_QUANTILE * len(ordered)))]
+
+    def backoff(self, attempt):
+        """第 attempt 次重试前的等待时间（full jitter 指数退避）"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def _timed(self, fn):
+        start = time.monotonic()
+        result = fn()
+        return result, time.monotonic() - start
+
+    def _attempt(self, fn, timeout, hedge):
+        """执行一次请求（可能包含一个对冲副本），返回首个成功结果"""
+        start = time.monotonic()
+        end = None if timeout is None else start + timeout
+        hedge_at = None
+        if hedge:
+            delay = self.hedge_delay()
+            hedge_at = None if delay is None else start + delay
+
+        futures = {self._executor.submit(self._timed, fn): False}
+        last_error = None
+        while futures:
+            now = time.monotonic()
+            if end is not None and now >= end:
+                raise CallTimeout(f"请求超过 {timeout:.1f}s 未返回", pending=futures)
+            wait_for = None if end is None else end - now
+            if hedge_at is not None:
+                wait_for = max(0.0, hedge_at - now) if wait_for is None else min(wait_for, max(0.0, hedge_at - now))
+
+            done, _ = wait(list(futures), timeout=wait_for, return_when=FIRST_COMPLETED)
+            for future in done:
+                is_hedge = futures.pop(future)
+                if future.exception() is None:
+                    result, latency = future.result()
+                    with self._lock:
+                        self._latencies.append(latency)
+                    if is_hedge:
+                        self._count("hedge_wins")
+                    return result
+                last_error = future.exception()
+
+            # 首个请求仍未返回且到达对冲时间：发出一个相同请求
+            if hedge_at is not None and futures and time.monotonic() >= hedge_at:
+                futures[self._executor.submit(self._timed, fn)] = True
+                hedge_at = None
+                self._count("hedges")
+        raise last_error
+
+    def call(self, fn, deadline=None, hedge=None, on_retry=None):
+        """
+        带超时、重试与对冲地执行一次模型调用
+        :param fn: 无参可调用对象，执行实际请求并返回结果
+        :param deadline: 截止时间（time.monotonic() 时刻），None 表示不限
+        :param hedge: 是否对冲，None 表示使用默认设置（流式等有副作用的请求应传 False）
+        :param on_retry: 可选回调，每次重试前调用（用于按图片 / 场景统计重试次数）
+        :return: fn 的返回值
+        """
+        hedge = self.hedge if hedge is None else hedge
+        self._count("calls")
+        for attempt in range(self.max_retries + 1):
+            timeout = self.timeout
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._count("deadline_exceeded")
+                    raise DeadlineExceeded("已超过场景截止时间")
+                timeout = remaining if timeout is None else min(timeout, remaining)
+
+            try:
+                return self._attempt(fn, timeout, hedge)
+            except Exception as e:
+                if isinstance(e, CallTimeout):
+                    self._count("timeouts")
+                    if deadline is not None and time.monotonic() >= deadline:
+                        self._count("deadline_exceeded")
+                        raise DeadlineExceeded("已超过场景截止时间") from e
+                if not is_retryable(e) or attempt == self.max_retries:
+                    self._count("failures")
+                    raise
+                delay = self.backoff(attempt)
+                if deadline is not None and time.monotonic() + delay >= deadline:
+                    self._count("deadline_exceeded")
+                    raise DeadlineExceeded("重试等待将超过场景截止时间") from e
+                if isinstance(e, CallTimeout) and e.pending:
+                    # 被放弃的请求仍在执行：等它结束后再重试，期间成功返回则直接采用
+                    late = self._await_abandoned(e.pending, max(delay, ABANDON_GRACE), deadline)
+                    if late is not None:
+                        return late[0]
+                    if any(not future.done() for future in e.pending):
+                        self._count("retries_skipped")
+                        self._count("failures")
+                        print(f"   [Retry] 超时的请求仍未结束，跳过重试: {e}")
+                        raise
+                    delay = 0.0
+                print(f"   [Retry] 第 {attempt + 1} 次重试（{delay:.1f}s 后）: {e}")
+                self._count("retries")
+                if on_retry is not None:
+                    on_retry()
+                time.sleep(delay)
+
+    def _await_abandoned(self, pending, grace, deadline):
+        """
+        等待超时被放弃的请求结束
+        :param grace: 最长等待时间（秒），不超过截止时间
+        :return: (结果,) 若期间有请求成功返回，否则 None
+        """
+        end = time.monotonic() + grace
+        if deadline is not None:
+            end = min(end, deadline)
+        pending = set(pending)
+        while pending:
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                break
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    result, latency = future.result()
+                    with self._lock:
+                        self._latencies.append(latency)
+                    return (result,)
+        return None
+
+    def summary(self):
+        """一行调用统计"""
+        s = self.stats
+        return (f"调用 {s['calls']} 次，重试 {s['retries']}，超时 {s['timeouts']}，对冲 {s['hedges']}"
+                f"（胜出 {s['hedge_wins']}），超过截止时间 {s['deadline_exceeded']}，失败 {s['failures']}"
+                f"（超时请求未结束而跳过重试 {s['retries_skipped']}）")
+
+
+def add_call_arguments(parser):
+    """为入口脚本添加调用层相关的命令行参数"""
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT,
+                        help=f"单次模型请求超时/秒（默认 {DEFAULT_TIMEOUT}）")
+    parser.add_argument("--retries", type=int, default=DEFAULT_MAX_RETRIES,
+                        help=f"可重试错误（超时/429/5xx/网络）的最大重试次数（默认 {DEFAULT_MAX_RETRIES}）")
+    parser.add_argument("--hedge", action="store_true",
+                        help="对冲请求：超过历史 p95 延迟未返回时再发一个相同请求，先返回者胜出")
+    parser.add_argument("--scene-deadline", type=float, default=None,
+                        help="每个场景的总截止时间/秒（含重试与对冲），超过后降级为回退结果")
+
+
+def create_call_layer(args):
+    """根据命令行参数创建 ModelCaller"""
+    return ModelCaller(timeout=args.timeout, max_retries=args.retries, hedge=args.hedge)
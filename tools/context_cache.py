@@ -0,0 +1,72 @@
+"""
+服务端上下文缓存（Gemini Context Caching）
+把每次请求都相同的长前缀（Step 1 的 task_prompt_json、Step 2 的静态 Prompt 前缀）
+通过 client.caches.create 注册为缓存上下文，之后每个请求只需发送变化的部分。
+创建失败（如前缀低于模型的最小缓存 token 数、模型不支持）时返回 None，调用方回退为完整发送。
+"""
+import hashlib
+import threading
+from datetime import datetime, timedelta, timezone
+from google.genai import types
+
+# 缓存上下文的存活时间（秒）
+DEFAULT_TTL_SECONDS = 3600
+# 过期前预留的安全余量，临近过期时重新创建
+EXPIRY_MARGIN = timedelta(minutes=5)
+
+
+class ContextCache:
+    def __init__(self, client, model, ttl_seconds=DEFAULT_TTL_SECONDS):
+        """
+        初始化上下文缓存管理器
+        :param client: 已初始化的 google.genai.Client 实例
+        :param model: 缓存绑定的模型名称（须与请求使用的模型一致）
+        :param ttl_seconds: 缓存存活时间
+        """
+        self.client = client
+        self.model = model
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._entries = {}      # 前缀哈希 -> (缓存名称, 过期时间)
+        self._failed = set()    # 创建失败的前缀哈希，本进程内不再重试
+
+    def get(self, prefix_text, display_name=None):
+        """
+        获取前缀对应的缓存名称，必要时创建
+        :return: 缓存名称（用于 GenerateContentConfig.cached_content），不可用时返回 None
+        """
+        key = hashlib.sha256(prefix_text.encode("utf-8")).hexdigest()
+        with self._lock:
+            if key in self._failed:
+                return None
+
+            entry = self._entries.get(key)
+            now = datetime.now(timezone.utc)
+            if entry is not None and entry[1] - EXPIRY_MARGIN > now:
+                return entry[0]
+
+            try:
+                cache = self.client.caches.create(
+                    model=self.model,
+                    config=types.CreateCachedContentConfig(
+                        contents=[prefix_text],
+                        ttl=f"{self.ttl_seconds}s",
+                        display_name=display_name or f"prefix-{key[:12]}",
+                    ),
+                )
+            except Exception as e:
+                print(f"   [Context Cache] 创建缓存上下文失败，回退为完整发送: {e}")
+                self._failed.add(key)
+                return None
+
+            expire_time = cache.expire_time or now + timedelta(seconds=self.ttl_seconds)
+            if expire_time.tzinfo is None:
+                expire_time = expire_time.replace(tzinfo=timezone.utc)
+            self._entries[key] = (cache.name, expire_time)
+            print(f"   [Context Cache] 已注册缓存上下文: {cache.name}")
+            return cache.name
+
+    @staticmethod
+    def config_with(config, cache_name):
+        """返回附带 cached_content 的配置副本"""
+        return config.model_copy(update={"cached_content": cache_name})
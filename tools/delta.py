@@ -0,0 +1,316 @@
+"""
+增量重规划（相邻两帧的区域差异）
+同一场景重新成像后，只对发生变化的部分生成追加指令，未受影响的 FlyToFire 保持不变：
+1. 火点匹配：归一化坐标上的网格索引（格子边长 = 距离阈值）+ 按距离贪心匹配，
+   分类为 new（新增）/ extinguished（熄灭）/ moved（移动）/ unchanged（不变）
+2. 区域匹配：两帧 zone 栅格化后按 IoU 贪心匹配（模型可能重新编号 zone id）
+3. 追加指令：
+   - moved：原 UAV 直接改飞新坐标（FlyToFire 覆盖当前航点，计划中的原指令改写为新坐标）
+   - new：优先使用该区域内仍有载荷余量的 UAV，不足时从未参与任务的可用灭火机中补充
+   - extinguished：从计划中删除对应 FlyToFire 并释放载荷；所有目标都熄灭且未被再分配的 UAV 回到区域搜索
+   - 新出现的区域：按本地规划器的法则单独规划
+"""
+import re
+import numpy as np
+
+from tools.geometry import rasterize_zones
+from tools.routing import parse_plan_lines
+from tools.planner import plan_mission_lines, zone_variable_name, is_available, can_extinguish, get_payload
+
+# 火点匹配的距离阈值（归一化坐标），超过该距离视为熄灭 + 新增
+MOVE_THRESHOLD = 0.05
+# 匹配距离不超过该值视为未移动
+STILL_TOLERANCE = 1e-3
+# 区域匹配的最小 IoU
+MIN_ZONE_IOU = 0.3
+# 区域匹配使用的栅格分辨率
+ZONE_RESOLUTION = 64
+
+
+class PointGrid:
+    def __init__(self, points, cell_size):
+        """
+        均匀网格点索引（归一化坐标）
+        :param points: (N, 2) 点坐标
+        :param cell_size: 格子边长，半径不超过该值的查询只需检查 3x3 个格子
+        """
+        self.points = np.asarray(points, dtype=float).reshape(-1, 2)
+        self.cell_size = cell_size
+        self._cells = {}
+        for index, cell in enumerate(map(tuple, np.floor(self.points / cell_size).astype(int))):
+            self._cells.setdefault(cell, []).append(index)
+
+    def query(self, point, radius):
+        """返回距离 point 不超过 radius 的点 [(下标, 距离)]"""
+        cx, cy = np.floor(np.asarray(point, dtype=float) / self.cell_size).astype(int)
+        reach = int(np.ceil(radius / self.cell_size))
+        candidates = [i for dx in range(-reach, reach + 1) for dy in range(-reach, reach + 1)
+                      for i in self._cells.get((cx + dx, cy + dy), ())]
+        if not candidates:
+            return []
+        distances = np.hypot(*(self.points[candidates] - np.asarray(point, dtype=float)).T)
+        return [(i, float(d)) for i, d in zip(candidates, distances) if d <= radius]
+
+
+def _flatten_points(zones):
+    """展开火点：[(zone_id, [x, y])]"""
+    return [(zone.get("id"), list(point)) for zone in zones or [] for point in zone.get("fire_points") or []]
+
+
+def match_points(prev_points, new_points, threshold=MOVE_THRESHOLD):
+    """
+    火点贪心匹配（全局按距离从小到大）
+    :return: [(prev 下标, new 下标, 距离)]
+    """
+    if not prev_points or not new_points:
+        return []
+    grid = PointGrid(prev_points, threshold)
+    pairs = sorted(((d, j, i) for i, point in enumerate(new_points) for j, d in grid.query(point, threshold)))
+    used_prev, used_new, matches = set(), set(), []
+    for d, j, i in pairs:
+        if j in used_prev or i in used_new:
+            continue
+        used_prev.add(j)
+        used_new.add(i)
+        matches.append((j, i, d))
+    return matches
+
+
+def match_zones(prev_zones, new_zones, min_iou=MIN_ZONE_IOU, resolution=ZONE_RESOLUTION):
+    """
+    区域贪心匹配（按 IoU 从大到小）
+    :return: {new zone id: prev zone id}
+    """
+    if not prev_zones or not new_zones:
+        return {}
+    prev_masks = rasterize_zones(prev_zones, resolution).astype(np.int32)
+    new_masks = rasterize_zones(new_zones, resolution).astype(np.int32)
+    inter = new_masks @ prev_masks.T
+    union = new_masks.sum(axis=1)[:, None] + prev_masks.sum(axis=1)[None, :] - inter
+    with np.errstate(divide="ignore", invalid="ignore"):
+        iou = np.where(union > 0, inter / union, 0.0)
+
+    mapping, used_prev = {}, set()
+    for flat in np.argsort(-iou, axis=None):
+        i, j = np.unravel_index(flat, iou.shape)
+        if iou[i, j] < min_iou:
+            break
+        new_id, prev_id = new_zones[i].get("id"), prev_zones[j].get("id")
+        if new_id in mapping or prev_id in used_prev:
+            continue
+        mapping[new_id] = prev_id
+        used_prev.add(prev_id)
+    return mapping
+
+
+def compute_scene_delta(prev_zones, new_zones, threshold=MOVE_THRESHOLD):
+    """
+    计算两帧之间的差异
+    :return: 差异字典（火点 new / moved / extinguished / unchanged，区域 matched / added / removed / affected）
+    """
+    prev_points = _flatten_points(prev_zones)
+    new_points = _flatten_points(new_zones)
+    matches = match_points([p for _, p in prev_points], [p for _, p in new_points], threshold)
+
+    moved, unchanged = [], 0
+    for j, i, d in matches:
+        if d <= STILL_TOLERANCE:
+            unchanged += 1
+        else:
+            moved.append({"zone": new_points[i][0], "from": prev_points[j][1], "to": new_points[i][1]})
+    matched_prev = {j for j, _, _ in matches}
+    matched_new = {i for _, i, _ in matches}
+    new = [{"zone": z, "point": p} for i, (z, p) in enumerate(new_points) if i not in matched_new]
+    extinguished = [{"zone": z, "point": p} for j, (z, p) in enumerate(prev_points) if j not in matched_prev]
+
+    zone_map = match_zones(prev_zones, new_zones)
+    prev_by_id = {zone.get("id"): zone for zone in prev_zones or []}
+    added = [zone.get("id") for zone in new_zones or [] if zone.get("id") not in zone_map]
+    removed = [zid for zid in prev_by_id if zid not in set(zone_map.values())]
+
+    affected = set(added)
+    affected.update(item["zone"] for item in new + moved)
+    for zone in new_zones or []:
+        prev = prev_by_id.get(zone_map.get(zone.get("id")))
+        if prev is not None and prev.get("risk_level") != zone.get("risk_level"):
+            affected.add(zone.get("id"))
+    inverse = {prev_id: new_id for new_id, prev_id in zone_map.items()}
+    affected.update(inverse.get(item["zone"], item["zone"]) for item in extinguished)
+
+    return {
+        "new": new,
+        "moved": moved,
+        "extinguished": extinguished,
+        "unchanged": unchanged,
+        "zone_map": zone_map,
+        "added_zones": added,
+        "removed_zones": removed,
+        "affected_zones": sorted(affected, key=str),
+    }
+
+
+def _point_key(point):
+    return tuple(round(float(v), 5) for v in point)
+
+
+def _rename_var(lines, old, new):
+    pattern = re.compile(rf"\b{re.escape(old)}\b")
+    return [pattern.sub(new, line) for line in lines]
+
+
+def replan_scene(prev_zones, new_zones, prev_lines, fleet, threshold=MOVE_THRESHOLD):
+    """
+    基于差异在已有任务代码之上生成追加指令
+    :param prev_zones: 上一帧的 zone 列表
+    :param new_zones: 新一帧的 zone 列表
+    :param prev_lines: 上一帧的任务代码行（missions_plan.json 中的 value）
+    :param fleet: 无人机字典列表
+    :return: (更新后的代码行, 报告)；熄灭火点的 FlyToFire 被删除，移动火点的 FlyToFire 原位改写为新坐标，
+             其余追加指令接在末尾。报告中的 delta_lines 为需要下发给机群的增量指令
+    """
+    delta = compute_scene_delta(prev_zones, new_zones, threshold)
+    uav_lists, zone_vars, fly_calls = parse_plan_lines(prev_lines)
+    var_by_zone = {zone_id: var for var, zone_id in zone_vars.items()}
+    uav_by_id = {uav["id"]: uav for uav in fleet}
+
+    # 已有计划中每个火点的执行者、所在行号与每架 UAV 的已分配火点数
+    owner_of, line_of, assigned = {}, {}, {}
+    for line_no, var, idx, point in fly_calls:
+        owner_of[_point_key(point)] = (var, idx)
+        line_of[_point_key(point)] = line_no
+        assigned[(var, idx)] = assigned.get((var, idx), 0) + 1
+    used_ids = {uav_id for ids in uav_lists.values() for uav_id in ids}
+    taken_vars = set(uav_lists)
+
+    def fresh_var(zone_id):
+        base = zone_variable_name(zone_id)[:-len("_uavs")]
+        n = 1
+        while f"{base}_d{n}_uavs" in taken_vars:
+            n += 1
+        taken_vars.add(f"{base}_d{n}_uavs")
+        return f"{base}_d{n}_uavs"
+
+    def remaining(var, idx):
+        uav = uav_by_id.get(uav_lists[var][idx])
+        return get_payload(uav) - assigned.get((var, idx), 0) if uav and can_extinguish(uav) else 0
+
+    lines, unassigned = [], []
+    # 被取代的原指令：行号 -> 改写后的行（None 表示删除），保证每架 UAV 的 FlyToFire 数不超过载荷
+    superseded = {}
+
+    # 1. 熄灭：删除原指令并释放载荷，记录目标全部熄灭的 UAV
+    idle_slots = {}
+    for item in delta["extinguished"]:
+        key = _point_key(item["point"])
+        owner = owner_of.get(key)
+        if owner is None or line_of[key] in superseded:
+            continue
+        superseded[line_of[key]] = None
+        assigned[owner] -= 1
+        if assigned[owner] == 0:
+            idle_slots.setdefault(item["zone"], []).append(owner)
+
+    # 2. 移动：原 UAV 直接改飞新坐标（原指令原位改写，不占用新的载荷）
+    for item in delta["moved"]:
+        key = _point_key(item["from"])
+        owner = owner_of.get(key)
+        if owner is None or line_of[key] in superseded:
+            delta["new"].append({"zone": item["zone"], "point": item["to"]})
+            continue
+        line = f"FlyToFire({owner[0]}[{owner[1]}], {list(item['to'])!r})"
+        superseded[line_of[key]] = line
+        lines.append(line)
+    rewritten = len(lines)
+
+    # 3. 新增火点（已匹配区域）：区域内有余量的 UAV 优先，不足时补充未参与任务的灭火机
+    added = set(delta["added_zones"])
+    new_by_zone = {}
+    for item in delta["new"]:
+        if item["zone"] not in added:
+            new_by_zone.setdefault(item["zone"], []).append(item["point"])
+    for zone_id, points in new_by_zone.items():
+        var = var_by_zone.get(delta["zone_map"].get(zone_id))
+        pending = []
+        for point in points:
+            slot = None
+            if var is not None:
+                slot = next(((var, i) for i in range(len(uav_lists[var])) if remaining(var, i) > 0), None)
+            if slot is None:
+                pending.append(point)
+                continue
+            assigned[slot] = assigned.get(slot, 0) + 1
+            for slots in idle_slots.values():
+                if slot in slots:
+                    slots.remove(slot)
+            lines.append(f"FlyToFire({slot[0]}[{slot[1]}], {list(point)!r})")
+
+        if pending:
+            # 候选：目标已全部熄灭的 UAV（剩余载荷）优先，其次是未参与任务的可用灭火机
+            reserve = [(uav_by_id[uav_lists[v][i]], remaining(v, i), (z, (v, i)))
+                       for z, slots in idle_slots.items() for v, i in slots if remaining(v, i) > 0]
+            reserve += [(u, get_payload(u), None) for u in fleet
+                        if u["id"] not in used_ids and is_available(u) and can_extinguish(u)]
+            chosen, capacity = [], 0
+            for uav, cap, freed in reserve:
+                if capacity >= len(pending):
+                    break
+                chosen.append((uav, cap))
+                capacity += cap
+                if freed is not None:
+                    idle_slots[freed[0]].remove(freed[1])
+            if not chosen:
+                unassigned.extend({"zone": zone_id, "point": p} for p in pending)
+                continue
+            new_var = fresh_var(delta["zone_map"].get(zone_id, zone_id))
+            used_ids.update(u["id"] for u, _ in chosen)
+            lines.append(f"{new_var} = {[u['id'] for u, _ in chosen]!r}")
+            lines.append(f"SearchArea({new_var}, {delta['zone_map'].get(zone_id, zone_id)!r})")
+            slot, used = 0, 0
+            for point in pending:
+                while slot < len(chosen) and used >= chosen[slot][1]:
+                    slot, used = slot + 1, 0
+                if slot >= len(chosen):
+                    unassigned.append({"zone": zone_id, "point": point})
+                    continue
+                lines.append(f"FlyToFire({new_var}[{slot}], {list(point)!r})")
+                used += 1
+
+    # 4. 目标全部熄灭且未再分配的 UAV 回到区域搜索
+    for zone_id, slots in idle_slots.items():
+        if not slots:
+            continue
+        ids = [uav_lists[var][idx] for var, idx in slots]
+        new_var = fresh_var(zone_id)
+        lines.append(f"{new_var} = {ids!r}")
+        lines.append(f"SearchArea({new_var}, {zone_vars.get(slots[0][0], zone_id)!r})")
+
+    # 5. 新出现的区域：用未参与任务的可用 UAV 单独规划
+    new_zones_by_id = {zone.get("id"): zone for zone in new_zones or []}
+    for zone_id in delta["added_zones"]:
+        spare = [u for u in fleet if u["id"] not in used_ids]
+        zone_lines = plan_mission_lines([new_zones_by_id[zone_id]], spare)
+        if not zone_lines:
+            unassigned.extend({"zone": zone_id, "point": p} for p in new_zones_by_id[zone_id].get("fire_points") or [])
+            continue
+        plan_var = zone_variable_name(zone_id)
+        if plan_var in taken_vars:
+            zone_lines = _rename_var(zone_lines, plan_var, fresh_var(zone_id))
+        taken_vars.add(plan_var)
+        used_ids.update(uav_id for ids in parse_plan_lines(zone_lines)[0].values() for uav_id in ids)
+        lines.extend(zone_lines)
+
+    report = {
+        "new": len(delta["new"]),
+        "moved": len(delta["moved"]),
+        "extinguished": len(delta["extinguished"]),
+        "unchanged": delta["unchanged"],
+        "zone_map": delta["zone_map"],
+        "added_zones": delta["added_zones"],
+        "removed_zones": delta["removed_zones"],
+        "affected_zones": delta["affected_zones"],
+        "unassigned_points": unassigned,
+        "delta_lines": lines,
+    }
+    # 改写的移动指令已在原位，其余增量指令（第 3 步起）接在末尾
+    kept = [superseded.get(i, line) for i, line in enumerate(prev_lines)]
+    return [line for line in kept if line is not None] + lines[rewritten:], report
@@ -0,0 +1,232 @@
+"""
+本地替身 Client（不访问网络、不消耗配额）
+实现流水线用到的 google.genai.Client 接口子集：
+- files.upload：返回带过期时间的 types.File，不读取文件内容
+- models.generate_content / generate_content_stream：回放 out/zones_data.json 与 out/missions_plan.json 中的已记录响应
+- caches.create：返回虚拟的缓存上下文名称
+请求耗时、错误率与 token 数均可配置，用于基准测试与离线调试流水线本身的开销。
+分布写法：const:0.5 / uniform:0.2,1.5 / lognormal:1.0,0.5（中位数, sigma）/ exp:0.8（均值），单位秒。
+"""
+import os
+import json
+import math
+import time
+import zlib
+import random
+import threading
+from datetime import datetime, timedelta, timezone
+
+from google.genai import types, errors
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ZONES_JSON = os.path.join(BASE_DIR, "out", "zones_data.json")
+MISSIONS_JSON = os.path.join(BASE_DIR, "out", "missions_plan.json")
+
+# 估算 token 数：文本约 4 字符 / token，每张图像按固定 token 数计
+CHARS_PER_TOKEN = 4
+IMAGE_TOKENS = 258
+# 模拟错误时使用的可重试状态码
+ERROR_CODES = (429, 503)
+# 流式响应的分片长度（字符）
+STREAM_CHUNK_CHARS = 64
+# 上传文件的有效期（与 Gemini Files API 相同）
+FILE_TTL = timedelta(hours=48)
+
+
+def parse_distribution(spec, rng=random):
+    """
+    解析耗时分布，返回无参采样函数（秒）
+    :param spec: None / 数字 / "const:x" / "uniform:a,b" / "lognormal:median,sigma" / "exp:mean"
+    :param rng: 随机数生成器（random.Random 实例）
+    """
+    if spec is None:
+        return lambda: 0.0
+    if isinstance(spec, (int, float)):
+        return lambda: float(spec)
+    kind, _, params = str(spec).partition(":")
+    if not params:
+        kind, params = "const", kind
+    values = [float(v) for v in params.split(",")]
+    if kind == "const":
+        return lambda: values[0]
+    if kind == "uniform":
+        return lambda: rng.uniform(values[0], values[1])
+    if kind == "lognormal":
+        mu = math.log(values[0]) if values[0] > 0 else 0.0
+        return lambda: rng.lognormvariate(mu, values[1])
+    if kind == "exp":
+        return lambda: rng.expovariate(1.0 / values[0]) if values[0] > 0 else 0.0
+    raise ValueError(f"不支持的分布: {spec}")
+
+
+def _load_records(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f) or {}
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+
+def _iter_parts(contents):
+    """把 contents（str / types.File / 批量作业的 JSON 形式）展开为 ("text"|"file", 值)"""
+    for item in contents if isinstance(contents, list) else [contents]:
+        if isinstance(item, str):
+            yield "text", item
+        elif isinstance(item, types.File):
+            yield "file", item.name or item.uri or ""
+        elif isinstance(item, dict):
+            for part in item.get("parts") or []:
+                if "text" in part:
+                    yield "text", part["text"]
+                elif "file_data" in part:
+                    yield "file", part["file_data"].get("file_uri", "")
+
+
+class _FakeFiles:
+    def __init__(self, owner):
+        self._owner = owner
+
+    def upload(self, file, config=None):
+        self._owner._sleep(self._owner.upload_latency)
+        with self._owner._lock:
+            self._owner.stats["uploads"] += 1
+        name = os.path.basename(str(file))
+        return types.File(
+            name=f"files/{name}",
+            uri=f"fake://files/{name}",
+            mime_type="image/png" if name.lower().endswith(".png") else "image/jpeg",
+            expiration_time=datetime.now(timezone.utc) + FILE_TTL,
+        )
+
+
+class _FakeCaches:
+    def __init__(self, owner):
+        self._owner = owner
+
+    def create(self, model, config=None):
+        ttl = int(str(getattr(config, "ttl", None) or "3600s").rstrip("s"))
+        return types.CachedContent(name=f"cachedContents/fake-{self._owner._random.getrandbits(32):08x}",
+                                   expire_time=datetime.now(timezone.utc) + timedelta(seconds=ttl))
+
+
+class _FakeModels:
+    def __init__(self, owner):
+        self._owner = owner
+
+    def generate_content(self, model, contents, config=None):
+        owner = self._owner
+        owner._sleep(owner.latency)
+        owner._maybe_fail()
+        return owner._response(contents, config)
+
+    def generate_content_stream(self, model, contents, config=None):
+        owner = self._owner
+        owner._maybe_fail()
+        response = owner._response(contents, config)
+        text = response.text or ""
+        chunks = [text[i:i + STREAM_CHUNK_CHARS] for i in range(0, len(text), STREAM_CHUNK_CHARS)] or [""]
+        total = owner.latency()
+        for index, chunk in enumerate(chunks):
+            owner._sleep(lambda: total / len(chunks))
+            last = index == len(chunks) - 1
+            yield types.GenerateContentResponse(
+                candidates=[types.Candidate(content=types.Content(role="model", parts=[types.Part(text=chunk)]))],
+                usage_metadata=response.usage_metadata if last else None,
+            )
+
+
+class FakeGeminiClient:
+    # 缓存 key 中的 Client 种类（与真实 Client 的缓存互不命中）
+    kind = "fake"
+
+    def __init__(self, zones_path=ZONES_JSON, missions_path=MISSIONS_JSON, latency=None, upload_latency=None,
+                 error_rate=0.0, output_tokens=None, seed=None, time_scale=1.0):
+        """
+        初始化替身 Client
+        :param zones_path: 视觉响应的回放来源（{图片名: zones}）
+        :param missions_path: 规划响应的回放来源（{图片名: 代码行列表}）
+        :param latency: 模型请求耗时分布（见 parse_distribution），None 表示无延迟
+        :param upload_latency: 上传耗时分布
+        :param error_rate: 每次模型请求返回可重试错误（429 / 503）的概率
+        :param output_tokens: 可选的输出 token 数分布；默认按响应文本长度估算
+        :param seed: 随机种子（固定后耗时与错误序列可复现）
+        :param time_scale: 耗时缩放系数（0 表示不等待，只统计）
+        """
+        self._random = random.Random(seed)
+        self.latency = parse_distribution(latency, self._random)
+        self.upload_latency = parse_distribution(upload_latency, self._random)
+        self.error_rate = error_rate
+        self.output_tokens = parse_distribution(output_tokens, self._random) if output_tokens is not None else None
+        self.time_scale = time_scale
+
+        zones = _load_records(zones_path)
+        self._zones = {name: value for name, value in zones.items() if value}
+        self._zone_names = sorted(self._zones)
+        missions = _load_records(missions_path)
+        self._plans = ["\n".join(lines) for _, lines in sorted(missions.items()) if lines]
+
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "errors": 0, "uploads": 0}
+        self.files = _FakeFiles(self)
+        self.models = _FakeModels(self)
+        self.caches = _FakeCaches(self)
+
+    def _sleep(self, sampler):
+        seconds = max(0.0, sampler()) * self.time_scale
+        if seconds:
+            time.sleep(seconds)
+
+    def _maybe_fail(self):
+        with self._lock:
+            self.stats["requests"] += 1
+            failed = self.error_rate and self._random.random() < self.error_rate
+            code = self._random.choice(ERROR_CODES)
+            if failed:
+                self.stats["errors"] += 1
+        if failed:
+            raise errors.APIError(code, {"error": {"code": code, "message": "fake client injected error"}})
+
+    def zones_for(self, name):
+        """按图片名回放 zones；未记录的图片按名称哈希映射到某个已记录场景"""
+        name = os.path.basename(name)
+        if name in self._zones:
+            return self._zones[name]
+        if not self._zone_names:
+            return []
+        return self._zones[self._zone_names[zlib.crc32(name.encode("utf-8")) % len(self._zone_names)]]
+
+    def recorded_scenes(self):
+        """已记录的非空场景 zones 列表（按图片名排序）"""
+        return [self._zones[name] for name in self._zone_names]
+
+    def _response(self, contents, config):
+        texts, files, labels = [], [], []
+        for kind, value in _iter_parts(contents):
+            if kind == "file":
+                files.append(value)
+            else:
+                texts.append(value)
+                if value.startswith("图像名称: "):
+                    labels.append(value[len("图像名称: "):])
+
+        if len(files) > 1:
+            # 多图批量请求：返回 {图像名称: zones}
+            names = labels if len(labels) == len(files) else [os.path.basename(f) for f in files]
+            text = json.dumps({label: self.zones_for(f) for label, f in zip(names, files)}, ensure_ascii=False)
+        elif files:
+            text = json.dumps(self.zones_for(files[0]), ensure_ascii=False)
+        else:
+            prompt = "".join(texts)
+            text = self._plans[zlib.crc32(prompt.encode("utf-8")) % len(self._plans)] if self._plans else ""
+
+        prompt_chars = sum(len(t) for t in texts)
+        cached = getattr(config, "cached_content", None)
+        usage = types.GenerateContentResponseUsageMetadata(
+            prompt_token_count=prompt_chars // CHARS_PER_TOKEN + IMAGE_TOKENS * len(files),
+            candidates_token_count=int(self.output_tokens()) if self.output_tokens else len(text) // CHARS_PER_TOKEN,
+            cached_content_token_count=None if not cached else 0,
+        )
+        return types.GenerateContentResponse(
+            candidates=[types.Candidate(content=types.Content(role="model", parts=[types.Part(text=text)]))],
+            usage_metadata=usage,
+        )
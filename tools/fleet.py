@@ -0,0 +1,270 @@
+"""
+数组化的机队注册表
+data/UAV.py 以模块级字典定义无人机，分配时逐个线性筛选；机队扩大到数百架时改用本注册表：
+- 属性保存在 NumPy 结构化数组中，可从 data/UAV.py、JSON（字典列表）或 .npy 文件加载
+- 按状态 / 类型缓存下标索引，可用性（IDLE，或 RETURN 且电量 > 50%）、类型、剩余载荷查询均为向量化运算
+- 可用灭火机的位置建立均匀网格索引，支持查询距火点最近的 k 架
+- candidate_subset 为一个场景挑选相关的候选子集（全部可用侦查机 + 满足火点载荷需求的近邻灭火机），
+  Step 2 的 Prompt 只包含这些无人机
+"""
+import json
+import numpy as np
+
+import data.UAV as UAV
+from data.UAV import UAVStatus
+from tools.planner import load_uav_fleet, RETURN_BATTERY_THRESHOLD, EXTINGUISHING_DRONE, SURVEILLANCE_DRONE
+
+STATUSES = [UAVStatus.IDLE, UAVStatus.SEARCHING, UAVStatus.EXTINGUISHING, UAVStatus.RETURN, UAVStatus.CHARGING]
+TYPES = [EXTINGUISHING_DRONE, SURVEILLANCE_DRONE]
+
+FLEET_DTYPE = np.dtype([
+    ("id", "U32"),
+    ("type", "i1"),               # TYPES 中的下标
+    ("status", "i1"),             # STATUSES 中的下标
+    ("x", "f4"),
+    ("y", "f4"),
+    ("battery", "f4"),
+    ("max_payload", "i2"),
+    ("payload", "i2"),
+    ("max_speed", "f4"),
+    ("sensor_range", "f4"),
+])
+
+# 每个火点默认选取的最近可用灭火机数量
+DEFAULT_CANDIDATES_K = 3
+
+
+def _code(values, value):
+    """把字符串枚举值转换为下标，未知值追加到列表末尾"""
+    if value not in values:
+        values.append(value)
+    return values.index(value)
+
+
+class FleetRegistry:
+    def __init__(self, records, descriptions=None):
+        """
+        :param records: FLEET_DTYPE 结构化数组
+        :param descriptions: 可选的描述文本列表（与 records 一一对应，仅用于生成 Prompt）
+        """
+        self.records = records
+        self.descriptions = list(descriptions) if descriptions is not None else [""] * len(records)
+        self._row_of = {uav_id: row for row, uav_id in enumerate(records["id"])}
+        self._invalidate()
+
+    # ---------- 加载 / 保存 ----------
+
+    @classmethod
+    def from_dicts(cls, fleet):
+        """从无人机字典列表（data/UAV.py 的格式）构建"""
+        records = np.zeros(len(fleet), dtype=FLEET_DTYPE)
+        for row, uav in enumerate(fleet):
+            caps = uav.get("capabilities", {})
+            location = uav.get("location") or [0.0, 0.0]
+            records[row] = (uav["id"], _code(TYPES, uav.get("type")), _code(STATUSES, uav.get("status")),
+                            location[0], location[1], uav.get("battery", 0.0),
+                            caps.get("max_fire_extinguisher", 0), caps.get("current_payload", 0),
+                            caps.get("max_speed", 0.0), caps.get("sensor_range", 0.0))
+        return cls(records, [uav.get("description", "") for uav in fleet])
+
+    @classmethod
+    def from_module(cls, module=UAV):
+        return cls.from_dicts(load_uav_fleet(module))
+
+    @classmethod
+    def load(cls, path=None):
+        """
+        加载机队：None 读取 data/UAV.py；.npy 为结构化数组；其他按 JSON 字典列表读取
+        """
+        if path is None:
+            return cls.from_module()
+        if path.endswith(".npy"):
+            return cls(np.load(path, allow_pickle=False))
+        with open(path, "r", encoding="utf-8") as f:
+            return cls.from_dicts(json.load(f))
+
+    def save(self, path):
+        """保存为 .npy（结构化数组）或 JSON（字典列表）"""
+        if path.endswith(".npy"):
+            np.save(path, self.records, allow_pickle=False)
+            return
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dicts(), f, ensure_ascii=False, indent=4)
+
+    def __len__(self):
+        return len(self.records)
+
+    def to_dicts(self, rows=None):
+        """转换回 data/UAV.py 的字典格式（供规划器、航线优化与 Prompt 使用）"""
+        rows = range(len(self.records)) if rows is None else rows
+        fleet = []
+        for row in rows:
+            r = self.records[row]
+            fleet.append({
+                "id": str(r["id"]),
+                "type": TYPES[r["type"]],
+                "status": STATUSES[r["status"]],
+                "location": [round(float(r["x"]), 6), round(float(r["y"]), 6)],
+                "battery": round(float(r["battery"]), 3),
+                "capabilities": {
+                    "max_fire_extinguisher": int(r["max_payload"]),
+                    "current_payload": int(r["payload"]),
+                    "max_speed": round(float(r["max_speed"]), 3),
+                    "sensor_range": round(float(r["sensor_range"]), 6),
+                },
+                "description": self.descriptions[row],
+            })
+        return fleet
+
+    # ---------- 状态更新 ----------
+
+    def update(self, uav_id, **fields):
+        """更新单架无人机的字段（status / type 可传字符串），并使索引失效"""
+        row = self._row_of[uav_id]
+        for name, value in fields.items():
+            if name == "status":
+                value = _code(STATUSES, value)
+            elif name == "type":
+                value = _code(TYPES, value)
+            self.records[row][name] = value
+        self._invalidate()
+
+    def _invalidate(self):
+        self._status_index = None
+        self._type_index = None
+        self._grid = None
+
+    # ---------- 索引查询 ----------
+
+    def _index(self, field, values):
+        return {value: np.flatnonzero(self.records[field] == code) for code, value in enumerate(values)}
+
+    def rows_with_status(self, status):
+        if self._status_index is None:
+            self._status_index = self._index("status", STATUSES)
+        return self._status_index.get(status, np.empty(0, dtype=np.intp))
+
+    def rows_with_type(self, uav_type):
+        if self._type_index is None:
+            self._type_index = self._index("type", TYPES)
+        return self._type_index.get(uav_type, np.empty(0, dtype=np.intp))
+
+    def available_mask(self):
+        """可用性规则：IDLE，或 RETURN 且电量 > 50%"""
+        mask = np.zeros(len(self.records), dtype=bool)
+        mask[self.rows_with_status(UAVStatus.IDLE)] = True
+        returning = self.rows_with_status(UAVStatus.RETURN)
+        mask[returning[self.records["battery"][returning] > RETURN_BATTERY_THRESHOLD]] = True
+        return mask
+
+    def query(self, available=True, uav_type=None, min_payload=None):
+        """
+        组合查询
+        :param available: True 只返回可用的无人机
+        :param uav_type: 可选的类型过滤
+        :param min_payload: 可选的最小剩余载荷
+        :return: 行下标数组（按注册顺序）
+        """
+        mask = self.available_mask() if available else np.ones(len(self.records), dtype=bool)
+        if uav_type is not None:
+            type_mask = np.zeros(len(self.records), dtype=bool)
+            type_mask[self.rows_with_type(uav_type)] = True
+            mask &= type_mask
+        if min_payload is not None:
+            mask &= self.records["payload"] >= min_payload
+        return np.flatnonzero(mask)
+
+    def available_extinguishers(self):
+        """可用且有载荷的灭火机"""
+        return self.query(uav_type=EXTINGUISHING_DRONE, min_payload=1)
+
+    # ---------- 空间索引 ----------
+
+    def _build_grid(self):
+        rows = self.available_extinguishers()
+        xy = np.column_stack([self.records["x"][rows], self.records["y"][rows]]).astype(float)
+        # 格子边长使平均每格约 4 架（位置全部重合时退化为单个格子）
+        span = float(np.ptp(xy, axis=0).max()) if len(xy) else 0.0
+        cell = span / max(1.0, np.sqrt(len(xy) / 4.0)) if span > 0 else 1.0
+        cells = {}
+        for i, key in enumerate(map(tuple, np.floor(xy / cell).astype(int))):
+            cells.setdefault(key, []).append(i)
+        self._grid = {"rows": rows, "xy": xy, "cell": cell,
+                      "keys": np.array(list(cells), dtype=int).reshape(-1, 2), "members": list(cells.values())}
+
+    def nearest_extinguishers(self, point, k=DEFAULT_CANDIDATES_K):
+        """
+        距 point 最近的 k 架可用灭火机
+        非空格子按与查询格子的切比雪夫距离（环数）由近到远扫描，
+        第 k 近的距离不超过已扫描半径时停止（未扫描格子中的点距离必然更远）
+        :return: 行下标数组（由近到远）
+        """
+        if self._grid is None:
+            self._build_grid()
+        grid = self._grid
+        if len(grid["rows"]) == 0 or k <= 0:
+            return np.empty(0, dtype=np.intp)
+
+        point = np.asarray(point, dtype=float)
+        rings = np.abs(grid["keys"] - np.floor(point / grid["cell"]).astype(int)).max(axis=1)
+        order = np.argsort(rings, kind="stable")
+        found = []
+        for position, cell_index in enumerate(order):
+            found.extend(grid["members"][cell_index])
+            ring = rings[cell_index]
+            if position + 1 < len(order) and rings[order[position + 1]] == ring:
+                continue
+            if len(found) >= k:
+                distances = np.hypot(*(grid["xy"][found] - point).T)
+                if np.partition(distances, k - 1)[k - 1] <= ring * grid["cell"]:
+                    break
+        distances = np.hypot(*(grid["xy"][found] - point).T)
+        nearest = np.argsort(distances, kind="stable")[:k]
+        return grid["rows"][np.asarray(found)[nearest]]
+
+    def candidate_subset(self, zones, k=DEFAULT_CANDIDATES_K):
+        """
+        为一个场景挑选候选无人机：
+        - 全部可用侦查机（Monitor / 侦查任务需要按能力匹配，不能只给灭火机）
+        - 每个火点最近的 k 架可用灭火机
+        - 候选灭火机的剩余载荷合计少于场景火点总数时，按距火点中心由近到远继续补充灭火机
+        - 候选数仍少于区域数时，按距区域中心由近到远补充其余可用无人机
+        :return: 无人机字典列表（按注册顺序）
+        """
+        zones = zones or []
+        points = [point for zone in zones for point in zone.get("fire_points") or []]
+        selected = set(self.query(uav_type=SURVEILLANCE_DRONE).tolist())
+        for point in points:
+            selected.update(self.nearest_extinguishers(point, k).tolist())
+
+        xy = np.column_stack([self.records["x"], self.records["y"]]).astype(float)
+
+        def by_distance(rows, center):
+            rows = np.setdiff1d(rows, list(selected))
+            return rows[np.argsort(np.hypot(*(xy[rows] - center).T), kind="stable")]
+
+        # 载荷需求：每个火点至少一枚灭火弹
+        extinguishers = self.available_extinguishers()
+        payload = int(self.records["payload"][np.intersect1d(extinguishers, list(selected))].sum())
+        if payload < len(points):
+            for row in by_distance(extinguishers, np.mean(np.asarray(points, dtype=float), axis=0)):
+                selected.add(int(row))
+                payload += int(self.records["payload"][row])
+                if payload >= len(points):
+                    break
+
+        centers = [np.mean(np.asarray(zone["coordinates"], dtype=float), axis=0)
+                   for zone in zones if zone.get("coordinates")]
+        center = np.mean(centers, axis=0) if centers else np.zeros(2)
+        if len(selected) < len(zones):
+            selected.update(by_distance(self.query(), center)[:len(zones) - len(selected)].tolist())
+        return self.to_dicts(sorted(selected))
+
+
+def add_fleet_arguments(parser):
+    """为入口脚本添加机队相关的命令行参数"""
+    parser.add_argument("--fleet", default=None,
+                        help="机队文件（JSON 字典列表或 .npy 结构化数组），默认读取 data/UAV.py")
+    parser.add_argument("--candidates", type=int, default=DEFAULT_CANDIDATES_K,
+                        help=f"Prompt 只包含可用侦查机与每个火点最近的 K 架可用灭火机（载荷不足时补充）等候选子集（默认 {DEFAULT_CANDIDATES_K}），"
+                             f"0 表示在静态前缀中列出整个机队")
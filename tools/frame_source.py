@@ -0,0 +1,175 @@
+"""
+视频 / 帧序列输入
+无人机悬停时连续帧几乎相同，逐帧送入 Step 1 会产生大量重复请求。
+本模块从视频文件（需要 opencv-python，可选依赖）或帧图片目录中按采样率取帧，
+用 NumPy + Pillow 计算差值感知哈希 (dHash)，与上一张保留帧的汉明距离不超过阈值的帧直接丢弃，
+只有画面发生变化的帧才会进入 VisionAnalyzer。
+帧按需逐个产出：VisionAnalyzer.iter_analyze 边读取边分析，长视频不必先解码完毕，也不会在内存中积累帧列表。
+"""
+import os
+import glob
+import hashlib
+import numpy as np
+from PIL import Image
+
+# 感知哈希边长（hash_size x hash_size 位）
+HASH_SIZE = 8
+# 汉明距离不超过该值视为近重复帧（64 位哈希）
+DEFAULT_HASH_THRESHOLD = 10
+# 视频默认采样率（帧/秒）
+DEFAULT_SAMPLE_FPS = 1.0
+
+VIDEO_EXTENSIONS = (".mp4", ".mov", ".avi", ".mkv", ".m4v")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+def dhash(image, hash_size=HASH_SIZE):
+    """
+    差值感知哈希：缩放为 (hash_size+1) x hash_size 灰度图，比较水平相邻像素
+    :param image: PIL.Image
+    :return: (hash_size*hash_size,) bool 数组
+    """
+    gray = image.convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR)
+    pixels = np.asarray(gray, dtype=np.int16)
+    return (pixels[:, 1:] > pixels[:, :-1]).ravel()
+
+
+def hamming(hash_a, hash_b):
+    """两个哈希之间的汉明距离"""
+    return int(np.count_nonzero(hash_a != hash_b))
+
+
+def _open_for_hash(path):
+    """打开图片用于计算哈希，JPEG 使用 draft 模式只解码缩小后的灰度图"""
+    img = Image.open(path)
+    img.draft("L", (HASH_SIZE * 8, HASH_SIZE * 8))
+    return img
+
+
+def iter_directory_frames(frame_dir, every=1):
+    """
+    按文件名顺序读取帧目录
+    :param every: 每隔 N 帧取 1 帧
+    :return: 生成器，产出 (帧序号, 图片路径, PIL.Image)
+    """
+    paths = sorted(p for p in glob.glob(os.path.join(frame_dir, "*")) if p.lower().endswith(IMAGE_EXTENSIONS))
+    for index, path in enumerate(paths):
+        if index % max(1, every):
+            continue
+        with _open_for_hash(path) as img:
+            yield index, path, img
+
+
+def iter_video_frames(video_path, sample_fps=DEFAULT_SAMPLE_FPS, every=None):
+    """
+    按采样率读取视频帧（未采样的帧只 grab 不解码）
+    :param sample_fps: 每秒取几帧（every 未指定时生效）
+    :param every: 每隔 N 帧取 1 帧
+    :return: 生成器，产出 (帧序号, None, PIL.Image)
+    """
+    try:
+        import cv2
+    except ImportError as e:
+        raise RuntimeError("读取视频需要 opencv-python：pip install opencv-python") from e
+
+    capture = cv2.VideoCapture(video_path)
+    if not capture.isOpened():
+        raise RuntimeError(f"无法打开视频: {video_path}")
+    try:
+        if every is None:
+            video_fps = capture.get(cv2.CAP_PROP_FPS) or 30.0
+            every = max(1, round(video_fps / sample_fps))
+        index = 0
+        while capture.grab():
+            if index % every == 0:
+                ok, frame = capture.retrieve()
+                if not ok:
+                    break
+                yield index, None, Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+            index += 1
+    finally:
+        capture.release()
+
+
+def source_fingerprint(source, sample_fps=DEFAULT_SAMPLE_FPS, every=None):
+    """
+    视频帧文件名中的来源指纹：绝对路径 + 大小 + 修改时间 + 采样参数的短哈希
+    视频被替换或采样参数变化后生成新的帧文件，不会复用旧视频抽出的同序号帧
+    """
+    stat = os.stat(source)
+    key = f"{os.path.abspath(source)}|{stat.st_size}|{stat.st_mtime_ns}|{sample_fps}|{every}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:12]
+
+
+def iter_scene_frames(source, output_dir, sample_fps=DEFAULT_SAMPLE_FPS, every=None,
+                      threshold=DEFAULT_HASH_THRESHOLD, stats=None):
+    """
+    从视频或帧目录中筛选出画面发生变化的帧
+    :param source: 视频文件路径或帧图片目录
+    :param output_dir: 视频帧的保存目录（帧目录输入直接使用原文件；文件名带来源指纹，见 source_fingerprint）
+    :param sample_fps: 视频采样率（帧/秒）
+    :param every: 每隔 N 帧取 1 帧（指定时覆盖 sample_fps）
+    :param threshold: 汉明距离阈值，不超过该值的帧视为近重复帧
+    :param stats: 可选字典，写入 sampled / kept 计数
+    :return: 生成器，产出保留帧的图片路径
+    """
+    stats = {} if stats is None else stats
+    stats.update(sampled=0, kept=0)
+    if os.path.isdir(source):
+        frames = iter_directory_frames(source, every or 1)
+    elif source.lower().endswith(VIDEO_EXTENSIONS):
+        frames = iter_video_frames(source, sample_fps, every)
+    else:
+        raise ValueError(f"不支持的帧来源: {source}")
+
+    stem = os.path.splitext(os.path.basename(os.path.normpath(source)))[0]
+    if not os.path.isdir(source):
+        stem = f"{stem}_{source_fingerprint(source, sample_fps, every)}"
+    last_hash = None
+    for index, path, image in frames:
+        stats["sampled"] += 1
+        frame_hash = dhash(image)
+        if last_hash is not None and hamming(frame_hash, last_hash) <= threshold:
+            continue
+        last_hash = frame_hash
+        stats["kept"] += 1
+
+        if path is None:
+            os.makedirs(output_dir, exist_ok=True)
+            path = os.path.join(output_dir, f"{stem}_{index:06d}.jpg")
+            if not os.path.exists(path):
+                tmp_path = path + ".tmp"
+                image.save(tmp_path, format="JPEG", quality=90)
+                os.replace(tmp_path, path)
+        yield path
+
+
+def iter_selected_frames(source, output_dir, **options):
+    """iter_scene_frames 的包装：逐帧产出，全部产出后打印采样与去重统计"""
+    stats = {}
+    yield from iter_scene_frames(source, output_dir, stats=stats, **options)
+    print(f"🎞️ [Frames] {source}: 采样 {stats['sampled']} 帧，保留 {stats['kept']} 帧"
+          f"（跳过近重复 {stats['sampled'] - stats['kept']} 帧）")
+
+
+def select_scene_frames(source, output_dir, **options):
+    """iter_selected_frames 的列表版本"""
+    return list(iter_selected_frames(source, output_dir, **options))
+
+
+def add_frame_source_arguments(parser):
+    """为入口脚本添加帧来源相关的命令行参数"""
+    parser.add_argument("--source", default=None,
+                        help="帧来源：视频文件或帧图片目录（默认扫描 temp/ 下的图片，不做去重）")
+    parser.add_argument("--sample-fps", type=float, default=DEFAULT_SAMPLE_FPS,
+                        help=f"视频采样率/帧每秒（默认 {DEFAULT_SAMPLE_FPS}）")
+    parser.add_argument("--sample-every", type=int, default=None,
+                        help="每隔 N 帧取 1 帧（指定时覆盖 --sample-fps；帧目录默认 1）")
+    parser.add_argument("--hash-threshold", type=int, default=DEFAULT_HASH_THRESHOLD,
+                        help=f"与上一张保留帧的感知哈希汉明距离不超过该值时跳过（默认 {DEFAULT_HASH_THRESHOLD}，共 64 位）")
+
+
+def frames_from_args(args, output_dir):
+    """根据命令行参数筛选帧，返回保留帧路径的生成器（调用方边解码去重边分析，不等待整段视频读完）"""
+    return iter_selected_frames(args.source, output_dir, sample_fps=args.sample_fps,
+                               every=args.sample_every, threshold=args.hash_threshold)
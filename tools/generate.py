@@ -4,14 +4,25 @@
 1. 技能库（函数定义）
 2. 可用无人机资源
 3. 少样本示例 (Few-Shot Prompting)
+Prompt 分为与场景无关的静态前缀（进程内缓存，可注册为服务端缓存上下文）与每个场景的区域数据两部分。
+区域数据可以按 JSON 原样发送，也可以用紧凑表格编码（去掉规划用不到的字段，火点坐标按精度量化）。
 """
+import os
 import json
 import inspect
+import importlib
+import threading
 
 # 导入用户的数据文件
 import data.function as function
 import data.UAV as UAV
 
+# 区域数据编码格式
+ZONE_FORMATS = ["json", "compact"]
+DEFAULT_ZONE_FORMAT = "compact"
+# 紧凑编码中坐标保留的小数位数
+DEFAULT_COORD_PRECISION = 3
+
 def get_function_definitions(module):
     """提取模块中所有函数的源代码作为提示词上下文"""
     definitions = []
@@ -43,6 +54,10 @@ def get_uav_resources(module):
             uavs.append(f"{name} = {json.dumps(obj, ensure_ascii=False)}")
     return "\n".join(uavs)
 
+def format_uav_resources(fleet):
+    """把无人机字典列表格式化为与 get_uav_resources 相同的资源池文本（用于候选子集）"""
+    return "\n".join(f"{uav['id']} = {json.dumps(uav, ensure_ascii=False)}" for uav in fleet)
+
 def get_few_shot_examples():
     """提供纯净的少样本示例 (展示多机轮询调度)"""
     return """
@@ -58,24 +73,41 @@ def get_few_shot_examples():
     FlyToFire(zone_2_uavs[0], [0.68, 0.79])
     """
 
-# 构建动态提示词
-def create_command_prompt(zones):
+# ==========================================
+# 静态前缀缓存：规则 / 状态定义 / 资源池 / 示例在所有场景间完全相同，
+# 每个进程只构建一次；data/UAV.py 或 data/function.py 被修改时自动重新加载并重建。
+# ==========================================
+_static_prompt_cache = {"signature": None, "prompts": {}}
+_static_prompt_lock = threading.Lock()
+
 
-    # skills_context = get_function_definitions(function)
+def _source_signature():
+    """数据源文件的修改时间与大小，作为静态前缀的失效依据"""
+    signature = []
+    for module in (UAV, function):
+        stat = os.stat(module.__file__)
+        signature.append((module.__file__, stat.st_mtime_ns, stat.st_size))
+    return tuple(signature)
 
+
+def build_static_prompt(include_fleet=True):
+    """
+    构建与场景无关的静态前缀（决策法则、状态定义、资源池、语法规范、示例）
+    :param include_fleet: False 时资源池不放在前缀中，由 build_zones_prompt 按场景给出候选子集
+    """
     # 1. 获取状态定义
     status_def = get_uav_status_definition(UAV)
     
     # 2. 获取无人机资源
-    uav_context = get_uav_resources(UAV)
-      
-    # 3. 序列化任务区域数据
-    zones_json = json.dumps(zones, ensure_ascii=False, indent=2)
+    if include_fleet:
+        uav_context = get_uav_resources(UAV)
+    else:
+        uav_context = "见下方【5. 任务区域情报】中的候选资源池（已按距离筛选，仅可从中分配）。"
     
-    # 4. 获取少样本示例
+    # 3. 获取少样本示例
     examples_context = get_few_shot_examples()
-    
-    prompt = f"""
+
+    return f"""
     你是一名无人机集群指挥官。面对复杂的战场环境，你需要执行**“全局资源规划 -> 战术动作生成”**的决策流程。
 
     ==================================================
@@ -126,26 +158,98 @@ def create_command_prompt(zones):
     {uav_context}
 
     ==================================================
-    【3. 任务区域情报 (JSON)】
-    ==================================================
-    {zones_json}
-
-    ==================================================
-    【4. 代码生成规范 (Syntax Constraints)】
+    【3. 代码生成规范 (Syntax Constraints)】
     ==================================================
     1. **纯净代码**：严禁输出注释、Markdown 标记、print 语句。
     2. **变量绑定**：严格遵守 `变量定义 -> 函数调用` 的顺序。
     3. **索引引用**：灭火时必须使用 `zone_x_uavs[i]`，禁止直接使用字符串 ID。
 
     ==================================================
-    【5. 语法格式参考 (Syntax Only)】
+    【4. 语法格式参考 (Syntax Only)】
     ==================================================
     以下示例仅用于展示**代码格式**，**不要**参考其中的分配逻辑（逻辑请严格遵守上文的【核心决策法则】）：
     {examples_context}
+    """
+
+
+def get_static_prompt(include_fleet=True):
+    """获取静态前缀（进程内缓存，数据源文件变化时重新加载模块并重建）"""
+    with _static_prompt_lock:
+        signature = _source_signature()
+        if _static_prompt_cache["signature"] != signature:
+            if _static_prompt_cache["signature"] is not None:
+                importlib.reload(UAV)
+                importlib.reload(function)
+                signature = _source_signature()
+            _static_prompt_cache["prompts"] = {}
+            _static_prompt_cache["signature"] = signature
+        prompts = _static_prompt_cache["prompts"]
+        if include_fleet not in prompts:
+            prompts[include_fleet] = build_static_prompt(include_fleet)
+        return prompts[include_fleet]
+
+
+def _format_value(value, precision):
+    """按精度格式化坐标，只去掉小数点后的末尾 0（precision=0 时 10 仍为 10）"""
+    text = f"{float(value):.{precision}f}"
+    if "." in text:
+        text = text.rstrip("0").rstrip(".")
+    return "0" if text in ("", "-0") else text
+
+
+def _format_point(point, precision):
+    return ",".join(_format_value(value, precision) for value in point)
+
+
+def encode_zones_compact(zones, precision=DEFAULT_COORD_PRECISION):
+    """
+    紧凑表格编码：每个区域一行 `id|risk_level|火点`，火点之间用 ';' 分隔
+    reason / boundary_description / coordinates 不参与资源分配，不写入
+    :param precision: 火点坐标保留的小数位数
+    """
+    lines = ["id|risk_level|fire_points(x,y;...)"]
+    for zone in zones:
+        points = ";".join(_format_point(point, precision) for point in zone.get("fire_points") or [])
+        lines.append(f"{zone.get('id')}|{zone.get('risk_level')}|{points or '-'}")
+    return "\n    ".join(lines)
+
+
+def build_zones_prompt(zones, fleet=None, zone_format="json", precision=DEFAULT_COORD_PRECISION):
+    """
+    构建随场景变化的动态部分（任务区域情报 + 最终指令）
+    :param fleet: 可选的候选无人机字典列表；给出时作为本场景的资源池（静态前缀应使用 include_fleet=False）
+    :param zone_format: json 原样序列化；compact 使用紧凑表格编码
+    :param precision: compact 编码的坐标精度（小数位数）
+    """
+    # 序列化任务区域数据
+    if zone_format == "compact":
+        zones_title = "表格"
+        zones_json = encode_zones_compact(zones, precision)
+    else:
+        zones_title = "JSON"
+        zones_json = json.dumps(zones, ensure_ascii=False, indent=2)
+
+    fleet_context = ""
+    if fleet is not None:
+        fleet_context = f"""
+
+    **候选资源池**：
+    {format_uav_resources(fleet)}"""
+
+    return f"""
+    ==================================================
+    【5. 任务区域情报 ({zones_title})】
+    ==================================================
+    {zones_json}{fleet_context}
 
     ==================================================
     【6. 最终指令生成】
     ==================================================
     基于上述法则，输出最终 Python 代码：
     """
-    return prompt
\ No newline at end of file
+
+
+# 构建动态提示词
+def create_command_prompt(zones):
+    """完整 Prompt = 静态前缀（可作为缓存上下文）+ 场景区域数据"""
+    return get_static_prompt() + build_zones_prompt(zones)
@@ -0,0 +1,293 @@
+"""
+区域几何校验与修复
+检查 Step 1 输出是否满足 task_prompt_json 中的约束：
+1. 每个火点位于其所属 zone 内
+2. Monitor 区域不包含火点
+3. 所有 zone 拼接后覆盖整张图像
+4. zone 之间互不重叠
+点包含测试使用 NumPy 批量射线法；覆盖率 / 重叠率基于栅格化掩码计算。
+修复：把落在错误 zone 的火点重新分配到实际包含它的 zone（或最近的非 Monitor zone）。
+"""
+import sys
+import json
+import copy
+import numpy as np
+
+# 栅格化分辨率（每边像素数）
+DEFAULT_RESOLUTION = 128
+# 允许的最小覆盖率与最大重叠率
+MIN_COVERAGE = 0.98
+MAX_OVERLAP = 0.02
+# 判定点在多边形边界上的距离容差（归一化坐标）
+EDGE_TOLERANCE = 1e-3
+
+
+def points_in_polygon(points, polygon):
+    """
+    批量射线法点包含测试
+    :param points: (N, 2) 点坐标
+    :param polygon: (M, 2) 多边形顶点
+    :return: (N,) bool
+    """
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    poly = np.asarray(polygon, dtype=float).reshape(-1, 2)
+    if len(poly) < 3 or len(points) == 0:
+        return np.zeros(len(points), dtype=bool)
+
+    x, y = points[:, 0:1], points[:, 1:2]                 # (N, 1)
+    x1, y1 = poly[:, 0], poly[:, 1]                       # (M,)
+    x2, y2 = np.append(x1[1:], x1[0]), np.append(y1[1:], y1[0])
+
+    crosses = (y1 > y) != (y2 > y)                        # (N, M)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        x_cross = x1 + (y - y1) * (x2 - x1) / (y2 - y1)
+    hits = crosses & (x < x_cross)
+    return hits.sum(axis=1) % 2 == 1
+
+
+def points_polygon_distance(points, polygon):
+    """批量计算点到多边形边界的最短距离 (N,)"""
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    poly = np.asarray(polygon, dtype=float).reshape(-1, 2)
+    if len(poly) == 0 or len(points) == 0:
+        return np.full(len(points), np.inf)
+
+    a = poly[None, :, :]                                  # (1, M, 2)
+    b = np.concatenate([poly[1:], poly[:1]])[None, :, :]
+    p = points[:, None, :]                                # (N, 1, 2)
+    ab = b - a
+    denom = np.maximum((ab ** 2).sum(axis=-1), 1e-18)
+    t = np.clip(((p - a) * ab).sum(axis=-1) / denom, 0.0, 1.0)
+    closest = a + t[..., None] * ab
+    return np.sqrt(((p - closest) ** 2).sum(axis=-1)).min(axis=1)
+
+
+def points_in_zone(points, polygon, tolerance=EDGE_TOLERANCE):
+    """点包含测试（边界上容差范围内的点也视为在内）"""
+    inside = points_in_polygon(points, polygon)
+    if tolerance > 0:
+        inside |= points_polygon_distance(points, polygon) <= tolerance
+    return inside
+
+
+def grid_points(resolution=DEFAULT_RESOLUTION):
+    """生成栅格中心点坐标 (R*R, 2)"""
+    centers = (np.arange(resolution) + 0.5) / resolution
+    gx, gy = np.meshgrid(centers, centers)
+    return np.column_stack([gx.ravel(), gy.ravel()])
+
+
+def _polygon_edges(polygon):
+    """多边形边的起止点 (x1, y1, x2, y2)，顶点不足 3 个时返回空数组"""
+    poly = np.asarray(polygon, dtype=float).reshape(-1, 2)
+    if len(poly) < 3:
+        return np.empty((0, 4))
+    nxt = np.concatenate([poly[1:], poly[:1]])
+    return np.hstack([poly, nxt])
+
+
+def rasterize_zones(zones, resolution=DEFAULT_RESOLUTION):
+    """
+    扫描线栅格化一个场景的所有 zone，返回 (Z, R*R) bool 掩码（与 grid_points 顺序一致）
+    每条边与每行扫描线（栅格中心）的交点处翻转奇偶性，沿 x 方向累加后取奇数即为内部。
+    所有 zone 的边合并为一次向量化计算，复杂度 O(R*E + Z*R*R)
+    """
+    edge_list = [_polygon_edges(zone.get("coordinates") or []) for zone in zones]
+    owner = np.repeat(np.arange(len(zones)), [len(e) for e in edge_list])
+    edges = np.vstack(edge_list) if edge_list else np.empty((0, 4))
+    x1, y1, x2, y2 = edges.T                              # (E,)
+
+    y = ((np.arange(resolution) + 0.5) / resolution)[:, None]
+    crosses = (y1 > y) != (y2 > y)                        # (R, E)
+    rows, cols_e = np.nonzero(crosses)
+    ey1, ey2, ex1, ex2 = y1[cols_e], y2[cols_e], x1[cols_e], x2[cols_e]
+    x_cross = ex1 + ((rows + 0.5) / resolution - ey1) * (ex2 - ex1) / (ey2 - ey1)
+    # 交点右侧第一个栅格中心所在列：从该列起的采样点左侧多了一个交点
+    cols = np.clip(np.floor(x_cross * resolution + 0.5).astype(int), 0, resolution)
+
+    width = resolution + 1
+    flat = (owner[cols_e] * resolution + rows) * width + cols
+    toggles = np.bincount(flat, minlength=len(zones) * resolution * width).astype(np.uint8)
+    toggles = toggles.reshape(len(zones), resolution, width)[:, :, :resolution]
+    parity = np.bitwise_xor.accumulate(toggles & 1, axis=2)
+    return parity.reshape(len(zones), -1).astype(bool)
+
+
+def locate_fire_points(zones):
+    """
+    计算每个火点被哪些 zone 包含
+    :return: [(所属 zone 下标, 火点坐标, 包含该点的 zone 下标数组)]
+    """
+    owners, points = [], []
+    for index, zone in enumerate(zones):
+        for point in zone.get("fire_points") or []:
+            owners.append(index)
+            points.append(point)
+    if not points:
+        return []
+
+    points_arr = np.asarray(points, dtype=float)
+    containment = np.column_stack([points_in_zone(points_arr, zone.get("coordinates") or []) for zone in zones])
+    return [(owner, point, np.flatnonzero(row)) for owner, point, row in zip(owners, points, containment)]
+
+
+def validate_zones(zones, resolution=DEFAULT_RESOLUTION):
+    """
+    校验单个场景
+    :return: 报告字典（valid / coverage / overlap / misplaced_points / monitor_fire_points / issues）
+    """
+    issues = []
+    if not zones:
+        return {"valid": False, "coverage": 0.0, "overlap": 0.0,
+                "misplaced_points": 0, "monitor_fire_points": 0, "issues": ["场景为空"]}
+
+    masks = rasterize_zones(zones, resolution)
+    counts = masks.sum(axis=0)
+    coverage = float((counts > 0).mean())
+    overlap = float((counts > 1).mean())
+    if coverage < MIN_COVERAGE:
+        issues.append(f"覆盖率不足: {coverage:.3f} < {MIN_COVERAGE}")
+    if overlap > MAX_OVERLAP:
+        issues.append(f"区域重叠: {overlap:.3f} > {MAX_OVERLAP}")
+
+    misplaced, monitor_fire = 0, 0
+    for owner, point, containing in locate_fire_points(zones):
+        zone = zones[owner]
+        if zone.get("risk_level") == "Monitor":
+            monitor_fire += 1
+            issues.append(f"Monitor 区域 {zone.get('id')} 包含火点 {point}")
+        if owner not in containing:
+            misplaced += 1
+            issues.append(f"火点 {point} 不在所属区域 {zone.get('id')} 内")
+
+    return {
+        "valid": not issues,
+        "coverage": coverage,
+        "overlap": overlap,
+        "misplaced_points": misplaced,
+        "monitor_fire_points": monitor_fire,
+        "issues": issues,
+    }
+
+
+def repair_zones(zones):
+    """
+    修复火点归属：
+    - 火点重新分配到包含它的非 Monitor zone（原 zone 满足时保持不动）
+    - 仅被 Monitor zone 包含时，把该 Monitor zone 升级为 Low 并归入其中
+    - 不被任何 zone 包含时，分配给边界距离最近的非 Monitor zone
+    :return: (修复后的 zones 副本, 变更说明列表)
+    """
+    repaired = copy.deepcopy(zones)
+    changes = []
+    located = locate_fire_points(repaired)
+    if not located:
+        return repaired, changes
+
+    fire_capable = np.array([z.get("risk_level") != "Monitor" for z in repaired])
+    new_points = [[] for _ in repaired]
+    for owner, point, containing in located:
+        candidates = [i for i in containing if fire_capable[i]]
+        if fire_capable[owner] and owner in containing:
+            target = owner
+        elif candidates:
+            target = candidates[0]
+        elif len(containing):
+            # 火点只落在 Monitor 区域内：以图像事实为准，把该区域升级为 Low
+            target = int(containing[0])
+            repaired[target]["risk_level"] = "Low"
+            fire_capable[target] = True
+            changes.append(f"区域 {repaired[target].get('id')} 由 Monitor 升级为 Low")
+        elif fire_capable.any():
+            # 火点不在任何区域内（覆盖缺口）：分配给边界距离最近的非 Monitor 区域
+            distances = [points_polygon_distance([point], z.get("coordinates") or [])[0] if fire_capable[i] else np.inf
+                         for i, z in enumerate(repaired)]
+            target = int(np.argmin(distances))
+        else:
+            target = owner
+
+        new_points[target].append(point)
+        if target != owner:
+            changes.append(f"火点 {point}: {repaired[owner].get('id')} -> {repaired[target].get('id')}")
+
+    for zone, points in zip(repaired, new_points):
+        zone["fire_points"] = points
+    return repaired, changes
+
+
+def validate_scenes(all_zones_data, repair=False, resolution=DEFAULT_RESOLUTION):
+    """
+    批量校验（可选修复）zones_data.json 中的所有场景
+    :return: (场景数据（repair=True 时为修复后的副本）, {file_name: 报告})
+    """
+    output, reports = {}, {}
+    for file_name, zones in all_zones_data.items():
+        if not zones:
+            output[file_name] = zones
+            continue
+        changes = []
+        if repair:
+            zones, changes = repair_zones(zones)
+        report = validate_zones(zones, resolution)
+        report["repairs"] = changes
+        output[file_name] = zones
+        reports[file_name] = report
+    return output, reports
+
+
+def clip_polygon_to_box(polygon, box):
+    """
+    Sutherland–Hodgman 算法：把多边形裁剪到轴对齐矩形内
+    :param polygon: [[x, y], ...] 顶点列表
+    :param box: (x_min, y_min, x_max, y_max)
+    :return: 裁剪后的顶点列表（完全在矩形外时为空列表）
+    """
+    x_min, y_min, x_max, y_max = box
+    # 依次用矩形的四条边裁剪：(坐标轴, 边界值, 内侧是否为 >=)
+    edges = ((0, x_min, True), (0, x_max, False), (1, y_min, True), (1, y_max, False))
+    points = [(float(x), float(y)) for x, y in polygon]
+    for axis, bound, keep_greater in edges:
+        if not points:
+            break
+
+        def inside(p):
+            return p[axis] >= bound if keep_greater else p[axis] <= bound
+
+        def intersect(p, q):
+            t = (bound - p[axis]) / (q[axis] - p[axis])
+            return tuple(bound if i == axis else p[i] + t * (q[i] - p[i]) for i in range(2))
+
+        clipped = []
+        for i, current in enumerate(points):
+            previous = points[i - 1]
+            if inside(current):
+                if not inside(previous):
+                    clipped.append(intersect(previous, current))
+                clipped.append(current)
+            elif inside(previous):
+                clipped.append(intersect(previous, current))
+        points = clipped
+    return [list(p) for p in points]
+
+
+if __name__ == '__main__':
+    # 用法：python -m tools.geometry <zones_data.json> [修复后输出路径]
+    if len(sys.argv) not in (2, 3):
+        print("用法: python -m tools.geometry <zones_data.json> [repaired_output.json]")
+        sys.exit(1)
+
+    with open(sys.argv[1], "r", encoding="utf-8") as f:
+        data = json.load(f)
+
+    scenes, scene_reports = validate_scenes(data, repair=len(sys.argv) == 3)
+    for name, r in scene_reports.items():
+        status = "✅" if r["valid"] else "❌"
+        print(f"{status} {name}: 覆盖率 {r['coverage']:.3f}, 重叠率 {r['overlap']:.3f}, "
+              f"错位火点 {r['misplaced_points']}, 修复 {len(r['repairs'])} 处")
+        for issue in r["issues"]:
+            print(f"    - {issue}")
+
+    if len(sys.argv) == 3:
+        with open(sys.argv[2], "w", encoding="utf-8") as f:
+            json.dump(scenes, f, ensure_ascii=False, indent=4)
+        print(f"💾 修复结果已保存至: {sys.argv[2]}")
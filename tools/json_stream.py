@@ -0,0 +1,107 @@
+"""
+增量 JSON 数组解析
+流式响应按片段到达，本模块逐字符跟踪括号深度与字符串状态，
+顶层数组中的每个对象一闭合就立即解析并产出，无需等待整个响应结束。
+数组之前的任意前缀（如 ```json 标记）会被忽略；响应被截断时，已闭合的对象仍然可用。
+parse_json_tolerant 在整体解析失败时复用该解析器，逐个恢复截断数组中已完整的对象。
+"""
+import re
+import json
+
+# 响应首尾的 Markdown 代码块标记
+FENCE_PATTERN = re.compile(r"^\s*```[a-zA-Z]*\s*|\s*```\s*$")
+
+
+class JsonArrayStream:
+    def __init__(self):
+        """顶层 JSON 数组的增量解析器：feed() 返回本次新闭合的对象"""
+        self.items = []           # 已解析的全部对象
+        self.errors = 0           # 闭合但无法解析的元素数
+        self.started = False      # 是否已遇到顶层 '['
+        self.complete = False     # 顶层数组是否已闭合
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._current = None      # 正在收集的元素字符
+
+    def feed(self, text):
+        """
+        输入一段文本
+        :return: 本段文本中闭合的对象列表
+        """
+        closed = []
+        for ch in text:
+            if self.complete:
+                break
+            if not self.started:
+                if ch == "[":
+                    self.started, self._depth = True, 1
+                continue
+
+            if self._current is not None:
+                self._current.append(ch)
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+
+            if ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                self._depth += 1
+                if self._depth == 2:
+                    self._current = [ch]
+            elif ch in "}]":
+                self._depth -= 1
+                if self._depth == 1 and self._current is not None:
+                    item = self._finish_item()
+                    if item is not None:
+                        closed.append(item)
+                elif self._depth == 0:
+                    self.complete = True
+        return closed
+
+    def _finish_item(self):
+        raw = "".join(self._current)
+        self._current = None
+        try:
+            item = json.loads(raw)
+        except json.JSONDecodeError:
+            self.errors += 1
+            return None
+        self.items.append(item)
+        return item
+
+
+def iter_array_items(chunks):
+    """逐段输入文本，按闭合顺序产出顶层数组中的对象"""
+    parser = JsonArrayStream()
+    for chunk in chunks:
+        yield from parser.feed(chunk)
+
+
+def parse_json_tolerant(raw_text):
+    """
+    容错解析模型返回的 JSON
+    1. 去掉首尾的 Markdown 代码块标记后整体解析
+    2. 失败且文本以 [ 开头时按顶层数组增量解析，恢复所有已闭合的对象（截断或中间夹杂非法片段时）；
+       其他文本（如开头是说明文字、内部含有示例数组）不做恢复，以免把无关片段当作结果
+    :return: (解析结果, 状态)；状态为 "ok" / "recovered" / "failed"，失败时结果为 None
+    """
+    text = FENCE_PATTERN.sub("", raw_text or "")
+    try:
+        return json.loads(text), "ok"
+    except json.JSONDecodeError:
+        pass
+    if not text.strip().startswith("["):
+        return None, "failed"
+    parser = JsonArrayStream()
+    parser.feed(text)
+    if parser.items:
+        return parser.items, "recovered"
+    return None, "failed"
@@ -0,0 +1,232 @@
+"""
+运行指标采集与导出
+- 分阶段计时（上传、模型请求、解析、可视化、写文件等），每个阶段保留全部观测值
+- 按图片 / 场景累计各阶段耗时、输入输出 token 数、重试次数、解析失败与截断恢复次数、预筛跳过次数
+- 导出 JSON 运行报告与 Prometheus 文本格式文件（阶段耗时直方图 + 计数器）
+- profile_run：用 cProfile 包裹一次运行（含运行期间启动的请求 / 消费者线程），保存 .prof 并打印累计耗时最高的函数
+"""
+import os
+import sys
+import time
+import pstats
+import cProfile
+import threading
+from contextlib import contextmanager
+
+from tools.storage import save_json_atomic
+
+# Prometheus 直方图的桶上限（秒）
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+# 每个条目（图片 / 场景）累计的计数器
+COUNTERS = ("prompt_tokens", "output_tokens", "retries", "parse_failures", "parse_recovered", "prescreen_skipped")
+# --profile 打印的函数数
+PROFILE_TOP = 25
+
+
+def _names(item):
+    """条目参数可以是单个名称、名称列表或 None"""
+    if item is None:
+        return []
+    return [item] if isinstance(item, str) else list(item)
+
+
+def _quantile(ordered, q):
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else None
+
+
+class RunMetrics:
+    def __init__(self, run_name):
+        """
+        线程安全的运行指标
+        :param run_name: 运行名称（step1 / step2 / pipeline），作为 Prometheus 的 run 标签
+        """
+        self.run_name = run_name
+        self.started_at = time.time()
+        self._start = time.monotonic()
+        self._lock = threading.Lock()
+        self.stages = {}       # stage -> [耗时]
+        self.items = {}        # item -> {"stages": {stage: 累计耗时}, 计数器...}
+        self.totals = dict.fromkeys(COUNTERS, 0)
+
+    def _item(self, item):
+        if item not in self.items:
+            self.items[item] = {"stages": {}, **dict.fromkeys(COUNTERS, 0)}
+        return self.items[item]
+
+    def observe(self, stage, seconds, item=None):
+        """记录一次阶段耗时；给出 item（名称或名称列表）时同时累计到这些条目"""
+        with self._lock:
+            self.stages.setdefault(stage, []).append(seconds)
+            for name in _names(item):
+                stages = self._item(name)["stages"]
+                stages[stage] = stages.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, stage, item=None):
+        """计时上下文：with metrics.stage("upload", "0001.jpg"): ..."""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.monotonic() - start, item)
+
+    def add(self, counter, n=1, item=None):
+        """累加计数器（全局与可选条目）"""
+        with self._lock:
+            self.totals[counter] += n
+            for name in _names(item):
+                self._item(name)[counter] += n
+
+    def record_usage(self, response, items=None):
+        """
+        从响应的 usage_metadata 累加 token 数
+        :param items: 条目列表；多图批量请求的 token 数平均分摊到各条目
+        """
+        usage = getattr(response, "usage_metadata", None)
+        prompt = getattr(usage, "prompt_token_count", None) or 0
+        output = getattr(usage, "candidates_token_count", None) or 0
+        items = _names(items)
+        with self._lock:
+            self.totals["prompt_tokens"] += prompt
+            self.totals["output_tokens"] += output
+            for item in items:
+                entry = self._item(item)
+                entry["prompt_tokens"] += prompt / len(items)
+                entry["output_tokens"] += output / len(items)
+
+    def retry_counter(self, item=None):
+        """返回供 ModelCaller.call(on_retry=...) 使用的回调"""
+        return lambda: self.add("retries", item=item)
+
+    # ---------- 导出 ----------
+
+    def report(self):
+        """JSON 运行报告"""
+        with self._lock:
+            stages = {}
+            for stage, values in self.stages.items():
+                ordered = sorted(values)
+                stages[stage] = {
+                    "count": len(ordered),
+                    "total_s": round(sum(ordered), 4),
+                    "mean_s": round(sum(ordered) / len(ordered), 4),
+                    "p50_s": round(_quantile(ordered, 0.5), 4),
+                    "p95_s": round(_quantile(ordered, 0.95), 4),
+                    "max_s": round(ordered[-1], 4),
+                }
+            items = {
+                item: {**entry, "stages": {k: round(v, 4) for k, v in entry["stages"].items()},
+                       "prompt_tokens": round(entry["prompt_tokens"]), "output_tokens": round(entry["output_tokens"])}
+                for item, entry in self.items.items()
+            }
+            return {
+                "run": self.run_name,
+                "started_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started_at)),
+                "wall_time_s": round(time.monotonic() - self._start, 4),
+                "totals": dict(self.totals),
+                "stages": stages,
+                "items": items,
+            }
+
+    def prometheus_text(self):
+        """Prometheus 文本格式：阶段耗时直方图 + token / 重试 / 解析失败计数器"""
+        run = self.run_name
+        lines = [
+            "# HELP uav_stage_duration_seconds Wall time per pipeline stage.",
+            "# TYPE uav_stage_duration_seconds histogram",
+        ]
+        with self._lock:
+            for stage, values in sorted(self.stages.items()):
+                labels = f'run="{run}",stage="{stage}"'
+                for bound in LATENCY_BUCKETS:
+                    count = sum(1 for v in values if v <= bound)
+                    lines.append(f'uav_stage_duration_seconds_bucket{{{labels},le="{bound}"}} {count}')
+                lines.append(f'uav_stage_duration_seconds_bucket{{{labels},le="+Inf"}} {len(values)}')
+                lines.append(f"uav_stage_duration_seconds_sum{{{labels}}} {sum(values):.6f}")
+                lines.append(f"uav_stage_duration_seconds_count{{{labels}}} {len(values)}")
+            for counter in COUNTERS:
+                lines.append(f"# TYPE uav_{counter}_total counter")
+                lines.append(f'uav_{counter}_total{{run="{run}"}} {self.totals[counter]}')
+            lines.append("# TYPE uav_items_total counter")
+            lines.append(f'uav_items_total{{run="{run}"}} {len(self.items)}')
+        return "\n".join(lines) + "\n"
+
+    def export(self, json_path, prom_path):
+        """写出 JSON 报告与 Prometheus 文本文件（原子替换）"""
+        save_json_atomic(json_path, self.report())
+        tmp_path = prom_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp_path, prom_path)
+
+    def parse_summary(self):
+        """一行解析统计：解析次数、失败率与截断恢复次数"""
+        with self._lock:
+            parses = len(self.stages.get("parse", []))
+            failures, recovered = self.totals["parse_failures"], self.totals["parse_recovered"]
+        rate = failures / parses if parses else 0.0
+        return f"解析 {parses} 次，失败 {failures}（{rate:.1%}），截断恢复 {recovered}"
+
+    def prescreen_summary(self):
+        """一行预筛统计：预筛图像数与跳过模型请求的比例"""
+        with self._lock:
+            screened = len(self.stages.get("prescreen", []))
+            skipped = self.totals["prescreen_skipped"]
+        rate = skipped / screened if screened else 0.0
+        return f"预筛 {screened} 张，跳过模型请求 {skipped}（{rate:.1%}）"
+
+    def summary(self):
+        """一行阶段耗时统计"""
+        report = self.report()
+        stages = "，".join(f"{stage} {s['total_s']:.1f}s" for stage, s in report["stages"].items())
+        return f"总耗时 {report['wall_time_s']:.1f}s；{stages or '无阶段记录'}"
+
+
+class _ThreadProfilers:
+    """为运行期间新启动的线程各创建一个 cProfile.Profile（cProfile 只统计调用 enable 的线程）"""
+
+    def __init__(self):
+        self.profilers = []
+        self._lock = threading.Lock()
+
+    def bootstrap(self, frame, event, arg):
+        """threading.setprofile 钩子：线程中第一次触发时换成该线程自己的 profiler"""
+        sys.setprofile(None)
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Python 3.12+ 的 cProfile 基于 sys.monitoring，主线程的 profiler 已覆盖所有线程
+            return
+        with self._lock:
+            self.profilers.append(profiler)
+
+
+@contextmanager
+def profile_run(path=None, top=PROFILE_TOP):
+    """
+    用 cProfile 包裹一次运行；path 为 None 时不做任何事
+    运行期间启动的线程（请求线程池、规划消费者线程）各自单独统计，结束时用 pstats.Stats.add 合并；
+    渲染 / 预处理进程池中的耗时不在其中
+    结束时保存 .prof 文件（可用 snakeviz / pstats 查看）并打印累计耗时最高的 top 个函数
+    """
+    if path is None:
+        yield
+        return
+    threads = _ThreadProfilers()
+    threading.setprofile(threads.bootstrap)
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        threading.setprofile(None)
+        # Stats.add 会 disable 并快照各线程的 profiler（持有 GIL，线程池中仍存活的空闲线程也可安全合并）
+        stats = pstats.Stats(profiler)
+        for thread_profiler in threads.profilers:
+            stats.add(thread_profiler)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        stats.dump_stats(path)
+        print(f"\n🔬 [Profile] 已保存至: {path}（主线程 + {len(threads.profilers)} 个工作线程）")
+        stats.sort_stats("cumulative").print_stats(top)
@@ -0,0 +1,176 @@
+"""
+本地确定性任务规划器
+直接实现 create_command_prompt 中描述的分配法则，替代 Step 2 的大模型调用：
+1. 优先级排序：含火点的区域优先（High > Low，火点多者优先），其次是仅需搜索的区域
+2. 能力匹配：火点区域优先分配有载荷的灭火机；普通区域优先分配侦查机，不足才用闲置灭火机
+3. 最小生存保障：先给每个区域各分 1 架，剩余兵力再分给高危区域
+4. 全局互斥：每架 UAV 全局只使用一次
+5. 可用性：仅 IDLE 或 RETURN 且电量 > 50% 的无人机可被分配
+6. 载荷饱和：每个火点优先使用列表中第一架有余量的灭火机，用满 current_payload 后切换下一架
+输出与 missions_plan.json 相同的 SearchArea / FlyToFire 代码行。
+"""
+import re
+
+import data.UAV as UAV
+from data.UAV import UAVStatus
+
+EXTINGUISHING_DRONE = "extinguishing_drone"
+SURVEILLANCE_DRONE = "surveillance_drone"
+
+# RETURN 状态的无人机电量高于该值才可被分配
+RETURN_BATTERY_THRESHOLD = 50.0
+
+# 区域风险等级排序（数值越小优先级越高）
+RISK_RANK = {"High": 0, "Low": 1, "Monitor": 2}
+
+
+def load_uav_fleet(module=UAV):
+    """提取模块中所有 UAV 定义（与 get_uav_resources 相同的约定：以 UAV_ 开头的字典）"""
+    fleet = []
+    for name in sorted(vars(module)):
+        obj = getattr(module, name)
+        if name.startswith("UAV_") and isinstance(obj, dict):
+            fleet.append(obj)
+    return fleet
+
+
+def is_available(uav):
+    """可用性规则：IDLE，或 RETURN 且电量 > 50%"""
+    status = uav.get("status")
+    if status == UAVStatus.IDLE:
+        return True
+    return status == UAVStatus.RETURN and uav.get("battery", 0) > RETURN_BATTERY_THRESHOLD
+
+
+def get_payload(uav):
+    return uav.get("capabilities", {}).get("current_payload", 0)
+
+
+def can_extinguish(uav):
+    """可执行灭火：灭火机且当前载荷 > 0"""
+    return uav.get("type") == EXTINGUISHING_DRONE and get_payload(uav) > 0
+
+
+def _zone_priority(zone):
+    fire_points = zone.get("fire_points") or []
+    has_fire = 0 if fire_points else 1
+    return has_fire, RISK_RANK.get(zone.get("risk_level"), len(RISK_RANK)), -len(fire_points)
+
+
+def _take(pool, predicate):
+    """从候选池中取出第一架满足条件的无人机"""
+    for index, uav in enumerate(pool):
+        if predicate(uav):
+            return pool.pop(index)
+    return None
+
+
+def allocate_uavs(zones, fleet):
+    """
+    全局资源规划
+    :param zones: Step 1 输出的 zone 列表
+    :param fleet: 无人机字典列表
+    :return: {zone_id: [uav, ...]}，列表中有载荷的灭火机排在前面
+    """
+    pool = [uav for uav in fleet if is_available(uav)]
+    ordered_zones = sorted(zones, key=_zone_priority)
+    assignment = {zone["id"]: [] for zone in zones}
+
+    # 1. 最小生存保障：按优先级给每个区域先分 1 架
+    for zone in ordered_zones:
+        if zone.get("fire_points"):
+            uav = (_take(pool, can_extinguish)
+                   or _take(pool, lambda u: u.get("type") == SURVEILLANCE_DRONE)
+                   or _take(pool, lambda u: True))
+        else:
+            uav = (_take(pool, lambda u: u.get("type") == SURVEILLANCE_DRONE)
+                   or _take(pool, lambda u: not can_extinguish(u))
+                   or _take(pool, lambda u: True))
+        if uav is not None:
+            assignment[zone["id"]].append(uav)
+
+    fire_zones = [zone for zone in ordered_zones if zone.get("fire_points")]
+
+    # 2. 剩余灭火机优先补足火点区域的载荷缺口
+    for zone in fire_zones:
+        assigned = assignment[zone["id"]]
+        demand = len(zone["fire_points"]) - sum(get_payload(u) for u in assigned if can_extinguish(u))
+        while demand > 0:
+            uav = _take(pool, can_extinguish)
+            if uav is None:
+                break
+            assigned.append(uav)
+            demand -= get_payload(uav)
+
+    # 3. 其余兵力轮流分配给高危区域
+    high_zones = [zone for zone in fire_zones if zone.get("risk_level") == "High"]
+    index = 0
+    while pool and high_zones:
+        assignment[high_zones[index % len(high_zones)]["id"]].append(pool.pop(0))
+        index += 1
+
+    # 列表内有载荷的灭火机在前，FlyToFire 按列表顺序饱和使用
+    for zone_id, assigned in assignment.items():
+        assignment[zone_id] = [u for u in assigned if can_extinguish(u)] + \
+                              [u for u in assigned if not can_extinguish(u)]
+    return assignment
+
+
+def zone_variable_name(zone_id):
+    """区域 UAV 列表的变量名，如 zone_0 -> zone_0_uavs"""
+    name = re.sub(r"\W", "_", str(zone_id))
+    if not name or name[0].isdigit():
+        name = f"zone_{name}"
+    return f"{name}_uavs"
+
+
+def plan_mission_lines(zones, fleet=None):
+    """
+    生成任务代码行
+    :param zones: Step 1 输出的 zone 列表
+    :param fleet: 无人机字典列表，默认读取 data/UAV.py
+    :return: 代码行列表（missions_plan.json 的存储格式）
+    """
+    fleet = load_uav_fleet() if fleet is None else fleet
+    assignment = allocate_uavs(zones, fleet)
+
+    lines = []
+    for zone in zones:
+        assigned = assignment[zone["id"]]
+        # 熔断规则：列表为空时不生成任何代码
+        if not assigned:
+            continue
+
+        var = zone_variable_name(zone["id"])
+        lines.append(f"{var} = {[u['id'] for u in assigned]!r}")
+        lines.append(f"SearchArea({var}, {zone['id']!r})")
+
+        # 载荷饱和：用满当前灭火机的载荷后再切换下一架
+        slot, used = 0, 0
+        for point in zone.get("fire_points") or []:
+            while slot < len(assigned) and (not can_extinguish(assigned[slot]) or used >= get_payload(assigned[slot])):
+                slot, used = slot + 1, 0
+            if slot >= len(assigned):
+                break
+            lines.append(f"FlyToFire({var}[{slot}], {list(point)!r})")
+            used += 1
+    return lines
+
+
+class LocalMissionPlanner:
+    def __init__(self, fleet=None):
+        """
+        初始化本地规划器（与 MissionPlanner 接口一致，无需 client）
+        :param fleet: 无人机字典列表，默认每次规划时读取 data/UAV.py
+        """
+        self.fleet = fleet
+
+    def generate_mission_code(self, zones_data, scene=None):
+        """
+        基于区域数据生成无人机控制代码（多行文本）
+        :param scene: 场景名称（与 MissionPlanner 接口一致，本地规划器不使用）
+        """
+        if not zones_data:
+            print("   [Planner Warning] 接收到的区域数据为空，跳过规划。")
+            return ""
+        return "\n".join(plan_mission_lines(zones_data, self.fleet))
@@ -0,0 +1,136 @@
+"""
+上传前的图像预处理
+模型只输出 0~1 归一化坐标，全分辨率像素收益很小。
+本模块在上传前把图片缩放到指定最长边、按指定质量重新编码为 JPEG 并去除 EXIF，
+缩放与编码在进程池中执行，使 CPU 计算与网络 I/O 重叠。
+另提供坐标漂移对比工具，用于评估预处理前后模型输出的差异。
+"""
+import os
+import sys
+import json
+import math
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image
+from tools.upload_cache import file_sha256
+
+DEFAULT_MAX_SIDE = 1600
+DEFAULT_QUALITY = 85
+
+
+def preprocess_image(image_path, output_dir, max_side=DEFAULT_MAX_SIDE, quality=DEFAULT_QUALITY):
+    """
+    缩放并重新编码单张图片
+    :param image_path: 原始图片路径
+    :param output_dir: 输出目录
+    :param max_side: 最长边像素上限（原图更小时不放大）
+    :param quality: JPEG 质量 (1~95)
+    :return: 处理后的图片路径
+    """
+    # 文件名带原图完整路径与内容 SHA-256 的短哈希：0001.jpg / 0001.png、不同目录下的同名图片互不覆盖，
+    # 原图内容变化后生成新文件（预处理参数已体现在 output_dir 的子目录中）
+    stem = os.path.splitext(os.path.basename(image_path))[0]
+    key = f"{os.path.abspath(image_path)}|{file_sha256(image_path)}"
+    output_path = os.path.join(output_dir, f"{stem}_{hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]}.jpg")
+
+    # 输出已存在时直接复用，保证重复运行时字节一致（便于命中上传/响应缓存）
+    if os.path.exists(output_path):
+        return output_path
+
+    os.makedirs(output_dir, exist_ok=True)
+    with Image.open(image_path) as img:
+        # 注意：不根据 EXIF 方向旋转，保持与可视化使用的原始像素坐标系一致
+        img = img.convert("RGB")
+        w, h = img.size
+        scale = max_side / max(w, h)
+        if scale < 1:
+            img = img.resize((max(1, round(w * scale)), max(1, round(h * scale))), Image.LANCZOS)
+
+        # 不传入 exif 参数即不写入 EXIF 元数据
+        tmp_path = output_path + f".{os.getpid()}.tmp"
+        img.save(tmp_path, format="JPEG", quality=quality, optimize=True)
+    os.replace(tmp_path, output_path)
+    return output_path
+
+
+class ImagePreprocessor:
+    def __init__(self, output_dir, max_side=DEFAULT_MAX_SIDE, quality=DEFAULT_QUALITY, max_workers=None):
+        """
+        基于进程池的图像预处理器
+        :param output_dir: 处理结果根目录（按参数分子目录，避免不同配置互相覆盖）
+        :param max_side: 最长边像素上限
+        :param quality: JPEG 质量
+        :param max_workers: 进程数，None 表示使用 CPU 核数
+        """
+        self.output_dir = os.path.join(output_dir, f"{max_side}_q{quality}")
+        self.max_side = max_side
+        self.quality = quality
+        self._executor = ProcessPoolExecutor(max_workers=max_workers)
+        # 立即启动工作进程，使 fork 发生在调用方创建请求线程之前
+        self._executor.submit(int).result()
+
+    def submit(self, image_path):
+        """提交单张图片的预处理任务，返回 Future（结果为处理后的路径）"""
+        return self._executor.submit(preprocess_image, image_path, self.output_dir, self.max_side, self.quality)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def compare_zone_drift(zones_ref, zones_test):
+    """
+    计算两组 zone 结果的火点坐标漂移（以参考结果为基准，逐点取最近邻距离）
+    :param zones_ref: 参考结果（如全分辨率）的 zone 列表
+    :param zones_test: 待评估结果（如预处理后）的 zone 列表
+    :return: 统计字典
+    """
+    ref_points = [p for z in zones_ref or [] for p in z.get("fire_points", [])]
+    test_points = [p for z in zones_test or [] for p in z.get("fire_points", [])]
+
+    distances = []
+    if test_points:
+        for rx, ry in ref_points:
+            distances.append(min(math.hypot(rx - tx, ry - ty) for tx, ty in test_points))
+
+    return {
+        "ref_fire_points": len(ref_points),
+        "test_fire_points": len(test_points),
+        "ref_zones": len(zones_ref or []),
+        "test_zones": len(zones_test or []),
+        "mean_drift": sum(distances) / len(distances) if distances else None,
+        "max_drift": max(distances) if distances else None,
+    }
+
+
+def compare_zone_files(ref_json, test_json):
+    """对比两个 zones_data.json 文件中同名图像的坐标漂移"""
+    with open(ref_json, "r", encoding="utf-8") as f:
+        ref_data = json.load(f)
+    with open(test_json, "r", encoding="utf-8") as f:
+        test_data = json.load(f)
+
+    report = {}
+    for file_name in sorted(set(ref_data) & set(test_data)):
+        report[file_name] = compare_zone_drift(ref_data[file_name], test_data[file_name])
+    return report
+
+
+if __name__ == '__main__':
+    # 用法：python -m tools.preprocess <全分辨率 zones_data.json> <预处理后 zones_data.json>
+    if len(sys.argv) != 3:
+        print("用法: python -m tools.preprocess <ref_zones.json> <test_zones.json>")
+        sys.exit(1)
+
+    drift_report = compare_zone_files(sys.argv[1], sys.argv[2])
+    all_mean = [r["mean_drift"] for r in drift_report.values() if r["mean_drift"] is not None]
+    for name, r in drift_report.items():
+        print(f"{name}: 火点 {r['ref_fire_points']} -> {r['test_fire_points']}, "
+              f"平均漂移 {r['mean_drift']}, 最大漂移 {r['max_drift']}")
+    if all_mean:
+        print(f"整体平均漂移: {sum(all_mean) / len(all_mean):.4f}")
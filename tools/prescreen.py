@@ -0,0 +1,140 @@
+"""
+本地火焰 / 烟雾预筛
+例行巡逻拍到的大量画面只有森林，却同样要请求一次视觉大模型。
+本模块在请求前对缩小后的图像做向量化 HSV 颜色与亮度统计（NumPy + Pillow）：
+- 火焰像素：色相位于红-橙-黄区间、饱和度高、亮度高且明显高于整图平均亮度
+- 烟雾像素：低饱和度的中高亮度灰白色
+两者占比折算为 0~1 的火情分数。低于阈值的图像直接生成整图 Monitor 区域，不调用模型；
+高于阈值时，火焰像素聚集的网格中心可作为候选热点提示附加到提示词中。
+"""
+from collections import namedtuple
+
+import numpy as np
+from PIL import Image
+
+# 统计使用的缩小尺寸（最长边像素）
+SCREEN_SIZE = 384
+# 低于该分数的图像视为无火情（默认偏保守：0.01% 火焰像素或 2.5% 烟雾像素即达到阈值，
+# 384px 缩略图上约 8 个火焰像素；temp/ 中火点最少的样例约 34 个）
+DEFAULT_THRESHOLD = 0.1
+# 火焰 / 烟雾占比达到该值时各自贡献满分 1.0
+FLAME_FULL_RATIO = 0.001
+SMOKE_FULL_RATIO = 0.25
+
+# HSV 阈值（H 为角度 0~360，S / V 为 0~1）
+FLAME_HUE_MAX = 50.0            # 红 -> 黄
+FLAME_HUE_WRAP = 340.0          # 品红侧的红色
+FLAME_MIN_SATURATION = 0.35
+FLAME_MIN_VALUE = 0.6
+FLAME_MIN_CONTRAST = 0.15       # 比整图平均亮度至少高出的值（排除秋季橙黄树冠等低亮度暖色）
+SMOKE_MAX_SATURATION = 0.18
+SMOKE_VALUE_RANGE = (0.45, 0.92)
+
+# 热点提示：把图像划分为 HOTSPOT_GRID x HOTSPOT_GRID 个网格，取火焰像素最多的若干个
+HOTSPOT_GRID = 16
+HOTSPOT_MIN_PIXELS = 3
+MAX_HOTSPOTS = 10
+
+ScreenResult = namedtuple("ScreenResult", ["score", "flame_ratio", "smoke_ratio", "mean_value", "hotspots"])
+
+
+def load_hsv(image_path, size=SCREEN_SIZE):
+    """以缩小尺寸解码图像，返回 (H, W, 3) float32 HSV 数组（H 为角度，S / V 为 0~1）"""
+    with Image.open(image_path) as img:
+        # JPEG 直接按缩小比例解码，不解码全分辨率像素
+        img.draft("RGB", (size, size))
+        img = img.convert("RGB")
+        img.thumbnail((size, size), Image.BILINEAR)
+        hsv = np.asarray(img.convert("HSV"), dtype=np.float32)
+    return hsv * np.array([360.0 / 255.0, 1.0 / 255.0, 1.0 / 255.0], dtype=np.float32)
+
+
+def _hotspots(flame_mask, grid=HOTSPOT_GRID, limit=MAX_HOTSPOTS):
+    """火焰像素最多的网格内火焰像素的质心（归一化坐标），按像素数降序"""
+    h, w = flame_mask.shape
+    ys, xs = np.nonzero(flame_mask)
+    if len(xs) == 0:
+        return []
+    cells = (ys * grid // h) * grid + (xs * grid // w)
+    counts = np.bincount(cells, minlength=grid * grid)
+    sum_x = np.bincount(cells, weights=xs + 0.5, minlength=grid * grid)
+    sum_y = np.bincount(cells, weights=ys + 0.5, minlength=grid * grid)
+    order = [c for c in np.argsort(counts)[::-1][:limit] if counts[c] >= HOTSPOT_MIN_PIXELS]
+    return [[round(float(sum_x[c] / counts[c] / w), 3), round(float(sum_y[c] / counts[c] / h), 3)] for c in order]
+
+
+def screen_image(image_path, size=SCREEN_SIZE):
+    """
+    计算单张图像的火情分数
+    :param image_path: 图片路径
+    :param size: 统计使用的缩小尺寸
+    :return: ScreenResult（score 为 0~1，hotspots 为候选热点的归一化坐标）
+    """
+    hsv = load_hsv(image_path, size)
+    hue, sat, val = hsv[..., 0], hsv[..., 1], hsv[..., 2]
+    mean_value = float(val.mean())
+
+    warm = (hue <= FLAME_HUE_MAX) | (hue >= FLAME_HUE_WRAP)
+    flame = warm & (sat >= FLAME_MIN_SATURATION) & (val >= max(FLAME_MIN_VALUE, mean_value + FLAME_MIN_CONTRAST))
+    smoke = (sat <= SMOKE_MAX_SATURATION) & (val >= SMOKE_VALUE_RANGE[0]) & (val <= SMOKE_VALUE_RANGE[1])
+
+    flame_ratio, smoke_ratio = float(flame.mean()), float(smoke.mean())
+    score = min(1.0, flame_ratio / FLAME_FULL_RATIO + smoke_ratio / SMOKE_FULL_RATIO)
+    return ScreenResult(round(score, 4), flame_ratio, smoke_ratio, mean_value, _hotspots(flame))
+
+
+def monitor_zones(result):
+    """无火情图像的合成结果：覆盖整图的单个 Monitor 区域"""
+    return [{
+        "id": "zone_0",
+        "risk_level": "Monitor",
+        "coordinates": [[0.0, 0.0], [1.0, 0.0], [1.0, 1.0], [0.0, 1.0]],
+        "fire_points": [],
+        "reason": f"本地预筛未检测到火焰或烟雾特征（分数 {result.score:.3f}），未调用视觉模型",
+        "boundary_description": "覆盖整张图像",
+    }]
+
+
+def hotspot_hint(result):
+    """候选热点提示文本（附加在提示词之后）；没有热点时返回 None"""
+    if not result.hotspots:
+        return None
+    return ("【本地预筛提示（仅供参考）】以下归一化坐标附近检测到疑似火焰颜色的高亮像素，"
+            f"请结合图像逐一确认，不要遗漏其他火点: {result.hotspots}")
+
+
+class PreScreener:
+    def __init__(self, threshold=DEFAULT_THRESHOLD, hints=False, size=SCREEN_SIZE):
+        """
+        请求前的本地预筛
+        :param threshold: 火情分数阈值，低于该值的图像不调用模型
+        :param hints: 是否把候选热点坐标作为提示附加到提示词
+        :param size: 统计使用的缩小尺寸
+        """
+        self.threshold = threshold
+        self.hints = hints
+        self.size = size
+
+    def screen(self, image_path):
+        """返回 (合成 zones 或 None, 提示文本或 None)：前者非 None 时表示跳过模型请求"""
+        result = screen_image(image_path, self.size)
+        if result.score < self.threshold:
+            return monitor_zones(result), None
+        return None, hotspot_hint(result) if self.hints else None
+
+
+def add_prescreen_arguments(parser):
+    """为入口脚本添加本地预筛相关的命令行参数"""
+    parser.add_argument("--prescreen", action="store_true",
+                        help="请求前做本地火焰 / 烟雾颜色预筛，低于阈值的图像直接输出整图 Monitor 区域")
+    parser.add_argument("--prescreen-threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help=f"预筛火情分数阈值 0~1（默认 {DEFAULT_THRESHOLD}）")
+    parser.add_argument("--prescreen-hints", action="store_true",
+                        help="把预筛找到的候选热点坐标作为提示附加到提示词")
+
+
+def create_prescreener(args):
+    """根据命令行参数创建 PreScreener；未启用时返回 None"""
+    if not args.prescreen:
+        return None
+    return PreScreener(args.prescreen_threshold, hints=args.prescreen_hints)
@@ -0,0 +1,33 @@
+"""
+客户端请求限速工具
+用于在多线程并发调用 Gemini API 时，限制单位时间内发出的请求数量，避免触发服务端配额限制。
+"""
+import threading
+import time
+
+
+class RateLimiter:
+    def __init__(self, requests_per_minute=None):
+        """
+        初始化限速器（令牌均匀释放）
+        :param requests_per_minute: 每分钟允许的最大请求数，None 或 <=0 表示不限速
+        """
+        if requests_per_minute and requests_per_minute > 0:
+            self.interval = 60.0 / requests_per_minute
+        else:
+            self.interval = 0.0
+        self._lock = threading.Lock()
+        self._next_time = 0.0
+
+    def acquire(self):
+        """阻塞直到允许发出下一个请求（线程安全）"""
+        if self.interval <= 0:
+            return
+
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next_time - now
+            self._next_time = max(now, self._next_time) + self.interval
+
+        if wait > 0:
+            time.sleep(wait)
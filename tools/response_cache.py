@@ -0,0 +1,129 @@
+"""
+模型响应缓存（磁盘持久化）
+两个阶段的模型调用均使用 temperature=0.0，相同的 模型 + 配置 + 输入内容 应得到相同结果。
+以三者的哈希为 key 缓存 response.text，支持条目数 / 总字节数 / 存活时间限制，按 LRU 淘汰。
+"""
+import os
+import json
+import time
+import hashlib
+import threading
+
+
+def make_cache_key(model, config, parts, client_kind="gemini"):
+    """
+    计算缓存 key
+    :param model: 模型名称
+    :param config: GenerateContentConfig（或任意可 JSON 序列化的配置）
+    :param parts: 请求内容列表，元素为 str 或 bytes（图片可传入其内容哈希）
+    :param client_kind: Client 种类；非 gemini 时写入 key，替身回放的响应不会被真实运行命中
+                        （gemini 不写入，已有的真实缓存保持有效）
+    """
+    digest = hashlib.sha256()
+    digest.update(model.encode("utf-8"))
+    if client_kind != "gemini":
+        digest.update(b"\0client:" + client_kind.encode("utf-8"))
+    if hasattr(config, "model_dump_json"):
+        config_text = config.model_dump_json(exclude_none=True)
+    else:
+        config_text = json.dumps(config, sort_keys=True, ensure_ascii=False)
+    digest.update(b"\0" + config_text.encode("utf-8"))
+    for part in parts:
+        data = part if isinstance(part, bytes) else str(part).encode("utf-8")
+        # 写入长度前缀，避免不同切分方式拼接出相同字节流
+        digest.update(b"\0" + str(len(data)).encode("ascii") + b":" + data)
+    return digest.hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, cache_dir, max_entries=5000, max_bytes=200 * 1024 * 1024,
+                 max_age_seconds=30 * 24 * 3600, bypass=False):
+        """
+        初始化响应缓存
+        :param cache_dir: 缓存目录（每个条目一个 JSON 文件）
+        :param max_entries: 最大条目数
+        :param max_bytes: 缓存总大小上限（字节）
+        :param max_age_seconds: 条目最长存活时间（秒）
+        :param bypass: 为 True 时跳过读取（强制重新请求），但仍写入新结果以刷新缓存
+        """
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.bypass = bypass
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key):
+        """读取缓存的响应文本，未命中 / 过期 / bypass 时返回 None"""
+        if self.bypass:
+            return None
+
+        path = self._path(key)
+        with self._lock:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    entry = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                return None
+
+            if time.time() - entry.get("created", 0) > self.max_age_seconds:
+                self._remove(path)
+                return None
+
+            # 刷新访问时间，作为 LRU 依据
+            os.utime(path, None)
+            return entry.get("text")
+
+    def put(self, key, text, model=None):
+        """写入响应文本，并按限制执行淘汰"""
+        if not text:
+            return
+
+        path = self._path(key)
+        entry = {"created": time.time(), "model": model, "text": text}
+        with self._lock:
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+            self._evict()
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _evict(self):
+        """淘汰过期条目，再按最近访问时间从旧到新淘汰，直到满足条目数与大小限制"""
+        now = time.time()
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        # mtime 在写入和命中时更新；超过存活时间未被写入/访问的条目也一并淘汰
+        alive = []
+        for mtime, size, path in entries:
+            if now - mtime > self.max_age_seconds:
+                self._remove(path)
+            else:
+                alive.append((mtime, size, path))
+
+        alive.sort()
+        total_bytes = sum(size for _, size, _ in alive)
+        while alive and (len(alive) > self.max_entries or total_bytes > self.max_bytes):
+            _, size, path = alive.pop(0)
+            total_bytes -= size
+            self._remove(path)
@@ -0,0 +1,170 @@
+"""
+火点航线优化
+对任务代码中每架 UAV 被分配的火点重新排序，使其从当前位置 (location) 出发的总飞行时间最短：
+- 距离矩阵使用 NumPy 向量化计算
+- 最近邻构造初始路径 + 2-opt 局部优化（起点固定为 UAV 当前位置，终点不限）
+- 飞行时间 = 距离 × 场景尺度 / max_speed，并按电量估算续航是否足够
+同时输出每个区域的预计首次投放时间 (time-to-first-drop)。
+"""
+import re
+import numpy as np
+
+# 归一化坐标 1.0 对应的实际距离（米），用于把归一化距离换算为飞行时间
+SCENE_SCALE_M = 1000.0
+
+# 满电状态下的续航时间（秒），按电量比例估算剩余续航
+FULL_BATTERY_ENDURANCE_S = 1800.0
+
+_ASSIGN_RE = re.compile(r"^\s*(\w+)\s*=\s*\[(.*)\]\s*$")
+_FLY_RE = re.compile(r"^\s*FlyToFire\(\s*(\w+)\[(\d+)\]\s*,\s*\[\s*([-\d.eE+]+)\s*,\s*([-\d.eE+]+)\s*\]\s*\)\s*$")
+_SEARCH_RE = re.compile(r"^\s*SearchArea\(\s*(\w+)\s*,\s*['\"](.+?)['\"]\s*\)\s*$")
+
+
+def distance_matrix(points):
+    """计算点集两两之间的欧氏距离矩阵 (N, N)"""
+    points = np.asarray(points, dtype=float)
+    diff = points[:, None, :] - points[None, :, :]
+    return np.sqrt((diff ** 2).sum(axis=-1))
+
+
+def _path_length(dist, order):
+    return float(dist[order[:-1], order[1:]].sum())
+
+
+def nearest_neighbour_order(dist):
+    """最近邻构造：从节点 0（起点）出发，返回访问顺序（含起点）"""
+    n = len(dist)
+    order = [0]
+    visited = np.zeros(n, dtype=bool)
+    visited[0] = True
+    for _ in range(n - 1):
+        candidates = np.where(visited, np.inf, dist[order[-1]])
+        nxt = int(np.argmin(candidates))
+        order.append(nxt)
+        visited[nxt] = True
+    return np.array(order)
+
+
+def two_opt(dist, order, max_rounds=100):
+    """
+    2-opt 局部优化（开放路径，起点固定）
+    对每个 i 向量化计算所有 j 的反转收益，取最优一次改进，直到无改进
+    """
+    order = np.array(order)
+    n = len(order)
+    if n < 4:
+        # 起点 + 至多 2 个火点时，仅需比较两种顺序
+        if n == 3 and dist[order[0], order[2]] + dist[order[2], order[1]] < dist[order[0], order[1]] + dist[order[1], order[2]]:
+            order = order[[0, 2, 1]]
+        return order
+
+    for _ in range(max_rounds):
+        improved = False
+        for i in range(1, n - 1):
+            a, b = order[i - 1], order[i]
+            js = np.arange(i + 1, n)
+            c = order[js]
+            # 反转 order[i..j]：边 (a,b),(c,d) 替换为 (a,c),(b,d)；j 为末尾时无 (c,d) 边
+            d = order[np.minimum(js + 1, n - 1)]
+            is_last = js == n - 1
+            old = dist[a, b] + np.where(is_last, 0.0, dist[c, d])
+            new = dist[a, c] + np.where(is_last, 0.0, dist[b, d])
+            gain = old - new
+            best = int(np.argmax(gain))
+            if gain[best] > 1e-12:
+                j = js[best]
+                order[i:j + 1] = order[i:j + 1][::-1]
+                improved = True
+        if not improved:
+            break
+    return order
+
+
+def optimize_route(start, points):
+    """
+    计算单架 UAV 的最优火点访问顺序
+    :param start: 起点坐标 [x, y]
+    :param points: 火点坐标列表
+    :return: (火点下标顺序, 逐段累计距离列表)
+    """
+    if not points:
+        return [], []
+    nodes = np.vstack([np.asarray(start, dtype=float)[None, :], np.asarray(points, dtype=float)])
+    dist = distance_matrix(nodes)
+    order = two_opt(dist, nearest_neighbour_order(dist))
+    cumulative = np.cumsum(dist[order[:-1], order[1:]])
+    return [int(k) - 1 for k in order[1:]], cumulative.tolist()
+
+
+def parse_plan_lines(lines):
+    """
+    解析任务代码行
+    :return: (变量名 -> UAV ID 列表, 变量名 -> 区域 ID, [(行号, 变量名, UAV 下标, [x, y])])
+    """
+    uav_lists, zone_ids, fly_calls = {}, {}, []
+    for index, line in enumerate(lines):
+        m = _FLY_RE.match(line)
+        if m:
+            fly_calls.append((index, m.group(1), int(m.group(2)), [float(m.group(3)), float(m.group(4))]))
+            continue
+        m = _SEARCH_RE.match(line)
+        if m:
+            zone_ids[m.group(1)] = m.group(2)
+            continue
+        m = _ASSIGN_RE.match(line)
+        if m:
+            uav_lists[m.group(1)] = re.findall(r"['\"]([^'\"]+)['\"]", m.group(2))
+    return uav_lists, zone_ids, fly_calls
+
+
+def _format_point(point):
+    return "[" + ", ".join(repr(round(v, 6)) for v in point) + "]"
+
+
+def route_mission_lines(lines, fleet, scene_scale_m=SCENE_SCALE_M):
+    """
+    对任务代码中每架 UAV 的 FlyToFire 顺序做航线优化
+    :param lines: 任务代码行列表（missions_plan.json 中一个场景的 value）
+    :param fleet: 无人机字典列表（提供 location / max_speed / battery）
+    :param scene_scale_m: 归一化坐标 1.0 对应的实际距离（米）
+    :return: (优化后的代码行, 报告 {zone_id: {...}})
+    """
+    uav_lists, zone_ids, fly_calls = parse_plan_lines(lines)
+    uav_by_id = {uav["id"]: uav for uav in fleet}
+
+    # 按 (区域变量, UAV 下标) 分组火点，记录每个区域 FlyToFire 行的位置
+    groups, slots = {}, {}
+    for line_no, var, idx, point in fly_calls:
+        groups.setdefault((var, idx), []).append(point)
+        slots.setdefault(var, []).append(line_no)
+
+    new_fly_lines = {var: [] for var in slots}
+    report = {}
+    for (var, idx), points in sorted(groups.items()):
+        uav_ids = uav_lists.get(var, [])
+        uav = uav_by_id.get(uav_ids[idx]) if idx < len(uav_ids) else None
+        start = uav.get("location", [0.0, 0.0]) if uav else [0.0, 0.0]
+        speed = uav.get("capabilities", {}).get("max_speed") if uav else None
+
+        order, cumulative = optimize_route(start, points)
+        for k in order:
+            new_fly_lines[var].append(f"FlyToFire({var}[{idx}], {_format_point(points[k])})")
+
+        zone_id = zone_ids.get(var, var)
+        zone_report = report.setdefault(zone_id, {"time_to_first_drop_s": None, "uavs": {}})
+        entry = {"route_length": cumulative[-1] if cumulative else 0.0, "fire_points": len(points)}
+        if speed:
+            seconds = [c * scene_scale_m / speed for c in cumulative]
+            entry["time_to_first_drop_s"] = seconds[0]
+            entry["total_flight_time_s"] = seconds[-1]
+            entry["battery_ok"] = seconds[-1] <= FULL_BATTERY_ENDURANCE_S * uav.get("battery", 100.0) / 100.0
+            first = zone_report["time_to_first_drop_s"]
+            zone_report["time_to_first_drop_s"] = seconds[0] if first is None else min(first, seconds[0])
+        zone_report["uavs"][uav_ids[idx] if idx < len(uav_ids) else f"{var}[{idx}]"] = entry
+
+    # 在原 FlyToFire 行的位置上写回优化后的顺序
+    routed = list(lines)
+    for var, line_numbers in slots.items():
+        for line_no, new_line in zip(line_numbers, new_fly_lines[var]):
+            routed[line_no] = new_line
+    return routed, report
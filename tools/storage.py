@@ -0,0 +1,87 @@
+"""
+结果文件读写工具
+- 原子写入：保证增量保存过程中被中断时输出文件始终是完整可读的 JSON。
+- 追加日志：每条结果完成即写入 JSONL，支持 --resume 续跑，结束时压缩为最终 JSON 格式。
+"""
+import os
+import json
+import threading
+
+
+def save_json_atomic(path, data):
+    """先写临时文件再替换，避免写入过程中断导致文件损坏"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=4)
+    os.replace(tmp_path, path)
+
+
+class ResultJournal:
+    def __init__(self, path):
+        """
+        追加写入的结果日志（JSONL，每行一条 {"key": ..., "value": ...}）
+        每条记录写入后立即 flush + fsync，进程崩溃或 Ctrl-C 时已完成的结果不会丢失。
+        :param path: 日志文件路径
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    def load(self):
+        """读取日志，同一 key 以最后一条为准；末尾被截断的行会被忽略"""
+        records = {}
+        if not os.path.exists(self.path):
+            return records
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                records[record["key"]] = record["value"]
+        return records
+
+    def append(self, key, value):
+        """追加一条记录"""
+        line = json.dumps({"key": key, "value": value}, ensure_ascii=False)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def reset(self):
+        """清空日志（非续跑模式下从头开始）"""
+        with self._lock:
+            open(self.path, "w", encoding="utf-8").close()
+
+
+def journal_path_for(output_path):
+    """输出文件对应的日志路径，如 out/zones_data.json -> out/zones_data.jsonl"""
+    return os.path.splitext(output_path)[0] + ".jsonl"
+
+
+def load_json(path, default=None):
+    """读取 JSON 文件，不存在或损坏时返回默认值"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return default
+
+
+def compact_results(records, output_path, order=None):
+    """
+    压缩：把日志记录写成最终的 JSON 输出格式
+    :param records: key -> value 字典
+    :param output_path: 输出 JSON 路径（zones_data.json / missions_plan.json）
+    :param order: 可选的 key 顺序，未出现在 order 中的 key 追加在末尾
+    """
+    if order is not None:
+        order = list(order)
+        ordered = set(order)
+        keys = order + [k for k in records if k not in ordered]
+        records = {k: records.get(k) for k in keys}
+    save_json_atomic(output_path, records)
+    return records
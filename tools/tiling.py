@@ -0,0 +1,366 @@
+"""
+大幅正射影像的分块分析
+拼接后的正射影像（orthomosaic）每边可达数万像素：整图上传会失败，或在服务端缩放后丢失小火点。
+本模块把影像切成带重叠的图块，在线程池中并行调用 VisionAnalyzer.analyze_scene，
+再把图块内的归一化坐标映射回整幅影像，合并为一个场景条目：
+- 每个图块只保留其"核心区域"（重叠带从中线一分为二）内的内容：zone 多边形裁剪到核心区域，
+  核心区域外的火点丢弃，因此相邻图块的 zone 互不重叠
+- 被核心区域边界（接缝）切开的同一区域：接缝两侧风险等级相同、在接缝上的边相互重叠的片段
+  拼接为一个 zone（片段都已裁剪到各自核心区域，沿接缝拼接即为两者的并集）
+- 核心区域边界附近被两个图块重复识别的火点，再按像素半径去重
+图块像素只在工作线程中按需读取，同一时刻内存中最多只有 max_workers 个图块。
+.npy 输入以 np.load(mmap_mode="r") 内存映射读取，内存占用与影像大小无关；
+其他格式由 Pillow 打开，首次裁剪时会完整解码一次（内存与影像大小成正比），
+需要恒定内存时先用 `python -m tools.tiling <影像> <输出.npy>` 转换。
+"""
+import os
+import sys
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from tools.geometry import clip_polygon_to_box
+
+DEFAULT_TILE_SIZE = 2048
+DEFAULT_TILE_OVERLAP = 256
+# 火点去重半径（整幅影像像素）
+DEFAULT_DEDUPE_PX = 16
+# 判断顶点落在接缝上的容差（像素）
+SEAM_EPS = 1e-6
+TILE_QUALITY = 90
+
+# 图块：像素范围 [x0, x1) x [y0, y1)，以及归属于该图块的核心区域（整幅影像像素）
+Tile = namedtuple("Tile", ["name", "x0", "y0", "x1", "y1", "core"])
+
+
+class Mosaic:
+    def __init__(self, path):
+        """
+        按需读取的大幅影像
+        :param path: .npy（H x W x C 或 H x W 的 uint8 数组，内存映射读取）或 Pillow 支持的图片
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        if path.lower().endswith(".npy"):
+            self._array = np.load(path, mmap_mode="r")
+            self._image = None
+            self.height, self.width = self._array.shape[:2]
+        else:
+            # 正射影像远超 Pillow 的解压炸弹像素上限，这里是可信的本地输入
+            Image.MAX_IMAGE_PIXELS = None
+            self._array = None
+            self._image = Image.open(path)
+            self.width, self.height = self._image.size
+
+    def crop(self, x0, y0, x1, y1):
+        """读取一个矩形区域，返回 RGB 的 PIL.Image"""
+        if self._array is not None:
+            return Image.fromarray(np.ascontiguousarray(self._array[y0:y1, x0:x1])).convert("RGB")
+        # Pillow 的图像对象不是线程安全的：首次裁剪触发整图解码，之后的裁剪也串行执行
+        with self._lock:
+            return self._image.crop((x0, y0, x1, y1)).convert("RGB")
+
+    def close(self):
+        if self._image is not None:
+            self._image.close()
+
+
+def _axis_starts(length, tile_size, overlap):
+    """单个坐标轴上的图块起点：步长 tile_size - overlap，最后一块与末端对齐"""
+    if length <= tile_size:
+        return [0]
+    stride = max(1, tile_size - overlap)
+    starts = list(range(0, length - tile_size, stride))
+    starts.append(length - tile_size)
+    return starts
+
+
+def _axis_cores(starts, length, tile_size):
+    """各图块在该坐标轴上的核心区间：相邻图块以重叠带的中线为界"""
+    ends = [min(length, s + tile_size) for s in starts]
+    cuts = [0] + [(starts[i + 1] + ends[i]) / 2 for i in range(len(starts) - 1)] + [length]
+    return list(zip(cuts[:-1], cuts[1:]))
+
+
+def tile_grid(width, height, tile_size=DEFAULT_TILE_SIZE, overlap=DEFAULT_TILE_OVERLAP):
+    """
+    计算覆盖整幅影像的重叠图块
+    :param width: 影像宽度（像素）
+    :param height: 影像高度（像素）
+    :param tile_size: 图块边长（像素）
+    :param overlap: 相邻图块的重叠宽度（像素）
+    :return: Tile 列表（按行优先排列）
+    """
+    xs, ys = _axis_starts(width, tile_size, overlap), _axis_starts(height, tile_size, overlap)
+    x_cores, y_cores = _axis_cores(xs, width, tile_size), _axis_cores(ys, height, tile_size)
+    tiles = []
+    for row, (y0, (cy0, cy1)) in enumerate(zip(ys, y_cores)):
+        for col, (x0, (cx0, cx1)) in enumerate(zip(xs, x_cores)):
+            tiles.append(Tile(f"r{row:02d}c{col:02d}", x0, y0, min(width, x0 + tile_size),
+                              min(height, y0 + tile_size), (cx0, cy0, cx1, cy1)))
+    return tiles
+
+
+def write_tile(mosaic, tile, output_dir, quality=TILE_QUALITY):
+    """
+    把图块保存为 JPEG（已存在且比影像新时直接复用，重复运行可命中上传 / 响应缓存）
+    :return: 图块文件路径
+    """
+    stem = os.path.splitext(os.path.basename(mosaic.path))[0]
+    path = os.path.join(output_dir, stem, f"{stem}_{tile.name}.jpg")
+    if os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(mosaic.path):
+        return path
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + f".{threading.get_ident()}.tmp"
+    mosaic.crop(tile.x0, tile.y0, tile.x1, tile.y1).save(tmp_path, format="JPEG", quality=quality)
+    os.replace(tmp_path, path)
+    return path
+
+
+def _to_global(points, tile, width, height):
+    """图块内归一化坐标 -> 整幅影像像素坐标"""
+    tw, th = tile.x1 - tile.x0, tile.y1 - tile.y0
+    return [(tile.x0 + x * tw, tile.y0 + y * th) for x, y in points or []]
+
+
+def _in_core(point, core, width, height):
+    """点是否归属该图块：核心区间左闭右开，影像最右 / 最下边界归属最后一块"""
+    x, y = point
+    cx0, cy0, cx1, cy1 = core
+    return (cx0 <= x < cx1 or (cx1 == width and x == width)) and (cy0 <= y < cy1 or (cy1 == height and y == height))
+
+
+def _seam_chain(polygon, axis, value):
+    """
+    逆时针多边形在接缝（axis 坐标 = value 的直线）上的唯一一段边
+    :return: (接缝区间 (lo, hi), 去掉该段后从段尾到段首的顶点链, 内部是否在接缝的低坐标一侧)；
+             与接缝不相接或相接多段时返回 None
+    """
+    n = len(polygon)
+    on = [abs(p[axis] - value) <= SEAM_EPS for p in polygon]
+    if all(on):
+        return None
+    # 接缝上连续顶点的段：段首的前一个顶点不在接缝上
+    starts = [i for i in range(n) if on[i] and not on[i - 1]]
+    if len(starts) != 1:
+        return None
+    start = end = starts[0]
+    while on[(end + 1) % n]:
+        end = (end + 1) % n
+    if end == start:
+        return None
+    chain = [polygon[(end + k) % n] for k in range((start - end) % n + 1)]
+    along = [polygon[(start + k) % n][1 - axis] for k in range((end - start) % n + 1)]
+    # 逆时针行进时内部在左侧：竖直接缝上向 +y 行进 / 水平接缝上向 -x 行进时内部在低坐标一侧
+    ascending = along[-1] > along[0]
+    return (min(along), max(along)), chain, ascending if axis == 0 else not ascending
+
+
+def _signed_area(polygon):
+    return sum(x0 * y1 - x1 * y0 for (x0, y0), (x1, y1) in zip(polygon, polygon[1:] + polygon[:1])) / 2
+
+
+def _join_across_seam(first, second, axis, value):
+    """
+    沿接缝拼接内部分居接缝两侧的两个逆时针多边形
+    :return: 拼接后的多边形；不在两侧或在接缝上的边不重叠时返回 None
+    """
+    a, b = _seam_chain(first, axis, value), _seam_chain(second, axis, value)
+    if a is None or b is None or a[2] == b[2]:
+        return None
+    (a_lo, a_hi), a_chain, _ = a
+    (b_lo, b_hi), b_chain, _ = b
+    if min(a_hi, b_hi) - max(a_lo, b_lo) <= SEAM_EPS:
+        return None
+    joined = []
+    for point in a_chain + b_chain:
+        if not joined or abs(point[0] - joined[-1][0]) > SEAM_EPS or abs(point[1] - joined[-1][1]) > SEAM_EPS:
+            joined.append(point)
+    return joined
+
+
+def _seams(tiles, width, height):
+    """各图块核心区域之间的接缝：[(坐标轴, 坐标值)]"""
+    xs = {tile.core[2] for tile in tiles if tile.core[2] < width}
+    ys = {tile.core[3] for tile in tiles if tile.core[3] < height}
+    return [(0, x) for x in sorted(xs)] + [(1, y) for y in sorted(ys)]
+
+
+def _merge_across_seams(fragments, seams):
+    """
+    拼接被接缝切开的同一区域（逐条接缝处理，只比较在该接缝上有边的片段；直到一轮内没有新的拼接）
+    :param fragments: [{"zone": 原 zone, "polygon": 全局像素坐标（逆时针）, "fire_points": [...], "order": 序号}]
+    :return: (拼接后的片段列表, 拼接次数)
+    """
+    joins, changed = 0, True
+    while changed:
+        changed = False
+        for axis, value in seams:
+            # 在接缝上有边的片段，按内部所在侧分组
+            sides = ([], [])
+            for fragment in fragments:
+                seam = _seam_chain(fragment["polygon"], axis, value)
+                if seam is not None:
+                    sides[seam[2]].append(fragment)
+            removed = set()
+            for first in sides[0]:
+                # 每个片段在一轮中至多拼接一次（拼接后接缝上的边已改变，下一轮重新计算）
+                for second in sides[1]:
+                    if id(second) in removed or first["zone"].get("risk_level") != second["zone"].get("risk_level"):
+                        continue
+                    polygon = _join_across_seam(first["polygon"], second["polygon"], axis, value)
+                    if polygon is None:
+                        continue
+                    first["polygon"] = polygon
+                    first["fire_points"] = first["fire_points"] + second["fire_points"]
+                    # 拼接结果沿用行优先顺序中较早片段的 zone 属性（id / 理由等）
+                    if second["order"] < first["order"]:
+                        first["zone"], first["order"] = second["zone"], second["order"]
+                    removed.add(id(second))
+                    joins += 1
+                    break
+            if removed:
+                fragments = [f for f in fragments if id(f) not in removed]
+                changed = True
+    return fragments, joins
+
+
+def merge_tile_zones(tile_results, width, height, dedupe_px=DEFAULT_DEDUPE_PX):
+    """
+    把各图块的 zone 合并为整幅影像的 zone 列表
+    :param tile_results: [(Tile, zones)]，zones 为图块内归一化坐标
+    :param width: 影像宽度（像素）
+    :param height: 影像高度（像素）
+    :param dedupe_px: 火点去重半径（像素），0 表示不去重
+    :return: (zones, 去重丢弃的火点数, 跨接缝拼接次数)
+    """
+    fragments = []
+    seen = {}  # 去重网格：(gx, gy) -> [已保留火点]
+    dropped = 0
+    cell = max(dedupe_px, 1)
+
+    def is_duplicate(x, y):
+        gx, gy = int(x // cell), int(y // cell)
+        for nx in (gx - 1, gx, gx + 1):
+            for ny in (gy - 1, gy, gy + 1):
+                for px, py in seen.get((nx, ny), ()):
+                    if (px - x) ** 2 + (py - y) ** 2 <= dedupe_px ** 2:
+                        return True
+        seen.setdefault((gx, gy), []).append((x, y))
+        return False
+
+    for tile, zones in tile_results:
+        for zone in zones or []:
+            polygon = clip_polygon_to_box(_to_global(zone.get("coordinates"), tile, width, height), tile.core)
+            if len(polygon) < 3:
+                continue
+            if _signed_area(polygon) < 0:
+                polygon = polygon[::-1]
+            fire_points = []
+            for x, y in _to_global(zone.get("fire_points"), tile, width, height):
+                if not _in_core((x, y), tile.core, width, height):
+                    continue
+                if dedupe_px and is_duplicate(x, y):
+                    dropped += 1
+                    continue
+                fire_points.append([round(x / width, 6), round(y / height, 6)])
+            fragments.append({
+                "zone": {**zone, "id": f"{tile.name}-{zone.get('id', len(fragments))}"},
+                "polygon": polygon,
+                "fire_points": fire_points,
+                "order": len(fragments),
+            })
+
+    fragments, joins = _merge_across_seams(fragments, _seams([tile for tile, _ in tile_results], width, height))
+    merged = [{
+        **fragment["zone"],
+        "coordinates": [[round(x / width, 6), round(y / height, 6)] for x, y in fragment["polygon"]],
+        "fire_points": fragment["fire_points"],
+    } for fragment in sorted(fragments, key=lambda f: f["order"])]
+    return merged, dropped, joins
+
+
+def analyze_mosaic(vision, path, tiles_dir, tile_size=DEFAULT_TILE_SIZE, overlap=DEFAULT_TILE_OVERLAP,
+                   max_workers=4, dedupe_px=DEFAULT_DEDUPE_PX):
+    """
+    分块分析一幅大影像
+    :param vision: VisionAnalyzer 实例（每个图块调用一次 analyze_scene，复用其缓存 / 限速 / 重试）
+    :param path: 影像路径（.npy 或图片）
+    :param tiles_dir: 图块 JPEG 的保存目录
+    :param max_workers: 并行分析的图块数（同时也是内存中图块数的上限）
+    :return: 整幅影像的 zone 列表；全部图块失败时为 []（无火情、被预筛跳过的图块不算失败）
+    """
+    mosaic = Mosaic(path)
+    try:
+        tiles = tile_grid(mosaic.width, mosaic.height, tile_size, overlap)
+        print(f"   [Tiling] {os.path.basename(path)}: {mosaic.width}x{mosaic.height}px，"
+              f"切分为 {len(tiles)} 个 {tile_size}px 图块（重叠 {overlap}px）")
+
+        def analyze_tile(tile):
+            with vision.metrics.stage("tile", os.path.basename(path)):
+                tile_path = write_tile(mosaic, tile, tiles_dir)
+            return (tile, *vision.analyze_scene_status(tile_path))
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            tile_results = list(executor.map(analyze_tile, tiles))
+    finally:
+        mosaic.close()
+
+    failed = sum(1 for _, _, ok in tile_results if not ok)
+    if failed == len(tile_results):
+        return []
+    if failed:
+        print(f"   [Tiling Warning] {os.path.basename(path)}: {failed}/{len(tiles)} 个图块分析失败，结果不完整")
+    zones, dropped, joins = merge_tile_zones([(tile, zones) for tile, zones, _ in tile_results],
+                                             mosaic.width, mosaic.height, dedupe_px)
+    print(f"   [Tiling] {os.path.basename(path)}: 合并为 {len(zones)} 个区域（跨接缝拼接 {joins} 次），"
+          f"去除重叠区重复火点 {dropped} 个")
+    return zones
+
+
+def iter_mosaics(vision, paths, tiles_dir, **options):
+    """逐幅分块分析，产出 (影像路径, zones)，与 VisionAnalyzer.iter_analyze 的产出格式一致"""
+    for path in paths:
+        try:
+            yield path, analyze_mosaic(vision, path, tiles_dir, **options)
+        except Exception as e:
+            print(f"   [Tiling Error] {os.path.basename(path)}: {e}")
+            yield path, []
+
+
+def add_tiling_arguments(parser):
+    """为入口脚本添加分块分析相关的命令行参数"""
+    parser.add_argument("--mosaic", nargs="+", default=None,
+                        help="分块分析的大幅正射影像（.npy 内存映射读取，或 Pillow 支持的图片），指定时不扫描 temp/")
+    parser.add_argument("--tile-size", type=int, default=DEFAULT_TILE_SIZE,
+                        help=f"图块边长/像素（默认 {DEFAULT_TILE_SIZE}）")
+    parser.add_argument("--tile-overlap", type=int, default=DEFAULT_TILE_OVERLAP,
+                        help=f"相邻图块的重叠宽度/像素（默认 {DEFAULT_TILE_OVERLAP}）")
+    parser.add_argument("--tile-dedupe", type=float, default=DEFAULT_DEDUPE_PX,
+                        help=f"重叠区火点去重半径/像素（默认 {DEFAULT_DEDUPE_PX}，0 表示不去重）")
+
+
+def convert_to_npy(image_path, npy_path, rows_per_strip=1024):
+    """把图片转换为 .npy（逐条带写入内存映射文件；解码本身仍需完整读入一次）"""
+    Image.MAX_IMAGE_PIXELS = None
+    with Image.open(image_path) as img:
+        img = img.convert("RGB")
+        width, height = img.size
+        out = np.lib.format.open_memmap(npy_path, mode="w+", dtype=np.uint8, shape=(height, width, 3))
+        for y in range(0, height, rows_per_strip):
+            out[y:y + rows_per_strip] = np.asarray(img.crop((0, y, width, min(height, y + rows_per_strip))))
+        out.flush()
+    return width, height
+
+
+if __name__ == '__main__':
+    # 用法：python -m tools.tiling <正射影像> <输出.npy>
+    if len(sys.argv) != 3:
+        print("用法: python -m tools.tiling <mosaic.tif|jpg|png> <output.npy>")
+        sys.exit(1)
+
+    w, h = convert_to_npy(sys.argv[1], sys.argv[2])
+    print(f"💾 已转换 {w}x{h}px 影像至: {sys.argv[2]}")
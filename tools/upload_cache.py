@@ -0,0 +1,120 @@
+"""
+图片上传缓存（按内容寻址）
+以图片内容的 SHA-256 为 key，持久化保存 client.files.upload 返回的文件句柄及其过期时间。
+同一张图片在服务端文件未过期前重复运行时直接复用句柄，跳过上传。
+"""
+import os
+import json
+import hashlib
+import threading
+from datetime import datetime, timedelta, timezone
+from google.genai import types
+
+# 过期前预留的安全余量，避免句柄在请求途中失效
+EXPIRY_MARGIN = timedelta(minutes=10)
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    """计算文件内容的 SHA-256 十六进制摘要"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class UploadCache:
+    def __init__(self, cache_path):
+        """
+        初始化上传缓存
+        :param cache_path: 缓存 JSON 文件路径
+        """
+        self.cache_path = cache_path
+        self._lock = threading.Lock()
+        self._entries = self._load()
+        self.evict_expired()
+
+    def _load(self):
+        if not os.path.exists(self.cache_path):
+            return {}
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            # 缓存损坏时直接丢弃，不影响主流程
+            return {}
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.cache_path) or ".", exist_ok=True)
+        tmp_path = self.cache_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._entries, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.cache_path)
+
+    @staticmethod
+    def _is_valid(entry, now=None):
+        expiration = entry.get("expiration_time")
+        if not expiration:
+            return False
+        now = now or datetime.now(timezone.utc)
+        return datetime.fromisoformat(expiration) - EXPIRY_MARGIN > now
+
+    def evict_expired(self):
+        """清理所有已过期（或即将过期）的条目"""
+        with self._lock:
+            now = datetime.now(timezone.utc)
+            expired = [k for k, v in self._entries.items() if not self._is_valid(v, now)]
+            for key in expired:
+                del self._entries[key]
+            if expired:
+                self._save()
+        return len(expired)
+
+    def get(self, sha256):
+        """查询有效的文件句柄，不存在或已过期返回 None"""
+        with self._lock:
+            entry = self._entries.get(sha256)
+            if entry is None:
+                return None
+            if not self._is_valid(entry):
+                del self._entries[sha256]
+                self._save()
+                return None
+            return types.File(
+                name=entry["name"],
+                uri=entry["uri"],
+                mime_type=entry["mime_type"],
+                display_name=entry.get("display_name"),
+            )
+
+    def put(self, sha256, file):
+        """记录上传返回的文件句柄（无过期时间的句柄不缓存）"""
+        if file.expiration_time is None:
+            return
+        expiration = file.expiration_time
+        if expiration.tzinfo is None:
+            expiration = expiration.replace(tzinfo=timezone.utc)
+        with self._lock:
+            self._entries[sha256] = {
+                "name": file.name,
+                "uri": file.uri,
+                "mime_type": file.mime_type,
+                "display_name": file.display_name,
+                "expiration_time": expiration.isoformat(),
+            }
+            self._save()
+
+    def upload(self, client, path):
+        """
+        带缓存的上传：命中则复用句柄，否则调用 client.files.upload 并记录
+        :return: (文件句柄, 是否命中缓存)
+        """
+        # 替身 Client 的句柄（fake://）以 Client 种类为前缀，不会被真实运行复用
+        kind = getattr(client, "kind", "gemini")
+        sha256 = file_sha256(path) if kind == "gemini" else f"{kind}:{file_sha256(path)}"
+        cached = self.get(sha256)
+        if cached is not None:
+            return cached, True
+        uploaded = client.files.upload(file=path)
+        self.put(sha256, uploaded)
+        return uploaded, False
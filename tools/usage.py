@@ -0,0 +1,51 @@
+"""
+Token 用量统计
+从响应的 usage_metadata 中读取输入 / 输出 / 缓存命中 token 数，并记录每次请求的耗时，
+用于比较不同 Prompt 编码（如 JSON 与紧凑表格）的输入 token 与延迟。
+"""
+import threading
+
+
+class UsageTracker:
+    def __init__(self):
+        """线程安全的 token 用量与延迟累计器"""
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.output_tokens = 0
+        self.cached_tokens = 0
+        self.latencies = []
+
+    def record(self, response, latency=None):
+        """
+        记录一次响应
+        :param response: 带 usage_metadata 的响应对象（缺失时只记录耗时）
+        :param latency: 请求耗时（秒）
+        :return: 本次的 (输入, 输出, 缓存) token 数
+        """
+        usage = getattr(response, "usage_metadata", None)
+        prompt = getattr(usage, "prompt_token_count", None) or 0
+        output = getattr(usage, "candidates_token_count", None) or 0
+        cached = getattr(usage, "cached_content_token_count", None) or 0
+        with self._lock:
+            self.requests += 1
+            self.prompt_tokens += prompt
+            self.output_tokens += output
+            self.cached_tokens += cached
+            if latency is not None:
+                self.latencies.append(latency)
+        return prompt, output, cached
+
+    def mean_latency(self):
+        with self._lock:
+            return sum(self.latencies) / len(self.latencies) if self.latencies else None
+
+    def summary(self):
+        """一行用量统计"""
+        if not self.requests:
+            return "无模型请求"
+        latency = self.mean_latency()
+        latency_text = f"，平均耗时 {latency:.2f}s" if latency is not None else ""
+        return (f"{self.requests} 次请求，输入 {self.prompt_tokens} tokens"
+                f"（平均 {self.prompt_tokens / self.requests:.0f}/次，缓存命中 {self.cached_tokens}），"
+                f"输出 {self.output_tokens} tokens{latency_text}")
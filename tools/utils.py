@@ -1,12 +1,31 @@
 """
 初始化gemini.Client 对象的工具函数
 包括读取api key 和 配置代理（默认7897端口，挂梯子使用）
+也可以创建本地替身 Client（tools/fake_client.py），离线回放已记录的响应；
+替身运行的输出与缓存写入单独的子目录（out/fake/、cache/fake/），不覆盖被回放的记录，也不与真实运行共用缓存
 """
 import os
 from google import genai
+from google.genai import types
+
+CLIENT_KINDS = ["gemini", "fake"]
+# 替身 Client 的输出 / 缓存子目录
+FAKE_SUBDIR = "fake"
+
+def setup_client(kind="gemini", timeout=None, **fake_options):
+    """
+    创建 Client 对象
+    :param kind: gemini 读取 Key 并配置代理，返回真实 Client；fake 返回本地替身 Client
+    :param timeout: 真实 Client 的 HTTP 请求超时（秒），None 表示使用 SDK 默认值；
+                    与调用层超时一致时，被调用层放弃的请求会在 SDK 内部按时结束而不是占用线程
+    :param fake_options: 传给 FakeGeminiClient 的参数（latency / error_rate / seed 等）
+    """
+    if kind == "fake":
+        from tools.fake_client import FakeGeminiClient
+        print(f"✅ [System] 使用本地替身 Client（回放 out/ 中的已记录响应，结果与缓存写入 out/{FAKE_SUBDIR}/ 与 "
+              f"cache/{FAKE_SUBDIR}/）")
+        return FakeGeminiClient(**fake_options)
 
-def setup_client():
-    """读取 Key 并配置代理，返回 Client 对象"""
     # 1. 读取 API Key， 保存在 Key.txt 中
     base_dir = os.path.dirname(os.path.abspath(__file__))
     key_path = os.path.join(base_dir, "Key.txt")
@@ -24,4 +43,35 @@ def setup_client():
     os.environ["HTTPS_PROXY"] = proxy_url
     
     print(f"✅ [System] 客户端已初始化 (Proxy: {proxy_port})")
-    return genai.Client(api_key=api_key)
\ No newline at end of file
+    http_options = types.HttpOptions(timeout=int(timeout * 1000)) if timeout else None
+    return genai.Client(api_key=api_key, http_options=http_options)
+
+def add_client_arguments(parser):
+    """为入口脚本添加 Client 相关的命令行参数"""
+    parser.add_argument("--client", choices=CLIENT_KINDS, default="gemini",
+                        help="gemini 调用真实 API；fake 使用本地替身回放 out/ 中的已记录响应（不消耗配额，"
+                             "输出与缓存写入 out/fake/、cache/fake/）")
+    parser.add_argument("--fake-latency", default=None,
+                        help="替身 Client 的请求耗时分布/秒，如 const:0.5、uniform:0.2,1.5、lognormal:1.0,0.5、exp:0.8")
+    parser.add_argument("--fake-error-rate", type=float, default=0.0,
+                        help="替身 Client 每次请求返回 429/503 的概率（默认 0）")
+
+def create_client(args):
+    """根据命令行参数创建 Client"""
+    return setup_client(args.client, timeout=getattr(args, "timeout", None),
+                        latency=args.fake_latency, error_rate=args.fake_error_rate)
+
+def client_kind(client):
+    """Client 的种类（gemini / fake），用于区分缓存 key"""
+    return getattr(client, "kind", "gemini")
+
+def isolate_path(path, kind):
+    """
+    替身 Client 的输出与缓存路径：out/x -> out/fake/x，cache/x -> cache/fake/x；真实 Client 原样返回
+    :param path: 默认的输出文件 / 缓存路径
+    :param kind: Client 种类（命令行参数 --client）
+    """
+    if kind != "fake":
+        return path
+    parent, name = os.path.split(path)
+    return os.path.join(parent, FAKE_SUBDIR, name)
@@ -1,51 +1,80 @@
 """
 可视化分割结果
 将分割结果绘制在图像上，并保存可视化结果。
-输入：分割结果字符串，图像路径（可选）
+输入：分割结果（zones 列表或其字符串形式），图像路径（可选）
+支持两种绘制后端：
+- matplotlib：带图例与标题的高质量输出（默认）
+- pillow：基于 ImageDraw 的轻量绘制，速度快，可限制输出尺寸
+并提供基于进程池的批量渲染接口，避免阻塞模型调用。
+渲染在子进程中计时，耗时随结果返回主进程并记录到可选的 RunMetrics（render 阶段）。
 """
 import json
 import ast
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
+import matplotlib
+matplotlib.use("Agg")  # 仅保存文件，使用无界面后端（进程池中也可安全绘制）
 import matplotlib.pyplot as plt
 import matplotlib.patches as patches
-from PIL import Image
+from PIL import Image, ImageDraw
 
-def visualize_segmentation_on_image(data_str, image_path=None):
-    # --- 1. 解析数据 ---
+RISK_COLORS = {'High': '#FF4500', 'Medium': '#FFA500', 'Low': '#FFD700', 'default': '#808080'}
+
+# pillow 后端默认的输出最长边（像素）
+DEFAULT_MAX_SIZE = 1280
+
+
+def parse_zones(data_str):
+    """解析 zones 字符串（JSON 或 Python 字面量），失败返回 None"""
     try:
         # 直接解析为 zones 列表，不再进行字典/列表格式判断
-        zones = json.loads(data_str)
+        return json.loads(data_str)
     except:
         try:
-            zones = ast.literal_eval(data_str)
+            return ast.literal_eval(data_str)
         except:
-            return
+            return None
+
 
-    # --- 2. 加载图像  ---
+def _load_image(image_path, max_size=None):
+    """加载图像，失败时返回浅灰色占位图；指定 max_size 时 JPEG 直接按缩小比例解码"""
     try:
         if image_path and os.path.exists(image_path):
-            img_arr = np.array(Image.open(image_path))
+            img = Image.open(image_path)
+            if max_size:
+                img.draft("RGB", (max_size, max_size))
+            return img.convert("RGB")
         else:
             raise Exception
     except:
-        img_arr = np.ones((1080, 1920, 3), dtype=np.uint8) * 240
-    
+        return Image.new("RGB", (1920, 1080), (240, 240, 240))
+
+
+def output_path_for(image_path=None, output_dir=None):
+    """可视化结果保存路径：默认保存在图像同级的 output/ 目录下"""
+    save_dir = output_dir or os.path.join(os.path.dirname(image_path) if image_path else '.', "output")
+    os.makedirs(save_dir, exist_ok=True)
+    return os.path.join(save_dir, f"{os.path.splitext(os.path.basename(image_path) if image_path else 'result')[0]}_visualized.png")
+
+
+def render_zones_matplotlib(zones, image_path=None, save_path=None, dpi=300):
+    """matplotlib 后端：绘制区域多边形、标签、火点与图例"""
+    img_arr = np.array(_load_image(image_path))
     h, w = img_arr.shape[:2]
 
-    # --- 3. 核心绘图 ---
+    # --- 核心绘图 ---
     fig, ax = plt.subplots(figsize=(12, 10))
     ax.imshow(img_arr)
     
-    risk_colors = {'High': '#FF4500', 'Medium': '#FFA500', 'Low': '#FFD700', 'default': '#808080'}
-    
     # 收集图例句柄
     legend_map = {}
 
     if isinstance(zones, list):
         for zone in zones:
             risk = zone.get('risk_level', 'default')
-            color = risk_colors.get(risk, risk_colors['default'])
+            color = RISK_COLORS.get(risk, RISK_COLORS['default'])
             
             # 绘制区域
             if 'coordinates' in zone:
@@ -66,18 +95,156 @@ def visualize_segmentation_on_image(data_str, image_path=None):
                 sc = ax.scatter(fps[:, 0], fps[:, 1], c='red', marker='x', s=80, linewidths=2, zorder=10)
                 legend_map['Fire Point'] = sc
 
-    # --- 4. 装饰与保存 ---
+    # --- 装饰与保存 ---
     ax.axis('off')
     ax.set_title(f"Fire Risk Analysis: {os.path.basename(image_path) if image_path else 'Generated'}")
     if legend_map:
         ax.legend(legend_map.values(), legend_map.keys(), loc='upper right', framealpha=0.9)
     
-    save_dir = os.path.join(os.path.dirname(image_path) if image_path else '.', "output")
-    os.makedirs(save_dir, exist_ok=True)
-    save_path = os.path.join(save_dir, f"{os.path.splitext(os.path.basename(image_path) if image_path else 'result')[0]}_visualized.png")
-    
-    plt.savefig(save_path, dpi=300, bbox_inches='tight')
-    plt.close()
+    save_path = save_path or output_path_for(image_path)
+    plt.savefig(save_path, dpi=dpi, bbox_inches='tight')
+    plt.close(fig)
+    return save_path
+
+
+def render_zones_pillow(zones, image_path=None, save_path=None, max_size=DEFAULT_MAX_SIZE):
+    """pillow 后端：在缩放后的图像上直接绘制半透明区域、标签与火点"""
+    img = _load_image(image_path, max_size)
+    if max_size and max(img.size) > max_size:
+        img.thumbnail((max_size, max_size), Image.BILINEAR)
+    w, h = img.size
+
+    overlay = Image.new("RGBA", img.size, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(overlay)
+    marker = max(4, round(max(w, h) / 160))
+
+    if isinstance(zones, list):
+        # 先画半透明填充与边框
+        for zone in zones:
+            color = RISK_COLORS.get(zone.get('risk_level', 'default'), RISK_COLORS['default'])
+            pts = [(x * w, y * h) for x, y in zone.get('coordinates') or []]
+            if len(pts) >= 3:
+                draw.polygon(pts, fill=color + "4D", outline=color)
+                draw.line(pts + pts[:1], fill=color, width=2)
+
+        # 再画标签与火点，避免被其他区域的填充覆盖
+        for zone in zones:
+            risk = zone.get('risk_level', 'default')
+            color = RISK_COLORS.get(risk, RISK_COLORS['default'])
+            pts = np.array([(x * w, y * h) for x, y in zone.get('coordinates') or []])
+            if len(pts) > 0:
+                cx, cy = pts[:, 0].mean(), pts[:, 1].mean()
+                label = f"{zone.get('id', '')}\n{risk}"
+                box = draw.multiline_textbbox((cx, cy), label, anchor="mm", align="center")
+                draw.rectangle((box[0] - 2, box[1] - 2, box[2] + 2, box[3] + 2), fill=color + "CC")
+                draw.multiline_text((cx, cy), label, fill="white", anchor="mm", align="center")
+            for x, y in zone.get('fire_points') or []:
+                px, py = x * w, y * h
+                draw.line((px - marker, py - marker, px + marker, py + marker), fill="red", width=2)
+                draw.line((px - marker, py + marker, px + marker, py - marker), fill="red", width=2)
+
+    result = Image.alpha_composite(img.convert("RGBA"), overlay).convert("RGB")
+    save_path = save_path or output_path_for(image_path)
+    result.save(save_path, compress_level=1)
+    return save_path
+
+
+def visualize_zones(zones, image_path=None, backend="matplotlib", output_dir=None,
+                    max_size=DEFAULT_MAX_SIZE, dpi=300):
+    """
+    绘制并保存单张图像的分割结果
+    :param zones: zone 列表
+    :param image_path: 原图路径（可选）
+    :param backend: "matplotlib" 或 "pillow"
+    :param output_dir: 输出目录，默认图像同级的 output/
+    :param max_size: pillow 后端的输出最长边
+    :param dpi: matplotlib 后端的保存分辨率
+    :return: 保存路径
+    """
+    save_path = output_path_for(image_path, output_dir)
+    if backend == "pillow":
+        return render_zones_pillow(zones, image_path, save_path, max_size=max_size)
+    return render_zones_matplotlib(zones, image_path, save_path, dpi=dpi)
+
+
+def visualize_segmentation_on_image(data_str, image_path=None):
+    # --- 1. 解析数据 ---
+    zones = parse_zones(data_str)
+    if zones is None:
+        return
+
+    # --- 2. 绘制并保存 ---
+    return render_zones_matplotlib(zones, image_path)
+
+
+def _render_job(args):
+    """子进程任务：返回 (保存路径, 渲染耗时)，失败时路径为 None"""
+    zones, image_path, options = args
+    start = time.monotonic()
+    try:
+        save_path = visualize_zones(zones, image_path, **options)
+    except Exception as e:
+        print(f"   ⚠️ 可视化失败 ({image_path}): {e}")
+        save_path = None
+    return save_path, time.monotonic() - start
+
+
+def _record_render(metrics, image_path, result):
+    if metrics is not None:
+        metrics.observe("render", result[1], os.path.basename(image_path) if image_path else None)
+    return result[0]
+
+
+class BatchRenderer:
+    def __init__(self, max_workers=None, metrics=None, **options):
+        """
+        基于进程池的异步渲染器（提交后立即返回，不阻塞调用方）
+        :param max_workers: 进程数，None 表示使用 CPU 核数
+        :param metrics: 可选的 RunMetrics，记录每张图的渲染耗时
+        :param options: 传给 visualize_zones 的参数（backend / output_dir / max_size / dpi）
+        """
+        self.options = options
+        self.metrics = metrics
+        self._executor = ProcessPoolExecutor(max_workers=max_workers)
+        self._futures = []
+        # 立即启动工作进程，使 fork 发生在调用方创建请求线程之前
+        self._executor.submit(int).result()
+
+    def submit(self, zones, image_path=None):
+        """提交单张图像的渲染任务，返回 Future（结果为保存路径）"""
+        future = self._executor.submit(_render_job, (zones, image_path, self.options))
+        self._futures.append((image_path, future))
+        return future
+
+    def close(self, cancel=False):
+        """
+        等待渲染任务完成并关闭进程池
+        :param cancel: 取消尚未开始的任务并忽略渲染错误（中断或出错时使用，不掩盖原始异常）
+        """
+        self._executor.shutdown(wait=True, cancel_futures=cancel)
+        return [_record_render(self.metrics, path, f.result()) for path, f in self._futures
+                if not f.cancelled() and not (cancel and f.exception() is not None)]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def render_batch(items, max_workers=None, metrics=None, **options):
+    """
+    批量渲染
+    :param items: 可迭代的 (zones, image_path)
+    :param max_workers: 进程数
+    :param metrics: 可选的 RunMetrics，记录每张图的渲染耗时
+    :param options: 传给 visualize_zones 的参数
+    :return: 保存路径列表（失败项为 None）
+    """
+    jobs = [(zones, path, options) for zones, path in items]
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return [_record_render(metrics, job[1], result) for job, result in zip(jobs, executor.map(_render_job, jobs))]
+
 
 if __name__ == '__main__':
     
@@ -87,7 +254,5 @@ if __name__ == '__main__':
     with open(json_path, 'r', encoding='utf-8') as f:
         all_zones_data = json.load(f)
     
-    for file_name, zones in all_zones_data.items():
-        image_path = os.path.join(image_dir, file_name)
-        visualize_segmentation_on_image(str(zones), image_path)
-        
\ No newline at end of file
+    render_batch((zones, os.path.join(image_dir, file_name))
+                 for file_name, zones in all_zones_data.items() if zones)
@@ -0,0 +1,52 @@
+"""
+Step 1 结构化输出的响应 Schema
+与 data/prompts.py 中 task_prompt_json 约定的 zone 格式一致：
+id / risk_level（High、Low、Monitor 枚举）/ coordinates / fire_points 必填，reason / boundary_description 可选。
+配合 response_mime_type="application/json" 使用，模型只能输出符合 Schema 的 JSON。
+"""
+from google.genai import types
+
+RISK_LEVELS = ["High", "Low", "Monitor"]
+JSON_MIME_TYPE = "application/json"
+
+
+def _point_list():
+    # [[x, y], ...]，坐标为 0~1 归一化值
+    point = types.Schema(type=types.Type.ARRAY, items=types.Schema(type=types.Type.NUMBER), min_items=2, max_items=2)
+    return types.Schema(type=types.Type.ARRAY, items=point)
+
+
+def zone_schema():
+    """单个 zone 的 Schema"""
+    return types.Schema(
+        type=types.Type.OBJECT,
+        properties={
+            "id": types.Schema(type=types.Type.STRING),
+            "risk_level": types.Schema(type=types.Type.STRING, enum=RISK_LEVELS),
+            "coordinates": _point_list(),
+            "fire_points": _point_list(),
+            "reason": types.Schema(type=types.Type.STRING),
+            "boundary_description": types.Schema(type=types.Type.STRING),
+        },
+        required=["id", "risk_level", "coordinates", "fire_points"],
+        property_ordering=["id", "risk_level", "coordinates", "fire_points", "reason", "boundary_description"],
+    )
+
+
+def zone_list_schema():
+    """单图请求的响应：zone 列表"""
+    return types.Schema(type=types.Type.ARRAY, items=zone_schema())
+
+
+def batch_zone_schema(names):
+    """多图批量请求的响应：{图像名称: zone 列表}，每个图像名称都是必填字段"""
+    return types.Schema(
+        type=types.Type.OBJECT,
+        properties={name: zone_list_schema() for name in names},
+        required=list(names),
+    )
+
+
+def structured_config(config, schema):
+    """返回附带 JSON 响应类型与 Schema 的配置副本"""
+    return config.model_copy(update={"response_mime_type": JSON_MIME_TYPE, "response_schema": schema})